@@ -39,6 +39,7 @@ Note: changes are only reported for files (added/modified/deleted), not director
 '''
 import threading
 import sys
+import os
 try:
     from os import scandir
 except:
@@ -57,6 +58,16 @@ except:
         pass
 
 from collections import deque
+from stat import S_ISREG
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from .changelog import ChangeLog
+from .metrics import WatcherMetrics
+from .mounts import FilesystemPolicy
 
 import time
 
@@ -72,6 +83,207 @@ class Change(IntEnum):
     modified = 2
     deleted = 3
 
+    # Only reported for log files (see: `Watcher.log_file_patterns`): the size grew in the
+    # same file (the new data is from the old to the new size).
+    appended = 4
+
+    # Only reported for log files: the size shrank in the same file.
+    truncated = 5
+
+    # Only reported for log files: the path now refers to a different file (i.e.: the
+    # file was moved away and a new one was created in its place).
+    rotated = 6
+
+
+class FollowSymlinks(IntEnum):
+    '''
+    Policy for symlinks to directories (see: `Watcher.follow_symlinks`).
+    '''
+    never = 0
+
+    # Only symlinks whose target is inside some tracked path are followed.
+    within_roots = 1
+
+    always = 2
+
+
+class ChangeEvent(object):
+    '''
+    Change provided by `Watcher.iter_changes()` when `Watcher.rich_change_events` is True.
+
+    It may be unpacked (or compared) as the usual `(change, path)` tuple but also has the
+    stat information which was obtained while scanning (so, there's no need to `os.stat`
+    the path again).
+
+    Note: `mtime_ns` and `size` are None for `Change.deleted` and `old_mtime_ns` and
+    `old_size` are None for `Change.added`.
+    '''
+
+    __slots__ = ['change', 'path', 'mtime_ns', 'size', 'old_mtime_ns', 'old_size']
+
+    def __init__(self, change, path, mtime_ns=None, size=None, old_mtime_ns=None, old_size=None):
+        self.change = change
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.old_mtime_ns = old_mtime_ns
+        self.old_size = old_size
+
+    @property
+    def size_changed(self):
+        return self.size != self.old_size
+
+    def __iter__(self):
+        yield self.change
+        yield self.path
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        return (self.change, self.path)[i]
+
+    def __eq__(self, o):
+        if isinstance(o, ChangeEvent):
+            return (
+                self.change, self.path, self.mtime_ns, self.size, self.old_mtime_ns,
+                self.old_size) == (
+                o.change, o.path, o.mtime_ns, o.size, o.old_mtime_ns, o.old_size)
+
+        if isinstance(o, tuple):
+            return (self.change, self.path) == o
+
+        return False
+
+    def __ne__(self, o):
+        return not self == o
+
+    def __hash__(self):
+        return hash((self.change, self.path))
+
+    def __repr__(self):
+        return 'ChangeEvent(%r, %r, mtime_ns=%r, size=%r, old_mtime_ns=%r, old_size=%r)' % (
+            self.change, self.path, self.mtime_ns, self.size, self.old_mtime_ns, self.old_size)
+
+
+def _ignore_change(change, path, mtime, old_mtime):
+    pass
+
+
+def _decode_path(path):
+    '''
+    :param bytes path:
+
+    :return Optional[str]:
+        The decoded path (or None if it can't be decoded).
+    '''
+    try:
+        return path.decode(sys.getfilesystemencoding())
+    except UnicodeDecodeError:
+        try:
+            return path.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+
+
+def _get_modified_change(mtime, old_mtime):
+    '''
+    :param tuple mtime:
+        The new (st_mtime_ns, st_size) or, for log files, (st_mtime_ns, st_size, st_ino).
+
+    :return Change:
+        The change for a file found with a different mtime/size (appends, truncations
+        and rotations are only distinguished for log files).
+    '''
+    if len(mtime) < 3 or len(old_mtime) < 3:
+        return Change.modified
+    if mtime[2] != old_mtime[2]:
+        return Change.rotated
+    if mtime[1] > old_mtime[1]:
+        return Change.appended
+    if mtime[1] < old_mtime[1]:
+        return Change.truncated
+    return Change.modified
+
+
+def _create_log_file_filter(patterns, bytes_paths=False):
+    '''
+    :param Iterable[str] patterns:
+        The glob patterns for the names of log files (see: `Watcher.log_file_patterns`).
+
+    :return Optional[Callable[str, bool]]:
+        Returns whether a path is a log file (None if there are no patterns).
+    '''
+    if not patterns:
+        return None
+    import fnmatch
+    import re
+    regex = '|'.join('(?:%s)' % (fnmatch.translate(pattern),) for pattern in patterns)
+    if bytes_paths:
+        regex = os.fsencode(regex)
+    match = re.compile(regex).match
+    basename = os.path.basename
+
+    def is_log_file(path):
+        return match(basename(path)) is not None
+
+    return is_log_file
+
+
+def _create_append_change(changes, rich_change_events, decode_paths=False):
+    '''
+    :param bool decode_paths:
+        Whether the paths are bytes which must be decoded (see: `Watcher.bytes_paths`).
+
+    :return Callable[Change, str, Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        The function which `_PathWatcher._check` calls with the change, the path and the
+        new/old `(st_mtime_ns, st_size)` (which is None when not available).
+    '''
+    append = changes.append
+    if rich_change_events:
+
+        def append_change(change, path, mtime, old_mtime):
+            if mtime is None:
+                mtime = (None, None)
+            if old_mtime is None:
+                old_mtime = (None, None)
+            append(ChangeEvent(change, path, mtime[0], mtime[1], old_mtime[0], old_mtime[1]))
+
+    else:
+
+        def append_change(change, path, mtime, old_mtime):
+            append((change, path))
+
+    if decode_paths:
+        fsdecode = os.fsdecode
+        append_decoded = append_change
+
+        def append_change(change, path, mtime, old_mtime):
+            append_decoded(change, fsdecode(path), mtime, old_mtime)
+
+    return append_change
+
+
+class ScandirProvider(object):
+    '''
+    Provides directory listings and stat results from the filesystem (this is the default
+    provider used by `Watcher`).
+
+    Custom providers must implement the same methods:
+
+    `scandir(dir_path)`: returns an iterable with entries which provide `name`, `path`,
+        `is_dir()`, `is_symlink()` and `stat()` (as `os.DirEntry`) or raises OSError.
+
+    `stat(path)`: returns an object with `st_mtime_ns` and `st_size` (as `os.stat_result`)
+        or raises OSError.
+    '''
+
+    def scandir(self, dir_path):
+        return scandir(dir_path)
+
+    def stat(self, path):
+        return os.stat(path)
+
 
 class _SingleVisitInfo(object):
 
@@ -81,6 +293,482 @@ class _SingleVisitInfo(object):
         self.file_to_mtime = {}
         self.last_sleep_time = time.time()
 
+        # Set when a background initial scan is superseded (the scan is stopped early).
+        self.cancelled = False
+
+        # OSErrors ignored while scanning.
+        self.errors = 0
+
+        # Time slept for throttling.
+        self.throttle_sleep_time = 0.
+
+        # Set to a `fsnotify.profiler.ScanProfile` when profiling slow scans.
+        self.scan_profile = None
+
+        # (st_dev, st_ino) -> (dir_path, exact) for the directories visited (used to detect
+        # loops when symlinks are followed, see: `_PathWatcher._is_visited_dir`).
+        self.visited_dir_ids = {}
+
+        # Directories whose files were collapsed to a fingerprint (to limit the memory
+        # used by the snapshot, see: `Watcher.max_snapshot_entries`): dir -> fingerprint.
+        self.dir_to_fingerprint = {}
+
+        # The fingerprints from the previous scan (entries are popped while visiting).
+        self.old_dir_to_fingerprint = None
+
+        # Number of collapsed directories which were expanded because their
+        # fingerprint changed.
+        self.expanded_dirs = 0
+
+        # path -> (st_mtime_ns, st_size) used instead of stat'ing the file (only set in
+        # the initial scan, see: `Watcher.git_index_warm_start`).
+        self.seed_file_to_mtime = None
+
+
+def _create_fingerprint(files):
+    '''
+    :param Iterable[Tuple[str, Tuple[int, int]]] files:
+        The path and (st_mtime_ns, st_size) of the files in a directory.
+
+    :return Tuple[int, int, int]:
+        The number of files, the max mtime and a digest of all the paths/mtimes/sizes.
+    '''
+    count = 0
+    max_mtime_ns = 0
+    digest = 0
+    for path, mtime in files:
+        count += 1
+        if mtime[0] > max_mtime_ns:
+            max_mtime_ns = mtime[0]
+        digest = (digest + hash((path, mtime))) & 0xFFFFFFFFFFFFFFFF
+    return count, max_mtime_ns, digest
+
+
+def _check_collapsed_dir(dir_path, old_fingerprint, files, single_visit_info, append_change):
+    '''
+    Checks the files of a directory which was collapsed to a fingerprint: if the
+    fingerprint changed, the directory is expanded again (the files with an mtime newer
+    than the ones in the fingerprint are reported as modified).
+    '''
+    fingerprint = _create_fingerprint(files)
+    if fingerprint == old_fingerprint:
+        single_visit_info.dir_to_fingerprint[dir_path] = fingerprint
+        return
+
+    single_visit_info.expanded_dirs += 1
+    new_files = single_visit_info.file_to_mtime
+    old_max_mtime_ns = old_fingerprint[1]
+    for path, mtime in files:
+        new_files[path] = mtime
+        if mtime[0] > old_max_mtime_ns:
+            append_change(Change.modified, path, mtime, None)
+
+
+class ScanStats(object):
+    '''
+    Statistics on the scans done by `Watcher.iter_changes()` (see: `Watcher.scan_stats`).
+    '''
+
+    def __init__(self):
+        self.scans_completed = 0
+        self.total_scan_time = 0.
+        self.total_entries_scanned = 0
+        self.total_changes = 0
+
+        self.last_scan_time = 0.
+        self.last_entries_scanned = 0
+        self.last_files_found = 0
+
+    @property
+    def entries_per_second(self):
+        '''
+        :return float:
+            The entries scanned per second in the last scan.
+        '''
+        if self.last_scan_time <= 0:
+            return 0.
+        return self.last_entries_scanned / self.last_scan_time
+
+    def _on_scan(self, scan_time, entries_scanned, files_found, changes):
+        self.scans_completed += 1
+        self.total_scan_time += scan_time
+        self.total_entries_scanned += entries_scanned
+        self.total_changes += changes
+
+        self.last_scan_time = scan_time
+        self.last_entries_scanned = entries_scanned
+        self.last_files_found = files_found
+
+
+class InitialScan(object):
+    '''
+    Provides information on the initial snapshot of the tracked paths (which may be
+    built in a background thread if `Watcher.background_initial_scan` is True).
+
+    Note: `iter_changes()` only starts reporting changes after the initial scan is ready
+    (changes done while the initial scan is running are reported in the first scan
+    afterwards).
+    '''
+
+    def __init__(self, single_visit_info, roots_total):
+        self._single_visit_info = single_visit_info
+        self.ready = threading.Event()
+        self.roots_total = roots_total
+        self.roots_done = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+        # The snapshot is changed by the scans done afterwards, so, the counts are
+        # kept when it's ready.
+        self._final_counts = None
+
+    @property
+    def cancelled(self):
+        return self._single_visit_info.cancelled
+
+    def cancel(self):
+        self._single_visit_info.cancelled = True
+
+    def wait(self, timeout=None):
+        '''
+        :return bool:
+            True if the initial scan is ready and False if the timeout elapsed.
+        '''
+        return self.ready.wait(timeout)
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def _get_counts(self):
+        final_counts = self._final_counts
+        if final_counts is not None:
+            return final_counts
+        single_visit_info = self._single_visit_info
+        return (
+            single_visit_info.count,
+            len(single_visit_info.visited_dirs),
+            len(single_visit_info.file_to_mtime),
+        )
+
+    @property
+    def entries_scanned(self):
+        return self._get_counts()[0]
+
+    @property
+    def dirs_scanned(self):
+        return self._get_counts()[1]
+
+    @property
+    def files_found(self):
+        return self._get_counts()[2]
+
+    @property
+    def elapsed_time(self):
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.time()
+        return end_time - self.start_time
+
+    def _mark_ready(self, final_counts=None):
+        self._final_counts = final_counts if final_counts is not None else self._get_counts()
+        self.end_time = time.time()
+        self.ready.set()
+
+
+class ChangeBatch(object):
+    '''
+    Changes provided by `Watcher.iter_change_batches()` in a columnar form (the change
+    codes and stat information are kept in `array.array` instances, which may be wrapped
+    without copying by NumPy, i.e.: `numpy.frombuffer(batch.changes, dtype=numpy.uint8)`).
+    '''
+
+    __slots__ = ['paths', 'changes', 'mtime_ns', 'size', 'old_mtime_ns', 'old_size']
+
+    def __init__(self, paths, changes, mtime_ns=None, size=None, old_mtime_ns=None, old_size=None):
+        # List[str]
+        self.paths = paths
+
+        # array('B') with the `Change` value for each path.
+        self.changes = changes
+
+        # array('q') with the st_mtime_ns/st_size for each path (-1 for deleted files) or
+        # None if `Watcher.rich_change_events` is False.
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+        # array('q') with the previous st_mtime_ns/st_size for each path (-1 for added
+        # files) or None if `Watcher.rich_change_events` is False.
+        self.old_mtime_ns = old_mtime_ns
+        self.old_size = old_size
+
+    @classmethod
+    def from_changes(cls, changes):
+        '''
+        :param List[Tuple[Change, str]|ChangeEvent] changes:
+        '''
+        from array import array
+
+        paths = [change[1] for change in changes]
+        codes = array('B', [change[0] for change in changes])
+        if changes and isinstance(changes[0], ChangeEvent):
+            return cls(
+                paths, codes,
+                array('q', [-1 if c.mtime_ns is None else c.mtime_ns for c in changes]),
+                array('q', [-1 if c.size is None else c.size for c in changes]),
+                array('q', [-1 if c.old_mtime_ns is None else c.old_mtime_ns for c in changes]),
+                array('q', [-1 if c.old_size is None else c.old_size for c in changes]))
+        return cls(paths, codes)
+
+    @classmethod
+    def _create_empty(cls, rich_change_events):
+        from array import array
+
+        if rich_change_events:
+            return cls([], array('B'), array('q'), array('q'), array('q'), array('q'))
+        return cls([], array('B'))
+
+    def _create_append_change(self, decode_paths=False):
+        '''
+        :return Callable[Change, str, Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+            A function as the one from `_create_append_change` which appends the changes
+            directly to the columns of this batch (so, no object is created per change).
+        '''
+        append_path = self.paths.append
+        append_code = self.changes.append
+        if decode_paths:
+            fsdecode = os.fsdecode
+            append_encoded = append_path
+
+            def append_path(path):
+                append_encoded(fsdecode(path))
+
+        if self.mtime_ns is None:
+
+            def append_change(change, path, mtime, old_mtime):
+                append_path(path)
+                append_code(change)
+
+        else:
+            append_mtime_ns = self.mtime_ns.append
+            append_size = self.size.append
+            append_old_mtime_ns = self.old_mtime_ns.append
+            append_old_size = self.old_size.append
+
+            def append_change(change, path, mtime, old_mtime):
+                append_path(path)
+                append_code(change)
+                if mtime is None:
+                    append_mtime_ns(-1)
+                    append_size(-1)
+                else:
+                    append_mtime_ns(mtime[0])
+                    append_size(mtime[1])
+                if old_mtime is None:
+                    append_old_mtime_ns(-1)
+                    append_old_size(-1)
+                else:
+                    append_old_mtime_ns(old_mtime[0])
+                    append_old_size(old_mtime[1])
+
+        return append_change
+
+    def _columns(self):
+        return [column for column in (
+            self.paths, self.changes, self.mtime_ns, self.size, self.old_mtime_ns,
+            self.old_size) if column is not None]
+
+    def extend(self, batch):
+        '''
+        :param ChangeBatch batch:
+            A batch with the same columns.
+        '''
+        for column, other in zip(self._columns(), batch._columns()):
+            column.extend(other)
+
+    def to_changes(self):
+        '''
+        :return List[Tuple[Change, str]|ChangeEvent]:
+            The changes as provided by `Watcher.iter_changes()`.
+        '''
+        if self.mtime_ns is None:
+            return [(Change(code), path) for code, path in zip(self.changes, self.paths)]
+
+        def none_if_missing(value):
+            return None if value == -1 else value
+
+        return [
+            ChangeEvent(
+                Change(code), path, none_if_missing(mtime_ns), none_if_missing(size),
+                none_if_missing(old_mtime_ns), none_if_missing(old_size))
+            for code, path, mtime_ns, size, old_mtime_ns, old_size in zip(
+                self.changes, self.paths, self.mtime_ns, self.size, self.old_mtime_ns,
+                self.old_size)]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        '''
+        :param int|slice index:
+            If a slice is given a `ChangeBatch` with the changes in it is returned
+            (otherwise, the `(Change, str)` tuple at the given index).
+        '''
+        if isinstance(index, slice):
+            cls = self.__class__
+            return cls(*[
+                None if column is None else column[index] for column in (
+                    self.paths, self.changes, self.mtime_ns, self.size, self.old_mtime_ns,
+                    self.old_size)])
+        return Change(self.changes[index]), self.paths[index]
+
+    def __delitem__(self, index):
+        for column in self._columns():
+            del column[index]
+
+    def __iter__(self):
+        '''
+        :rtype: Iterable[Tuple[Change, str]]
+        '''
+        for code, path in zip(self.changes, self.paths):
+            yield Change(code), path
+
+
+class _Throttle(object):
+    '''
+    Throttling state shared by all the path watchers of a watcher (so that updating it
+    doesn't depend on the number of tracked paths). The sleep time is auto-tuned based on
+    `Watcher.target_time_for_single_scan`.
+    '''
+
+    __slots__ = ['sleep_time', 'sleep_at_elapsed']
+
+    def __init__(self, sleep_time=.0):
+        self.sleep_time = sleep_time
+        self.sleep_at_elapsed = 1. / 30.
+
+    def throttle(self, single_visit_info):
+        '''
+        Sleeps if the scan ran for more than `sleep_at_elapsed` since the last sleep
+        (called periodically while scanning).
+        '''
+        sleep_time = self.sleep_time
+        if sleep_time > 0:
+            t = time.time()
+            diff = t - single_visit_info.last_sleep_time
+            if diff > self.sleep_at_elapsed:
+                time.sleep(sleep_time)
+                single_visit_info.last_sleep_time = time.time()
+                single_visit_info.throttle_sleep_time += sleep_time
+
+    def update(self, target_time, actual_time):
+        '''
+        Updates the sleep time based on the time the last scan took (going slowly into the
+        right direction).
+        '''
+        if target_time <= 0.0:
+            self.sleep_time = 0.0
+            return
+
+        perc = target_time / actual_time
+
+        # Prevent from changing the values too much (go slowly into the right
+        # direction).
+        # (to prevent from cases where the user puts the machine on sleep and
+        # values become too skewed).
+        if perc > 2.:
+            perc = 2.
+        elif perc < 0.5:
+            perc = 0.5
+
+        if self.sleep_time <= 0.0:
+            self.sleep_time = 0.001
+        new_sleep_time = self.sleep_time * perc
+
+        diff_sleep_time = new_sleep_time - self.sleep_time
+        self.sleep_time += (diff_sleep_time / 3.0)
+
+        if self.sleep_time < 0.001:
+            self.sleep_time = 0.001
+
+
+class _ScanResult(object):
+
+    __slots__ = ['changes', 'path_watchers', 'throttle', 'scan_time']
+
+    def __init__(self):
+        self.changes = None
+        self.path_watchers = None
+        self.throttle = None
+
+        # The time spent scanning (without the time spent by the consumer of the changes
+        # provided while scanning).
+        self.scan_time = 0.
+
+
+class Subscription(object):
+    '''
+    Created by `Watcher.subscribe()`.
+
+    Changes are split in lanes by path (so, the same path is always handled in the same
+    lane) and each lane processes its batches serially in the executor.
+    '''
+
+    def __init__(self, watcher, callback, executor, lanes, shutdown_executor):
+        self._watcher = watcher
+        self.callback = callback
+        self._executor = executor
+        self._shutdown_executor = shutdown_executor
+        self._lanes = max(1, lanes)
+        self._lock = threading.Lock()
+        self._lane_to_pending = [deque() for _i in range(self._lanes)]
+        self._lane_running = [False] * self._lanes
+        self._disposed = False
+
+    def unsubscribe(self):
+        self._watcher._unsubscribe(self)
+
+    def _shutdown(self):
+        self._disposed = True
+        if self._shutdown_executor:
+            self._executor.shutdown(wait=False)
+
+    def _dispatch(self, changes):
+        lanes = self._lanes
+        if lanes == 1:
+            lane_to_changes = {0: changes}
+        else:
+            lane_to_changes = {}
+            for change in changes:
+                lane = hash(change[1]) % lanes
+                lst = lane_to_changes.get(lane)
+                if lst is None:
+                    lst = lane_to_changes[lane] = []
+                lst.append(change)
+
+        for lane, lane_changes in lane_to_changes.items():
+            with self._lock:
+                if self._disposed:
+                    return
+                self._lane_to_pending[lane].append(lane_changes)
+                if self._lane_running[lane]:
+                    continue  # The running task will pick it up.
+                self._lane_running[lane] = True
+            self._executor.submit(self._run_lane, lane)
+
+    def _run_lane(self, lane):
+        pending = self._lane_to_pending[lane]
+        while True:
+            with self._lock:
+                if not pending or self._disposed:
+                    self._lane_running[lane] = False
+                    return
+                changes = pending.popleft()
+            try:
+                self.callback(changes)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
 
 class TrackedPath(object):
 
@@ -91,35 +779,373 @@ class TrackedPath(object):
         self.recursive = recursive
 
 
+class _RootsTrie(object):
+    '''
+    Prefix trie (by path components) of the tracked paths.
+
+    Paths are canonicalized (made absolute/normalized and, if `resolve_symlinks` is True,
+    symlinks are resolved to find out whether different spellings point to the same
+    directory), so, the same directory is tracked only once and nested paths are merged
+    with the paths containing them.
+
+    Note: the paths reported use the (absolute) spelling of the outermost tracked path.
+    '''
+
+    _VALUE = None  # Key for the value in a node (other keys are path components).
+
+    def __init__(self, resolve_symlinks=True):
+        self._resolve_symlinks = resolve_symlinks
+        self._root = {}
+
+    def add(self, path, recursive):
+        spelling = os.path.abspath(path)
+        key = os.path.realpath(spelling) if self._resolve_symlinks else spelling
+
+        node = self._root
+        for part in key.split(os.sep):
+            if part:
+                node = node.setdefault(part, {})
+
+        value = node.get(self._VALUE)
+        if value is None:
+            node[self._VALUE] = [key, spelling, bool(recursive)]
+        elif recursive:
+            value[2] = True
+
+    def get_spelling(self, path):
+        '''
+        :return Optional[str]:
+            The given path spelled as reported by the outermost tracked path containing it
+            (or None if it's not inside any tracked path).
+        '''
+        key = os.path.abspath(path)
+        if self._resolve_symlinks:
+            key = os.path.realpath(key)
+
+        node = self._root
+        value = node.get(self._VALUE)
+        for part in key.split(os.sep):
+            if value is not None:
+                break
+            if part:
+                node = node.get(part)
+                if node is None:
+                    return None
+                value = node.get(self._VALUE)
+
+        if value is None:
+            return None
+        root_key, spelling, _recursive = value
+        return spelling + key[len(root_key):]
+
+    def iter_roots(self):
+        '''
+        :return Iterable[Tuple[str, bool, Dict[str, bool]]]:
+            The outermost tracked paths with whether they're recursive and the paths
+            nested inside it (spelled as if they were inside it).
+        '''
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            value = node.get(self._VALUE)
+            if value is None:
+                stack.extend(
+                    child for part, child in sorted(node.items(), reverse=True)
+                    if part is not self._VALUE)
+                continue
+
+            key, spelling, recursive = value
+            nested_roots = {}
+            for nested_key, _nested_spelling, nested_recursive in self._iter_nested(node):
+                nested_roots[spelling + nested_key[len(key):]] = nested_recursive
+            yield spelling, recursive, nested_roots
+
+    def _iter_nested(self, node):
+        stack = [child for part, child in node.items() if part is not self._VALUE]
+        while stack:
+            node = stack.pop()
+            value = node.get(self._VALUE)
+            if value is not None:
+                yield value
+            stack.extend(child for part, child in node.items() if part is not self._VALUE)
+
+
+class TrackedFiles(object):
+    '''
+    Used to track an explicit list of files (which may be scattered across a big tree)
+    without having to track their whole parent directories.
+
+    Note: `accept_file` is not used for the listed files (all of them are tracked).
+    Relative paths are made absolute (and changes are reported with the absolute paths).
+    '''
+
+    __slots__ = ['paths']
+
+    def __init__(self, paths):
+        '''
+        :type paths: Iterable[str]
+        '''
+        self.paths = tuple(paths)
+
+
+class _FileListWatcher(object):
+    '''
+    Helper to watch an explicit list of files.
+
+    Files are grouped by their parent directory: directories with many listed files are
+    listed with a single `scandir` whereas for directories where only a few of the
+    entries are listed, each listed file is stat'ed individually (the decision is based
+    on the number of entries found the last time the directory was listed).
+    '''
+
+    # If the number of listed files * this ratio is lower than the number of entries in
+    # a directory, the files are stat'ed individually instead of listing the directory.
+    stat_ratio = 8
+
+    # Directories with up to this number of listed files are always stat'ed individually.
+    max_files_to_stat = 4
+
+    def __init__(self, paths, throttle=None, provider=None, is_log_file=None):
+        '''
+        :type paths: Iterable[str]
+        :type throttle: _Throttle
+        :type provider: ScandirProvider
+
+        :param Callable[str, bool] is_log_file:
+            Returns whether a path is a log file (see: `Watcher.log_file_patterns`).
+        '''
+        from os.path import abspath, dirname, basename
+
+        self.provider = provider if provider is not None else ScandirProvider()
+        self._paths = frozenset(abspath(path) for path in paths)
+        dir_to_name_to_path = {}
+        for path in self._paths:
+            name_to_path = dir_to_name_to_path.get(dirname(path))
+            if name_to_path is None:
+                name_to_path = dir_to_name_to_path[dirname(path)] = {}
+            name_to_path[basename(path)] = path
+        self._dir_to_name_to_path = dir_to_name_to_path
+
+        # dir -> number of entries found when it was last listed.
+        self._dir_to_entries_count = {}
+
+        self.is_log_file = is_log_file
+        self.throttle = throttle if throttle is not None else _Throttle()
+
+    def __eq__(self, o):
+        if isinstance(o, _FileListWatcher):
+            return self._paths == o._paths
+
+        return False
+
+    def __ne__(self, o):
+        return not self == o
+
+    def __hash__(self):
+        return hash(self._paths)
+
+    def _throttle(self, single_visit_info):
+        if single_visit_info.count % 300 == 0:
+            self.throttle.throttle(single_visit_info)
+
+    def _check(self, single_visit_info, append_change, old_file_to_mtime):
+        for _ in self._iter_check(single_visit_info, append_change, old_file_to_mtime):
+            pass
+
+    def _iter_check(self, single_visit_info, append_change, old_file_to_mtime):
+        '''
+        Checks the files (yielding after each directory is checked).
+        '''
+        provider = self.provider
+        new_files = single_visit_info.file_to_mtime
+        dir_to_entries_count = self._dir_to_entries_count
+        is_log_file = self.is_log_file
+
+        for dir_path, name_to_path in self._dir_to_name_to_path.items():
+            if single_visit_info.cancelled:
+                return
+
+            entries_count = dir_to_entries_count.get(dir_path)
+            if len(name_to_path) <= self.max_files_to_stat or (
+                    entries_count is not None and
+                    len(name_to_path) * self.stat_ratio < entries_count):
+                path_and_stat = []
+                for path in name_to_path.values():
+                    single_visit_info.count += 1
+                    self._throttle(single_visit_info)
+                    try:
+                        path_and_stat.append((path, provider.stat(path)))
+                    except OSError:
+                        pass  # File does not exist.
+            else:
+                path_and_stat = []
+                entries_count = 0
+                try:
+                    for entry in provider.scandir(dir_path):
+                        entries_count += 1
+                        single_visit_info.count += 1
+                        self._throttle(single_visit_info)
+                        path = name_to_path.get(entry.name)
+                        if path is not None:
+                            try:
+                                if not entry.is_dir():
+                                    if is_log_file is not None and is_log_file(path):
+                                        # See: `_PathWatcher._check_dir` (st_ino is needed).
+                                        path_and_stat.append((path, provider.stat(path)))
+                                    else:
+                                        path_and_stat.append((path, entry.stat()))
+                            except OSError:
+                                pass  # File was removed in the meanwhile.
+                except OSError:
+                    single_visit_info.errors += 1  # Directory was removed in the meanwhile.
+                dir_to_entries_count[dir_path] = entries_count
+
+            for path, stat in path_and_stat:
+                if path in new_files:
+                    continue  # Already reported by some other watcher.
+                st_mode = getattr(stat, 'st_mode', None)
+                if st_mode is not None and not S_ISREG(st_mode):
+                    continue  # i.e.: a directory.
+                if is_log_file is not None and is_log_file(path):
+                    mtime = (stat.st_mtime_ns, stat.st_size, getattr(stat, 'st_ino', 0))
+                else:
+                    mtime = (stat.st_mtime_ns, stat.st_size)
+                new_files[path] = mtime
+
+                old_mtime = old_file_to_mtime.pop(path, None)
+                if not old_mtime:
+                    append_change(Change.added, path, mtime, None)
+                elif old_mtime != mtime:
+                    append_change(_get_modified_change(mtime, old_mtime), path, mtime, old_mtime)
+
+            yield
+
+
+class _CachedEntry(object):
+    '''
+    Entry of a directory listing kept in the listing cache (see:
+    `Watcher.cache_dir_listings`).
+    '''
+
+    __slots__ = ['path', '_is_dir', '_provider']
+
+    def __init__(self, path, is_dir, provider):
+        self.path = path
+        self._is_dir = is_dir
+        self._provider = provider
+
+    def is_dir(self):
+        return self._is_dir
+
+    def is_symlink(self):
+        return False  # Symlinks which shouldn't be followed aren't cached.
+
+    def stat(self):
+        return self._provider.stat(self.path)
+
+
 class _PathWatcher(object):
     '''
     Helper to watch a single path.
     '''
 
-    def __init__(self, root_path, accept_directory, accept_file, single_visit_info, max_recursion_level, sleep_time=.0, recursive=True):
+    # Note: many instances may be created (one per tracked path), so, the state shared by
+    # all of them (such as the throttling) is not kept in each instance.
+    __slots__ = [
+        'provider', 'nested_roots', 'accept_directory', 'accept_file', '_max_recursion_level',
+        '_root_path', '_recursive', 'follow_symlinks', 'is_within_roots', 'skip_dirs',
+        'one_filesystem', '_root_devs', 'scan_interval', '_last_check_time', 'is_log_file',
+        '_checked_files', '_last_files', '_last_dirs', 'bytes_paths', 'throttle',
+        'cache_listings', '_dir_to_listing', '_new_dir_to_listing']
+
+    # Directories modified less than this time (in seconds) before being listed aren't
+    # cached (so that filesystems with a coarse mtime resolution are supported).
+    racy_listing_time = 2.
+
+    def __init__(self, root_path, accept_directory, accept_file, single_visit_info, max_recursion_level, throttle=None, recursive=True, provider=None, nested_roots=None, follow_symlinks=FollowSymlinks.always, is_within_roots=None, skip_dirs=None, one_filesystem=False, scan_interval=None, is_log_file=None, cache_listings=False):
         '''
         :type root_path: str
         :type accept_directory: Callback[str, bool]
         :type accept_file: Callback[str, bool]
         :type max_recursion_level: int
-        :type sleep_time: float
+        :type provider: ScandirProvider
+
+        :param _Throttle throttle:
+            The throttling state (shared by the path watchers of a watcher).
+
+        :param Dict[str, bool] nested_roots:
+            Tracked paths inside `root_path` (and whether they're recursive) which are
+            checked along with this path watcher (even if they wouldn't be reached from
+            `root_path` due to the filters, recursion level or `recursive`).
+
+        :param FollowSymlinks follow_symlinks:
+            Whether symlinks to directories are followed.
+
+        :param Callable[str, bool] is_within_roots:
+            Returns whether the target of a symlink is inside some tracked path (used if
+            `follow_symlinks` is `FollowSymlinks.within_roots`).
+
+        :param Set[str] skip_dirs:
+            Directories which are not checked when reached (i.e.: mounts which are
+            excluded or checked by some other path watcher).
+
+        :param bool one_filesystem:
+            Whether directories in a different device than the root (or nested roots) are
+            skipped.
+
+        :param Optional[float] scan_interval:
+            If given, this path is checked at most once in this interval (in seconds).
+
+        :param Callable[str, bool] is_log_file:
+            Returns whether a path is a log file (see: `Watcher.log_file_patterns`).
+
+        :param bool cache_listings:
+            Whether the accepted entries of the directories are cached (see:
+            `Watcher.cache_dir_listings`).
         '''
+        self.provider = provider if provider is not None else ScandirProvider()
+        self.nested_roots = nested_roots if nested_roots is not None else {}
         self.accept_directory = accept_directory
         self.accept_file = accept_file
         self._max_recursion_level = max_recursion_level
 
         self._root_path = root_path
         self._recursive = recursive
-
-        # Initial sleep value for throttling, it'll be auto-updated based on the
-        # Watcher.target_time_for_single_scan.
-        self.sleep_time = sleep_time
-
-        self.sleep_at_elapsed = 1. / 30.
-
-        # When created, do the initial snapshot right away!
-        old_file_to_mtime = {}
-        self._check(single_visit_info, lambda _change: None, old_file_to_mtime)
+        self.follow_symlinks = follow_symlinks
+        self.is_within_roots = is_within_roots
+        self.skip_dirs = skip_dirs if skip_dirs is not None else frozenset()
+        self.one_filesystem = one_filesystem
+
+        # The devices of the root and nested roots (see: `one_filesystem`).
+        self._root_devs = frozenset()
+
+        self.scan_interval = scan_interval
+        self._last_check_time = None
+        self.is_log_file = is_log_file
+
+        # The files/directories found in the last check (only kept if `scan_interval` is
+        # set, so that they're kept in the snapshot when not checked).
+        self._checked_files = None
+        self._last_files = ()
+        self._last_dirs = ()
+
+        # Whether the paths are bytes (see: `Watcher.bytes_paths`).
+        self.bytes_paths = isinstance(root_path, bytes) and bytes is not str
+
+        self.throttle = throttle if throttle is not None else _Throttle()
+
+        # dir -> ((st_mtime_ns, st_ctime_ns, recursive), List[_CachedEntry]) with the
+        # accepted entries of the directories (reused while the directory doesn't change).
+        # The cache is rebuilt in each check (so that removed directories are dropped).
+        # Note: `cache_listings` may be changed afterwards (used in the next check).
+        self.cache_listings = cache_listings
+        self._dir_to_listing = {}
+        self._new_dir_to_listing = None
+
+        if single_visit_info is not None:
+            # When created, do the initial snapshot right away!
+            old_file_to_mtime = {}
+            self._check(single_visit_info, _ignore_change, old_file_to_mtime)
 
     def __eq__(self, o):
         if isinstance(o, _PathWatcher):
@@ -133,58 +1159,300 @@ class _PathWatcher(object):
     def __hash__(self):
         return hash(self._root_path)
 
-    def _check_dir(self, dir_path, single_visit_info, append_change, old_file_to_mtime, level):
+    def _check_dir(self, dir_path, single_visit_info, append_change, old_file_to_mtime, level, recursive, pending_dirs, dir_id=None):
+        '''
+        Checks the files in a single directory (accepted subdirectories to be checked are
+        added to `pending_dirs` as `(dir_path, level, recursive, dir_id)` if `recursive` is
+        True).
+
+        :param Optional[tuple] dir_id:
+            The (st_dev, st_ino) of the directory based on the listing of its parent (an
+            empty tuple if not available) or None if it must be obtained with a stat (i.e.:
+            for roots and symlinks).
+        '''
         # This is the actual poll loop
         if dir_path in single_visit_info.visited_dirs or level > self._max_recursion_level:
             return
+        if single_visit_info.cancelled:
+            return
         single_visit_info.visited_dirs.add(dir_path)
-        try:
-            if isinstance(dir_path, bytes):
-                try:
-                    dir_path = dir_path.decode(sys.getfilesystemencoding())
-                except UnicodeDecodeError:
-                    try:
-                        dir_path = dir_path.decode('utf-8')
-                    except UnicodeDecodeError:
-                        return  # Ignore if we can't deal with the path.
 
+        follow_symlinks = self.follow_symlinks
+        check_dir_ids = follow_symlinks != FollowSymlinks.never
+        new_dir_to_listing = self._new_dir_to_listing
+        dir_stat = None
+        if (check_dir_ids and dir_id is None) or self.one_filesystem or new_dir_to_listing is not None:
+            try:
+                dir_stat = self.provider.stat(dir_path)
+            except OSError:
+                pass
+            else:
+                if self.one_filesystem and self._root_devs and dir_stat.st_dev not in self._root_devs:
+                    return  # Don't cross filesystem boundaries.
+
+                # Note: st_ino is 0 if not available.
+                st_ino = getattr(dir_stat, 'st_ino', 0)
+                dir_id = (dir_stat.st_dev, st_ino) if st_ino else ()
+
+        # Detect loops (and directories reached through different paths) based on the
+        # directory identity.
+        dir_dev = None
+        if check_dir_ids and dir_id:
+            if self._is_visited_dir(dir_path, dir_id, dir_stat, single_visit_info):
+                return
+
+            # The ids of the subdirectories (which aren't symlinks) are based on the inode
+            # from the listing (available without a stat with the default provider, except
+            # on Windows) and the device of this directory (subclasses of the provider
+            # may provide entries without `inode()`, so, they're checked with a stat).
+            if new_dir_to_listing is None and os.name != 'nt' and type(self.provider) is ScandirProvider:
+                dir_dev = dir_id[0]
+
+        scan_profile = single_visit_info.scan_profile
+        if scan_profile is not None:
+            initial_time = time.time()
+            initial_count = single_visit_info.count
+        try:
             new_files = single_visit_info.file_to_mtime
-
-            for entry in scandir(dir_path):
+            nested_roots = self.nested_roots
+            skip_dirs = self.skip_dirs
+            checked_files = self._checked_files
+            is_log_file = self.is_log_file
+            seed_file_to_mtime = single_visit_info.seed_file_to_mtime
+
+            collapsed_files = None
+            old_dir_to_fingerprint = single_visit_info.old_dir_to_fingerprint
+            if old_dir_to_fingerprint:
+                old_fingerprint = old_dir_to_fingerprint.pop(dir_path, None)
+                if old_fingerprint is not None:
+                    collapsed_files = []
+
+            # When the listing is cached, only the accepted entries are checked (without
+            # listing the directory or calling the filters again).
+            listing = None
+            cached_entries = None
+            if new_dir_to_listing is not None and dir_stat is not None:
+                listing_key = (
+                    dir_stat.st_mtime_ns, getattr(dir_stat, 'st_ctime_ns', 0), recursive)
+                listing = self._dir_to_listing.get(dir_path)
+                if listing is not None and listing[0] != listing_key:
+                    listing = None
+                if listing is None:
+                    cached_entries = []
+                    listing_time = time.time()
+
+            from_cache = listing is not None
+            for entry in (listing[1] if from_cache else self.provider.scandir(dir_path)):
                 single_visit_info.count += 1
 
                 # Throttle if needed inside the loop
                 # to avoid consuming too much CPU.
                 if single_visit_info.count % 300 == 0:
-                    if self.sleep_time > 0:
-                        t = time.time()
-                        diff = t - single_visit_info.last_sleep_time
-                        if diff > self.sleep_at_elapsed:
-                            time.sleep(self.sleep_time)
-                            single_visit_info.last_sleep_time = time.time()
+                    self.throttle.throttle(single_visit_info)
 
                 if entry.is_dir():
-                    if self.accept_directory(entry.path):
-                        if self._recursive:
-                            self._check_dir(entry.path, single_visit_info, append_change, old_file_to_mtime, level + 1)
-
-                elif self.accept_file(entry.path):
-                    stat = entry.stat()
-                    mtime = (stat.st_mtime_ns, stat.st_size)
+                    if recursive and (from_cache or self.accept_directory(entry.path)):
+                        subdir_id = None  # Must be stat'ed (if ids are checked).
+                        if check_dir_ids:
+                            if entry.is_symlink():
+                                if follow_symlinks == FollowSymlinks.within_roots and not self.is_within_roots(entry.path):
+                                    continue
+                            elif dir_dev is not None:
+                                subdir_id = (dir_dev, entry.inode())
+                        elif entry.is_symlink():
+                            continue
+                        if cached_entries is not None:
+                            cached_entries.append(_CachedEntry(entry.path, True, self.provider))
+                        if skip_dirs and entry.path in skip_dirs:
+                            continue
+
+                        if nested_roots and entry.path in nested_roots:
+                            # The recursion level is counted from the nested root.
+                            pending_dirs.append((entry.path, 0, True, subdir_id))
+                        else:
+                            pending_dirs.append((entry.path, level + 1, True, subdir_id))
+
+                elif from_cache or self.accept_file(entry.path):
                     path = entry.path
+                    if cached_entries is not None:
+                        cached_entries.append(_CachedEntry(path, False, self.provider))
+                    if path in new_files:
+                        continue  # Already reported by some other watcher.
+                    if is_log_file is not None and is_log_file(path):
+                        # The st_ino is kept to detect rotations (note: the provider is
+                        # used as `entry.stat()` has no st_ino on Windows).
+                        stat = self.provider.stat(path)
+                        mtime = (stat.st_mtime_ns, stat.st_size, getattr(stat, 'st_ino', 0))
+                    else:
+                        mtime = None
+                        if seed_file_to_mtime is not None:
+                            mtime = seed_file_to_mtime.get(path)
+                        if mtime is None:
+                            stat = entry.stat()
+                            mtime = (stat.st_mtime_ns, stat.st_size)
+                    if collapsed_files is not None:
+                        collapsed_files.append((path, mtime))
+                        continue
+
                     new_files[path] = mtime
+                    if checked_files is not None:
+                        checked_files.append(path)
 
                     old_mtime = old_file_to_mtime.pop(path, None)
                     if not old_mtime:
-                        append_change((Change.added, path))
+                        append_change(Change.added, path, mtime, None)
                     elif old_mtime != mtime:
-                        append_change((Change.modified, path))
+                        if (mtime[1] > 0xFFFFFFFF and old_mtime[0] == mtime[0] and
+                                old_mtime[1] == mtime[1] & 0xFFFFFFFF):
+                            # Seeded from the git index, which has the sizes truncated
+                            # to 32 bits (see: `git_index_warm_start`).
+                            continue
+                        append_change(_get_modified_change(mtime, old_mtime), path, mtime, old_mtime)
+
+            if from_cache:
+                new_dir_to_listing[dir_path] = listing
+            elif cached_entries is not None and (
+                    listing_key[0] < (listing_time - self.racy_listing_time) * 1e9):
+                # Note: directories changed right before being listed aren't cached (as
+                # a change in the same mtime tick wouldn't be noticed).
+                new_dir_to_listing[dir_path] = (listing_key, cached_entries)
+
+            if collapsed_files is not None:
+                _check_collapsed_dir(
+                    dir_path, old_fingerprint, collapsed_files, single_visit_info, append_change)
+                if checked_files is not None:
+                    checked_files.extend(path for path, _mtime in collapsed_files)
+
+        except OSError:
+            single_visit_info.errors += 1  # Directory was removed in the meanwhile.
+
+        if scan_profile is not None:
+            if self.bytes_paths:
+                dir_path = os.fsdecode(dir_path)
+            scan_profile.dirs.append((
+                dir_path, time.time() - initial_time, single_visit_info.count - initial_count))
 
+    def _is_visited_dir(self, dir_path, dir_id, dir_stat, single_visit_info):
+        '''
+        :param tuple dir_id:
+            The (st_dev, st_ino) of the directory (exact if `dir_stat` is given, otherwise
+            based on the listing of its parent).
+
+        :return bool:
+            Whether the directory was already visited in this scan (through some other
+            path). If not, it's marked as visited.
+        '''
+        visited_dir_ids = single_visit_info.visited_dir_ids
+        visited = visited_dir_ids.get(dir_id)
+        if visited is None:
+            visited_dir_ids[dir_id] = (dir_path, dir_stat is not None)
+            return False
+
+        visited_path, exact = visited
+        if exact and dir_stat is not None:
+            return True
+
+        # Ids based on listings use the device of the parent (which is not the device of
+        # the directory in a mount point), so, they may clash: confirm with a stat.
+        provider = self.provider
+        try:
+            if dir_stat is None:
+                dir_stat = provider.stat(dir_path)
+            if not exact:
+                visited_stat = provider.stat(visited_path)
+                dir_id = (visited_stat.st_dev, visited_stat.st_ino)
         except OSError:
-            pass  # Directory was removed in the meanwhile.
+            return False
+        return (dir_stat.st_dev, dir_stat.st_ino) == dir_id
 
     def _check(self, single_visit_info, append_change, old_file_to_mtime):
-        self._check_dir(self._root_path, single_visit_info, append_change, old_file_to_mtime, 0)
+        for _ in self._iter_check(single_visit_info, append_change, old_file_to_mtime):
+            pass
+
+    def _iter_check(self, single_visit_info, append_change, old_file_to_mtime):
+        '''
+        Checks the tracked path (yielding after each directory is checked, so that the
+        scan may be interleaved with the scan of other paths).
+        '''
+        # Nested roots are only checked directly if they weren't reached from the root
+        # (they're in the bottom of the stack).
+        pending_dirs = [
+            (path, 0, recursive, None) for path, recursive in self.nested_roots.items()]
+        pending_dirs.append((self._root_path, 0, self._recursive, None))
+
+        if self.one_filesystem:
+            root_devs = set()
+            for dir_path, _level, _recursive, _dir_id in pending_dirs:
+                try:
+                    root_devs.add(self.provider.stat(dir_path).st_dev)
+                except OSError:
+                    pass
+            self._root_devs = frozenset(root_devs)
+
+        checked_dirs = None
+        if self.scan_interval is not None:
+            self._checked_files = []
+            checked_dirs = []
+
+        if self.cache_listings:
+            self._new_dir_to_listing = {}
+        else:
+            self._dir_to_listing = {}
+
+        check_dir = self._check_dir
+        while pending_dirs:
+            dir_path, level, recursive, dir_id = pending_dirs.pop()
+            if checked_dirs is not None:
+                checked_dirs.append(dir_path)
+            check_dir(
+                dir_path, single_visit_info, append_change, old_file_to_mtime, level, recursive,
+                pending_dirs, dir_id)
+            yield
+
+        if self._new_dir_to_listing is not None:
+            self._dir_to_listing = self._new_dir_to_listing
+            self._new_dir_to_listing = None
+
+        if checked_dirs is not None:
+            self._last_files = self._checked_files
+            self._last_dirs = checked_dirs
+            self._checked_files = None
+            self._last_check_time = time.time()
+
+    def _clear_listing_cache(self):
+        # Called when the filters change (the cached entries were accepted by the previous
+        # filters). Note: if in the middle of a check, it's not cached in this check.
+        self._dir_to_listing = {}
+        self._new_dir_to_listing = None
+
+    def _is_due(self, now):
+        '''
+        :return bool:
+            Whether this path should be checked in a scan started at the given time (see:
+            `scan_interval`).
+        '''
+        return (
+            self.scan_interval is None or self._last_check_time is None or
+            now - self._last_check_time >= self.scan_interval)
+
+    def _keep_last_check(self, single_visit_info, old_file_to_mtime):
+        '''
+        Keeps what was found in the last check in the snapshot (used instead of checking
+        when not due).
+        '''
+        new_files = single_visit_info.file_to_mtime
+        for path in self._last_files:
+            mtime = old_file_to_mtime.pop(path, None)
+            if mtime is not None:
+                new_files[path] = mtime
+
+        old_dir_to_fingerprint = single_visit_info.old_dir_to_fingerprint
+        if old_dir_to_fingerprint:
+            dir_to_fingerprint = single_visit_info.dir_to_fingerprint
+            for dir_path in self._last_dirs:
+                fingerprint = old_dir_to_fingerprint.pop(dir_path, None)
+                if fingerprint is not None:
+                    dir_to_fingerprint[dir_path] = fingerprint
 
 
 class Watcher(object):
@@ -215,7 +1483,116 @@ class Watcher(object):
     # This is the maximum recursion level.
     max_recursion_level = 10
 
-    def __init__(self, accept_directory=None, accept_file=None):
+    # Set to a time (in seconds) to profile scans: scans which take longer than this
+    # time generate a report with the most expensive directories and filters (see:
+    # `Watcher.slow_scan_reports`). Note: profiling adds some overhead to scans.
+    slow_scan_threshold = None
+
+    # Set to a directory (along with `slow_scan_threshold`) to run the scan done after
+    # a slow scan under cProfile (the stats are dumped in this directory).
+    slow_scan_cprofile_dir = None
+
+    # Number of entries scanned in a tracked path before switching to the next tracked
+    # path (so that a big tracked path doesn't delay the notifications of small ones).
+    # Changes are provided as they're found (note: deletions are only provided at the
+    # end of a full scan).
+    # Set to 0 to fully scan each tracked path before going to the next one.
+    round_robin_slice = 1000
+
+    # Set to True to have `iter_changes()` provide `ChangeEvent` instances (with the
+    # stat information obtained while scanning) instead of `(Change, path)` tuples.
+    rich_change_events = False
+
+    # Set to True to make `set_tracked_paths()` return right away while the initial
+    # snapshot is built in a background thread (see: `Watcher.initial_scan`).
+    background_initial_scan = False
+
+    # Sleep time used to throttle the initial scan when done in the background
+    # (0.0 means no throttling).
+    initial_scan_sleep_time = 0.0
+
+    # Number of changes kept in the change log (see: `changes_since()`). Used when the
+    # watcher is created (0 means no changes are kept).
+    change_log_size = 10000
+
+    # Policy for symlinks to directories (see: `FollowSymlinks`). When symlinks are
+    # followed, directories are identified by (st_dev, st_ino), so, each directory is
+    # scanned only once in a scan (even if reached through different paths or through
+    # a symlink loop). Used when the tracked paths are set.
+    follow_symlinks = FollowSymlinks.always
+
+    # Set to True to scan using bytes paths (which avoids decoding the path of each entry
+    # scanned: only the paths of the changes reported are decoded, with `os.fsdecode`, so
+    # names which can't be decoded are kept as surrogate escapes). Used when the tracked
+    # paths are set. Note: custom `accept_directory` / `accept_file` filters receive bytes
+    # paths in this mode (Python 3 only).
+    bytes_paths = False
+
+    # Maximum number of entries (files and collapsed directories) kept in the snapshot
+    # (0 means no limit). When exceeded, the files of the directories which didn't change
+    # for a longer time (coldest subtrees first) are collapsed to a fingerprint per
+    # directory, which is expanded again when it changes. Note: this trades precision for
+    # memory: in a collapsed directory, added/modified files are reported as modified
+    # (only if their mtime is newer than the ones in the fingerprint) and deleted files
+    # are not reported.
+    max_snapshot_entries = 0
+
+    # Set to True to not cross filesystem boundaries: directories in a different device
+    # (st_dev) than the tracked path which contains them are not scanned. Used when the
+    # tracked paths are set.
+    one_filesystem = False
+
+    # Maps filesystem types (as in `/proc/self/mountinfo`, i.e.: 'nfs4', 'cifs' or
+    # 'fuse.sshfs', where 'fuse' also matches 'fuse.sshfs') to a `FilesystemPolicy` for
+    # the mounts of that type in the tracked paths (i.e.: to exclude slow network mounts
+    # or to scan them less often), i.e.:
+    #
+    #     watcher.filesystem_policies = {
+    #         'nfs4': FilesystemPolicy(scan_interval=60.),
+    #         'fuse.sshfs': FilesystemPolicy(exclude=True),
+    #     }
+    #
+    # Used when the tracked paths are set (the mount table is only available on Linux).
+    filesystem_policies = {}
+
+    # Set to a time (in seconds) higher than `target_time_for_notification` to back off
+    # while idle: after each scan without changes, the time between scans is multiplied by
+    # `idle_backoff_factor` (up to this time). It's restored to
+    # `target_time_for_notification` as soon as a change is found or `wakeup()` is called.
+    # Set to 0.0 to always use `target_time_for_notification`.
+    idle_backoff_max_time = 0.0
+
+    idle_backoff_factor = 2.0
+
+    # Glob patterns (matched against the file name, i.e.: '*.log') for files which are
+    # tracked as log files: instead of `Change.modified`, changes to them are reported as
+    # `Change.appended` (same file, size grew), `Change.truncated` (same file, size
+    # shrank) or `Change.rotated` (a different file, based on st_ino, is in the path).
+    # With `rich_change_events`, the events have the old and new sizes, so, consumers
+    # may read just the appended bytes. Used when the tracked paths are set.
+    # Note: appends are detected based on the size only (the contents are not checked).
+    log_file_patterns = ()
+
+    # Set to True to use the stat information kept in the git index for the tracked paths
+    # in git checkouts: in the initial scan, the files tracked by git (whose information in
+    # the index is reliable) aren't stat'ed (directories are still listed, so, untracked
+    # files are still found). Note: files changed after git last refreshed the index
+    # (i.e.: uncommitted changes when `git status` wasn't run since then) are reported as
+    # modified in the first scan (see: `fsnotify.gitindex`).
+    git_index_warm_start = False
+
+    # Set to True to cache the accepted entries of each directory while the directory's
+    # mtime/ctime doesn't change: in scans, unchanged directories aren't listed (and the
+    # filters aren't called again), just the accepted files are stat'ed. Used when the
+    # tracked paths are set. Note: the cache is cleared when the filters (or the
+    # `ignored_dirs` / `accepted_file_extensions` of the default filters) are changed,
+    # but custom filters must not change their results otherwise. This is useful
+    # where listing a directory is more expensive than stat'ing its files (i.e.: on
+    # Windows, `scandir` already provides the stat information, so, it's not recommended).
+    # Listings aren't cached while recording a trace (see: `start_recording()`).
+    cache_dir_listings = False
+
+    def __init__(self, accept_directory=None, accept_file=None, provider=None, engine=None):
         '''
         :param Callable[str, bool] accept_directory:
             Callable that returns whether a directory should be watched.
@@ -224,21 +1601,119 @@ class Watcher(object):
         :param Callable[str, bool] accept_file:
             Callable that returns whether a file should be watched.
             Note: if passed it'll override the `accepted_file_extensions`.
+
+        :param ScandirProvider provider:
+            Provides the directory listings and stat results (by default the actual
+            filesystem is used, but it may be changed to some other implementation such
+            as `fsnotify.fakefs.FakeFilesystem`).
+
+        :param fsnotify.engine.SharedEngine engine:
+            If given, the tracked paths are scanned by the engine (which is shared with
+            other watchers, so, directories tracked by many watchers are scanned only once)
+            and this watcher just receives the changes accepted by its filters (see:
+            `fsnotify.engine.get_shared_engine()`).
         '''
         self._lock = threading.Lock()
         
-        self._path_watchers = set()
+        self._path_watchers = []
+        self._throttle = _Throttle()
         self._disposed = threading.Event()
 
+        # Set to stop waiting for the next scan.
+        self._wakeup = threading.Event()
+
+        # The time between scans while backing off (0 if not idle, see:
+        # `idle_backoff_max_time`).
+        self._idle_wait = 0.
+
+        self._engine = engine
+        if engine is not None:
+            self._engine_changes = queue.Queue()
+
+        # The `ignored_dirs` / `accepted_file_extensions` used by the default filters when
+        # the directory listings were cached (see: `cache_dir_listings`).
+        self._listing_filters_key = None
+
+        # (names, encoded names) for the default filters when using `bytes_paths`.
+        self._encoded_ignored_dirs = None
+        self._encoded_file_extensions = None
+
         if accept_directory is None:
             from os.path import basename
-            accept_directory = lambda dir_path: basename(dir_path) not in self.ignored_dirs
+
+            def accept_directory(dir_path):
+                ignored_dirs = self.ignored_dirs
+                if isinstance(dir_path, bytes) and bytes is not str:
+                    encoded = self._encoded_ignored_dirs
+                    if encoded is None or encoded[0] is not ignored_dirs:
+                        encoded = self._encoded_ignored_dirs = (
+                            ignored_dirs, frozenset(os.fsencode(name) for name in ignored_dirs))
+                    ignored_dirs = encoded[1]
+                return basename(dir_path) not in ignored_dirs
+
         if accept_file is None:
-            accept_file = lambda path_name: \
-                not self.accepted_file_extensions or path_name.endswith(self.accepted_file_extensions)
+
+            def accept_file(path_name):
+                extensions = self.accepted_file_extensions
+                if not extensions:
+                    return True
+                if isinstance(path_name, bytes) and bytes is not str:
+                    encoded = self._encoded_file_extensions
+                    if encoded is None or encoded[0] is not extensions:
+                        encoded = self._encoded_file_extensions = (
+                            extensions, tuple(os.fsencode(ext) for ext in extensions))
+                    extensions = encoded[1]
+                return path_name.endswith(extensions)
         self.accept_file = accept_file
         self.accept_directory = accept_directory
         self._single_visit_info = _SingleVisitInfo()
+        self._initial_scan = InitialScan(self._single_visit_info, 0)
+        self._initial_scan._mark_ready()
+
+        self._subscriptions = ()
+        self._dispatcher_thread = None
+
+        # Set to stop the dispatcher thread (when there are no subscriptions and
+        # `start_background_scan()` wasn't called).
+        self._dispatcher_stop = threading.Event()
+        self._background_scan = False
+
+        self.scan_stats = ScanStats()
+
+        # The last changes reported (see: `changes_since()`).
+        self.change_log = ChangeLog(self.change_log_size)
+
+        # dir -> number of the last scan where a change was found in it (used to find
+        # the coldest directories if `max_snapshot_entries` is exceeded).
+        self._dir_to_last_change = {}
+
+        # Set when the snapshot is published in shared memory (see: `publish_snapshot()`).
+        self._snapshot_publisher = None
+
+        # Whether the current path watchers use bytes paths (see: `bytes_paths`).
+        self._scan_bytes_paths = False
+
+        # The metrics (which may be exposed in the Prometheus text format).
+        self.metrics = WatcherMetrics()
+        self._metrics_servers = []
+
+        # The reports for the last slow scans (see: `slow_scan_threshold`).
+        self.slow_scan_reports = deque(maxlen=10)
+        self._cprofile_next_scan = False
+
+        if provider is None:
+            provider = ScandirProvider()
+        self._provider = provider
+        # The provider actually used by the path watchers (may wrap `_provider`).
+        self._scan_provider = provider
+        self._trace_recorder = None
+
+    @property
+    def initial_scan(self):
+        '''
+        :rtype: InitialScan
+        '''
+        return self._initial_scan
 
     @property
     def accept_directory(self):
@@ -249,6 +1724,7 @@ class Watcher(object):
         self._accept_directory = accept_directory
         for path_watcher in self._path_watchers:
             path_watcher.accept_directory = accept_directory
+        self._clear_listing_caches()
 
     @property
     def accept_file(self):
@@ -259,9 +1735,220 @@ class Watcher(object):
         self._accept_file = accept_file
         for path_watcher in self._path_watchers:
             path_watcher.accept_file = accept_file
+        self._clear_listing_caches()
+
+    def _clear_listing_caches(self):
+        for path_watcher in self._path_watchers:
+            if isinstance(path_watcher, _PathWatcher):
+                path_watcher._clear_listing_cache()
+
+    def _get_listing_filters_key(self):
+        return (frozenset(self.ignored_dirs), tuple(self.accepted_file_extensions))
+
+    @property
+    def provider(self):
+        '''
+        :rtype: ScandirProvider
+        '''
+        return self._provider
+
+    def _set_scan_provider(self, provider):
+        self._scan_provider = provider
+        cache_listings = self._get_cache_listings()
+        for path_watcher in self._path_watchers:
+            path_watcher.provider = provider
+            if isinstance(path_watcher, _PathWatcher):
+                path_watcher.cache_listings = cache_listings
+
+    def _get_cache_listings(self):
+        # Listings aren't cached while recording (the trace must have all the listings).
+        return self.cache_dir_listings and self._trace_recorder is None
+
+    def start_recording(self, path_or_stream, hash_names=False):
+        '''
+        Starts recording a trace with the directory listings (and stat results) obtained
+        while scanning the tracked paths and the changes reported (it may be replayed with
+        `fsnotify.trace.replay_trace()` afterwards).
+
+        Note: `TrackedFiles` are not recorded.
+
+        :param str|file path_or_stream:
+            Where the trace should be written (if a path ending with '.gz' is given the
+            contents are compressed).
+
+        :param bool hash_names:
+            If True, each path component is replaced by a hash (extensions and names in
+            `ignored_dirs` are kept) so that the trace may be shared.
+
+        :rtype: fsnotify.trace.TraceRecorder
+        '''
+        from .trace import TraceRecorder
+
+        self.stop_recording()
+        trace_recorder = TraceRecorder(
+            path_or_stream, hash_names=hash_names, keep_names=self.ignored_dirs)
+        with self._lock:
+            self._trace_recorder = trace_recorder
+            self._set_scan_provider(trace_recorder.wrap_provider(self._provider))
+            trace_recorder.record_roots(self._path_watchers)
+        return trace_recorder
+
+    def publish_snapshot(self, name=None):
+        '''
+        Publishes the snapshot (the mtime/size of each tracked file) in shared memory so
+        that other processes may read it with `fsnotify.sharedsnapshot.SnapshotReader`.
+
+        It's published when the initial scan is finished and then at the end of each scan
+        with changes (the shared memory is released on `dispose()`).
+
+        Note: requires Python 3.8 onwards.
+
+        :param str name:
+            The name of the shared memory segment (if not given a random name is used).
+
+        :rtype: fsnotify.sharedsnapshot.SnapshotPublisher
+        '''
+        from .sharedsnapshot import SnapshotPublisher
+
+        publisher = SnapshotPublisher(name)
+        with self._lock:
+            old_publisher = self._snapshot_publisher
+            self._snapshot_publisher = publisher
+            initial_scan = self._initial_scan
+            single_visit_info = self._single_visit_info
+        if old_publisher is not None:
+            old_publisher.close()
+
+        if initial_scan.is_ready() and single_visit_info is initial_scan._single_visit_info:
+            # No scans were done after the initial one (otherwise it's published when the
+            # current scan finishes).
+            publisher.publish(single_visit_info.file_to_mtime)
+        return publisher
+
+    def stop_recording(self):
+        with self._lock:
+            trace_recorder = self._trace_recorder
+            if trace_recorder is None:
+                return
+            self._trace_recorder = None
+            self._set_scan_provider(self._provider)
+        trace_recorder.close()
 
     def dispose(self):
         self._disposed.set()
+        self._wakeup.set()
+        if self._snapshot_publisher is not None:
+            self._snapshot_publisher.close()
+        if self._engine is not None:
+            self._engine.unregister(self)
+        self.stop_recording()
+        self._initial_scan.cancel()
+        with self._lock:
+            subscriptions = self._subscriptions
+            self._subscriptions = ()
+        for subscription in subscriptions:
+            subscription._shutdown()
+
+        for server in self._metrics_servers:
+            server.shutdown()
+            server.server_close()
+        del self._metrics_servers[:]
+
+    def subscribe(self, callback, executor=None, max_workers=4):
+        '''
+        Registers a callback to be called with the changes found (so, there's no need to
+        iterate `iter_changes()` in a custom thread).
+
+        The scan loop runs in an internal thread (started on the first subscription and
+        stopped when the last one is removed, unless `start_background_scan()` was called)
+        and the changes of each scan are dispatched in batches to the callback in the given
+        executor. Changes for the same path are never processed concurrently and are always
+        delivered in the order they were found (changes for different paths may be
+        delivered in parallel).
+
+        :param Callable[List[Tuple[Change, str]|ChangeEvent], None] callback:
+            Called with a list of changes.
+
+        :param concurrent.futures.Executor executor:
+            The executor where callbacks are run (anything with a `submit(fn, *args)`
+            method). If not given a `ThreadPoolExecutor(max_workers)` is created (and shut
+            down on `unsubscribe()` or `dispose()`).
+
+        :param int max_workers:
+            The maximum number of batches from this subscription processed in parallel.
+
+        :rtype: Subscription
+        '''
+        shutdown_executor = False
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers)
+            shutdown_executor = True
+
+        subscription = Subscription(self, callback, executor, max_workers, shutdown_executor)
+        with self._lock:
+            self._subscriptions += (subscription,)
+            self._start_dispatcher_thread()
+        return subscription
+
+    def start_background_scan(self):
+        '''
+        Starts scanning in an internal thread (the same one used by `subscribe()`), so
+        that the change log is updated without having to iterate `iter_changes()` (see:
+        `changes_since()`). Scans are stopped on `dispose()`.
+        '''
+        with self._lock:
+            self._background_scan = True
+            self._start_dispatcher_thread()
+
+    def _start_dispatcher_thread(self):
+        # Note: called with the lock held (a thread which is stopping is reused).
+        self._dispatcher_stop.clear()
+        if self._dispatcher_thread is None:
+            t = threading.Thread(target=self._dispatch_changes, args=(self._dispatcher_stop,))
+            t.name = 'fsnotify dispatcher'
+            t.daemon = True
+            self._dispatcher_thread = t
+            t.start()
+
+    def changes_since(self, seq):
+        '''
+        Provides the changes reported after the given sequence number (changes are kept in
+        a ring buffer with the last `change_log_size` changes).
+
+        Note: changes are only found while scanning (i.e.: while `iter_changes()` is
+        iterated or after `subscribe()` or `start_background_scan()` is called).
+
+        :param int seq:
+            The `last_seq` from the previous call (0 for the first call).
+
+        :rtype: fsnotify.changelog.ChangesSince
+        :return:
+            The changes and the new cursor (`last_seq`). If `expired` is True, changes after
+            the given sequence number are no longer available (because the buffer was
+            filled or the tracked paths changed) and a full resync is needed.
+        '''
+        return self.change_log.changes_since(seq)
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+            if not self._subscriptions and not self._background_scan:
+                # Scans are stopped (and restarted on the next subscription).
+                self._dispatcher_stop.set()
+        subscription._shutdown()
+
+    def _dispatch_changes(self, stop):
+        while True:
+            for changes in self._iter_scan_changes(stop):
+                for subscription in self._subscriptions:
+                    subscription._dispatch(changes)
+
+            with self._lock:
+                # Note: the stop may have been cleared by a new subscription in the meanwhile.
+                if self._disposed.is_set() or stop.is_set():
+                    self._dispatcher_thread = None
+                    return
 
     @property
     def path_watchers(self):
@@ -270,113 +1957,759 @@ class Watcher(object):
     def set_tracked_paths(self, paths):
         """
         Note: always resets all path trackers to track the passed paths.
-        :type paths: [str|TrackedPath]
+        :type paths: [str|TrackedPath|TrackedFiles]
+
+        :rtype: InitialScan
+        :return:
+            Information on the initial snapshot (which is only still running when
+            `background_initial_scan` is True).
         """
         if not isinstance(paths, (list, tuple, set)):
             paths = (paths,)
 
-        def key(path_or_str):
-            if isinstance(path_or_str, TrackedPath):
-                return -len(path_or_str.path)
-            return -len(path_or_str)
+        if self._initial_scan.roots_total:
+            # Changes aren't reported across different tracked paths.
+            self.change_log.expire_cursors()
+
+        if self._engine is not None:
+            initial_scan = self._engine.register(self, paths)
+            with self._lock:
+                self._initial_scan.cancel()
+                self._initial_scan = initial_scan
+            return initial_scan
+
+        file_lists = [p for p in paths if isinstance(p, TrackedFiles)]
+        paths = [p for p in paths if not isinstance(p, TrackedFiles)]
+
+        # Paths are canonicalized and nested/overlapping paths are merged (so, each
+        # directory is only traversed by a single path watcher).
+        bytes_paths = self.bytes_paths
+        if bytes_paths:
+            # The tracked paths are canonicalized as str.
+            decode = lambda path: os.fsdecode(path) if isinstance(path, bytes) else path
+            file_lists = [
+                TrackedFiles(os.fsencode(path) for path in file_list.paths)
+                for file_list in file_lists]
+        else:
+            # Note: bytes paths which can't be decoded are ignored.
+            decode = lambda path: _decode_path(path) if isinstance(path, bytes) else path
+
+        trie = _RootsTrie(resolve_symlinks=isinstance(self._provider, ScandirProvider))
+        for path in paths:
+            if isinstance(path, TrackedPath):
+                path, recursive = decode(path.path), path.recursive
+            else:
+                path, recursive = decode(path), True
+            if path is not None:
+                trie.add(path, recursive)
 
-        # Sort by the path len so that the bigger paths come first (so,
-        # if there's any nesting we want the nested paths to be visited
-        # before the parent paths so that the max_recursion_level is correct).
-        paths = sorted(set(paths), key=key)
-        path_watchers = set()
+        path_watchers = []
 
         single_visit_info = _SingleVisitInfo()
+        background = self.background_initial_scan
+        if self.cache_dir_listings:
+            self._listing_filters_key = self._get_listing_filters_key()
+
+        def is_within_roots(path):
+            if bytes_paths:
+                path = os.fsdecode(path)
+            return trie.get_spelling(path) is not None
+
+        is_log_file = _create_log_file_filter(self.log_file_patterns, bytes_paths)
+
+        # The throttling is shared by all the path watchers (it's auto-tuned by
+        # `iter_changes()` after the initial scan).
+        throttle = _Throttle(self.initial_scan_sleep_time if background else 0.)
+
+        mounts = None
+        if self.filesystem_policies:
+            from .mounts import read_mountinfo
+            mounts = read_mountinfo()
+
+        for root_path, recursive, nested_roots in trie.iter_roots():
+            root_scan_interval = None
+            mount_roots = []  # List[Tuple[str, float]]: slow mounts checked separately.
+            skip_dirs = set()
+            if mounts:
+                policy = self._get_filesystem_policy(mounts, root_path)
+                if policy is not None:
+                    if policy.exclude:
+                        continue
+                    root_scan_interval = policy.scan_interval
+                if recursive:
+                    mount_roots, skip_dirs = self._get_mount_roots(mounts, root_path)
+
+            if bytes_paths:
+                root_path = os.fsencode(root_path)
+                nested_roots = dict(
+                    (os.fsencode(path), nested_recursive)
+                    for path, nested_recursive in nested_roots.items())
+                mount_roots = [
+                    (os.fsencode(path), scan_interval) for path, scan_interval in mount_roots]
+                skip_dirs = set(os.fsencode(path) for path in skip_dirs)
+
+            roots = [(root_path, recursive, nested_roots, root_scan_interval)]
+            roots.extend((path, True, None, scan_interval) for path, scan_interval in mount_roots)
+            for path, path_recursive, path_nested_roots, scan_interval in roots:
+                path_watchers.append(_PathWatcher(
+                    path,
+                    self.accept_directory,
+                    self.accept_file,
+                    None,
+                    max_recursion_level=self.max_recursion_level,
+                    throttle=throttle,
+                    recursive=path_recursive,
+                    provider=self._scan_provider,
+                    nested_roots=path_nested_roots,
+                    follow_symlinks=self.follow_symlinks,
+                    is_within_roots=is_within_roots,
+                    skip_dirs=skip_dirs,
+                    one_filesystem=self.one_filesystem,
+                    scan_interval=scan_interval,
+                    is_log_file=is_log_file,
+                    cache_listings=self._get_cache_listings(),
+                ))
+
+        for file_list in file_lists:
+            path_watchers.append(_FileListWatcher(
+                file_list.paths, throttle=throttle, provider=self._scan_provider,
+                is_log_file=is_log_file))
+
+        initial_scan = InitialScan(single_visit_info, len(path_watchers))
+
+        trace_recorder = self._trace_recorder
+        if trace_recorder is not None:
+            trace_recorder.record_roots(path_watchers)
+            trace_recorder.record_scan_start()
+
+        if background:
+            with self._lock:
+                self._initial_scan.cancel()
+                self._initial_scan = initial_scan
+                self._single_visit_info = single_visit_info
+                self._path_watchers = path_watchers
+                self._throttle = throttle
+                self._scan_bytes_paths = bytes_paths
+
+            t = threading.Thread(
+                target=self._run_initial_scan,
+                args=(initial_scan, single_visit_info, path_watchers, throttle))
+            t.name = 'fsnotify initial scan'
+            t.daemon = True
+            t.start()
+        else:
+            # When collecting the first time in the current thread, sleep_time is 0.
+            self._run_initial_scan(initial_scan, single_visit_info, path_watchers, throttle)
 
-        for path in paths:
-            sleep_time = 0.  # When collecting the first time, sleep_time should be 0!
-            path_watcher = _PathWatcher(
-                path.path if isinstance(path, TrackedPath) else path,
-                self.accept_directory,
-                self.accept_file,
-                single_visit_info,
-                max_recursion_level=self.max_recursion_level,
-                sleep_time=sleep_time,
-                recursive=path.recursive if isinstance(path, TrackedPath) else path
-            )
-
-            path_watchers.add(path_watcher)
-        
-        with self._lock:    
-            self._single_visit_info = single_visit_info
-            self._path_watchers = path_watchers
+            with self._lock:
+                self._initial_scan.cancel()
+                self._initial_scan = initial_scan
+                self._single_visit_info = single_visit_info
+                self._path_watchers = path_watchers
+                self._throttle = throttle
+                self._scan_bytes_paths = bytes_paths
+
+        return initial_scan
+
+    def _get_filesystem_policy(self, mounts, path):
+        '''
+        :return Optional[FilesystemPolicy]:
+            The policy for the filesystem which contains the given path.
+        '''
+        from .mounts import find_mount, get_policy
+        mount = find_mount(mounts, os.path.realpath(path))
+        if mount is None:
+            return None
+        return get_policy(self.filesystem_policies, mount.fs_type)
+
+    def _get_mount_roots(self, mounts, root_path):
+        '''
+        :return Tuple[List[Tuple[str, float]], Set[str]]:
+            The mounts inside the given root which are checked by their own path watcher
+            (along with their `scan_interval`) and the mounts which the path watchers of
+            this root must skip (excluded mounts and the mounts checked separately).
+        '''
+        from .mounts import find_mounts_inside, get_policy
+
+        real_root = os.path.realpath(root_path)
+        mount_roots = []
+        skip_dirs = set()
+        excluded = []
+        for mount in find_mounts_inside(mounts, real_root):
+            if any(mount.mount_point.startswith(prefix) for prefix in excluded):
+                continue  # Inside an excluded mount.
+            policy = get_policy(self.filesystem_policies, mount.fs_type)
+            if policy is None or (not policy.exclude and policy.scan_interval is None):
+                continue
+
+            # The mount spelled as the root.
+            path = root_path + mount.mount_point[len(real_root):]
+            skip_dirs.add(path)
+            if policy.exclude:
+                excluded.append(mount.mount_point + os.sep)
+            else:
+                mount_roots.append((path, policy.scan_interval))
+        return mount_roots, skip_dirs
+
+    def _run_initial_scan(self, initial_scan, single_visit_info, path_watchers, throttle):
+        try:
+            if self.git_index_warm_start:
+                single_visit_info.seed_file_to_mtime = self._read_git_index_seed(path_watchers)
+            for path_watcher in path_watchers:
+                if single_visit_info.cancelled:
+                    return
+                path_watcher._check(single_visit_info, _ignore_change, {})
+                initial_scan.roots_done += 1
+            self._limit_snapshot(single_visit_info, path_watchers)
+            if self._snapshot_publisher is not None:
+                self._snapshot_publisher.publish(single_visit_info.file_to_mtime)
+        finally:
+            single_visit_info.seed_file_to_mtime = None
+
+            # Throttling is auto-tuned by `iter_changes()` from here on.
+            throttle.sleep_time = 0.
+            initial_scan._mark_ready()
+
+    def _read_git_index_seed(self, path_watchers):
+        '''
+        :return Dict[str, Tuple[int, int]]:
+            The (st_mtime_ns, st_size) of the files in the git index of the checkouts which
+            contain the tracked paths (spelled as the tracked paths).
+        '''
+        from .gitindex import find_git_worktree, read_reliable_entries
+
+        fsdecode = getattr(os, 'fsdecode', None) or (lambda path: path)  # Python 2: no-op.
+        bytes_paths = False
+        real_to_root = {}
+        for path_watcher in path_watchers:
+            if isinstance(path_watcher, _PathWatcher):
+                root_path = path_watcher._root_path
+                if path_watcher.bytes_paths:
+                    bytes_paths = True
+                    root_path = os.fsdecode(root_path)
+                real_to_root[os.path.realpath(root_path)] = root_path
+
+        worktree_to_index = {}
+        for real_root in real_to_root:
+            found = find_git_worktree(real_root)
+            if found is not None:
+                worktree_to_index[found[0]] = found[1]
+
+        seed = {}
+        sep = os.sep
+        dirname = os.path.dirname
+        for worktree, index_path in worktree_to_index.items():
+            # Relative dir in the index -> tracked path containing it (spelled as
+            # the tracked path) or None if not tracked.
+            rel_dir_to_spelling = {}
+            for rel_path, mtime in read_reliable_entries(index_path):
+                rel_dir, _, name = rel_path.rpartition(b'/')
+                try:
+                    dir_spelling = rel_dir_to_spelling[rel_dir]
+                except KeyError:
+                    dir_spelling = None
+                    real_dir = worktree
+                    if rel_dir:
+                        real_dir = worktree + sep + fsdecode(rel_dir).replace('/', sep)
+                    current = real_dir
+                    while True:
+                        root_path = real_to_root.get(current)
+                        if root_path is not None:
+                            dir_spelling = root_path + real_dir[len(current):]
+                            if bytes_paths:
+                                dir_spelling = os.fsencode(dir_spelling)
+                            break
+                        parent = dirname(current)
+                        if parent == current or len(parent) < len(worktree):
+                            break
+                        current = parent
+                    rel_dir_to_spelling[rel_dir] = dir_spelling
+
+                if dir_spelling is not None:
+                    if bytes_paths:
+                        seed[os.path.join(dir_spelling, name)] = mtime
+                    else:
+                        seed[os.path.join(dir_spelling, fsdecode(name))] = mtime
+        return seed
 
     def iter_changes(self):
         '''
         Continuously provides changes (until dispose() is called).
 
-        Changes provided are tuples with the Change enum and filesystem path.
+        Changes provided are tuples with the Change enum and filesystem path (or
+        `ChangeEvent` instances if `rich_change_events` is True).
 
-        :rtype: Iterable[Tuple[Change, str]]
+        :rtype: Iterable[Tuple[Change, str]|ChangeEvent]
         '''
-        while not self._disposed.is_set():
+        for changes in self._iter_scan_changes():
+            for change in changes:
+                yield change
 
-            with self._lock:
-                old_visit_info = self._single_visit_info
-                old_file_to_mtime = old_visit_info.file_to_mtime
+    def iter_change_batches(self, max_batch_size=0):
+        '''
+        Continuously provides the changes (until dispose() is called) in batches (one for
+        the changes provided at once by a scan) in a columnar form (which is better suited
+        to process many changes in bulk).
+
+        :param int max_batch_size:
+            If given, bigger batches are split in batches with up to this size.
+
+        :rtype: Iterable[ChangeBatch]
+        '''
+        for changes in self._iter_scan_changes(batches=True):
+            if not isinstance(changes, ChangeBatch):
+                changes = ChangeBatch.from_changes(changes)  # i.e.: from the engine.
+            if max_batch_size and len(changes) > max_batch_size:
+                for i in range(0, len(changes), max_batch_size):
+                    yield changes[i:i + max_batch_size]
+            else:
+                yield changes
+
+    def _scan_once(self, initial_scan):
+        '''
+        Does a single scan of the tracked paths, comparing it with the previous one.
+
+        :return Optional[Tuple[List[Tuple[Change, str]|ChangeEvent], List[_PathWatcher]]]:
+            The changes found and the path watchers used or None if the tracked paths
+            changed in the meanwhile (i.e.: `initial_scan` is no longer current).
+        '''
+        scan_result = _ScanResult()
+        for _changes in self._iter_scan(initial_scan, scan_result):
+            pass
+        if scan_result.path_watchers is None:
+            return None
+        return scan_result.changes, scan_result.path_watchers
+
+    def _iter_scan(self, initial_scan, scan_result, batches=False):
+        '''
+        Does a single scan of the tracked paths, comparing it with the previous one,
+        providing the changes as they're found (note: deletions are only found at the end
+        of the scan).
+
+        When finished, `scan_result` has all the changes and the path watchers used (if
+        the tracked paths changed in the meanwhile, nothing is done and
+        `scan_result.path_watchers` is None).
+
+        :param bool batches:
+            If True the changes are provided as `ChangeBatch` instances (the changes are
+            appended directly to its columns while scanning).
+
+        :type scan_result: _ScanResult
+        :rtype: Iterable[List[Tuple[Change, str]|ChangeEvent]|ChangeBatch]
+        '''
+        with self._lock:
+            if self._initial_scan is not initial_scan:
+                return
+
+            old_visit_info = self._single_visit_info
+            old_file_to_mtime = old_visit_info.file_to_mtime
+            if batches:
+                changes = ChangeBatch._create_empty(self.rich_change_events)
+                append_change = changes._create_append_change(self._scan_bytes_paths)
+                all_changes = ChangeBatch._create_empty(self.rich_change_events)
+                log_changes = self.change_log.append_batch
+            else:
                 changes = []
-                append_change = changes.append
-    
-                self._single_visit_info = single_visit_info = _SingleVisitInfo()
-                path_watchers = self._path_watchers.copy()
-                
-            initial_time = time.time()
-            for path_watcher in self._path_watchers:
+                append_change = _create_append_change(
+                    changes, self.rich_change_events, self._scan_bytes_paths)
+                all_changes = []
+                log_changes = self.change_log.append
+
+            self._single_visit_info = single_visit_info = _SingleVisitInfo()
+            single_visit_info.old_dir_to_fingerprint = old_visit_info.dir_to_fingerprint
+            path_watchers = list(self._path_watchers)
+            throttle = self._throttle
+            trace_recorder = self._trace_recorder
+
+            if self.cache_dir_listings:
+                # The default filters changed: the cached listings are outdated.
+                listing_filters_key = self._get_listing_filters_key()
+                if listing_filters_key != self._listing_filters_key:
+                    self._listing_filters_key = listing_filters_key
+                    self._clear_listing_caches()
+
+        if trace_recorder is not None:
+            trace_recorder.record_scan_start()
+
+        slow_scan_threshold = self.slow_scan_threshold
+        cprofile = None
+        if slow_scan_threshold is not None:
+            from .profiler import ScanProfile
+            single_visit_info.scan_profile = scan_profile = ScanProfile()
+            self._wrap_filters(path_watchers, scan_profile)
+
+            if self._cprofile_next_scan:
+                import cProfile
+                self._cprofile_next_scan = False
+                cprofile = cProfile.Profile()
+                cprofile.enable()
+
+        initial_time = time.time()
+        consumer_time = 0.  # Time spent outside of the scan (while changes are provided).
+
+        checked_path_watchers = []
+        for path_watcher in path_watchers:
+            if isinstance(path_watcher, _PathWatcher) and not path_watcher._is_due(initial_time):
+                # Not due yet (see: `filesystem_policies`): keep the last check.
+                path_watcher._keep_last_check(single_visit_info, old_file_to_mtime)
+            else:
+                checked_path_watchers.append(path_watcher)
+
+        finished = False
+        try:
+            for _ in self._iter_check_path_watchers(
+                    checked_path_watchers, single_visit_info, append_change, old_file_to_mtime):
+                if changes:
+                    partial_changes = changes[:]
+                    del changes[:]
+                    all_changes.extend(partial_changes)
+                    log_changes(partial_changes)
+                    yield_time = time.time()
+                    yield partial_changes
+                    consumer_time += time.time() - yield_time
+            finished = True
+        finally:
+            if not finished:
+                # The scan was interrupted (i.e.: the consumer stopped iterating in the
+                # middle of the scan): what wasn't checked is kept in the snapshot as it
+                # was (so that it's compared in the next scan).
+                self._keep_unchecked(single_visit_info, old_file_to_mtime)
+            if cprofile is not None:
+                cprofile.disable()
+            if slow_scan_threshold is not None:
+                self._unwrap_filters(path_watchers)
+
+        # Note that we pop entries while visiting, so, what remained is what's deleted.
+        for entry, old_mtime in old_file_to_mtime.items():
+            append_change(Change.deleted, entry, None, old_mtime)
+
+        scan_time = time.time() - initial_time - consumer_time
+        if slow_scan_threshold is not None:
+            self._on_profiled_scan(scan_time, slow_scan_threshold, scan_profile, cprofile)
+
+        all_changes.extend(changes)
+        self._limit_snapshot(single_visit_info, path_watchers, all_changes)
+        snapshot_publisher = self._snapshot_publisher
+        if snapshot_publisher is not None and (
+                all_changes or single_visit_info.expanded_dirs or not snapshot_publisher.generation):
+            snapshot_publisher.publish(single_visit_info.file_to_mtime)
+        self.scan_stats._on_scan(
+            scan_time, single_visit_info.count, len(single_visit_info.file_to_mtime),
+            len(all_changes))
+        self._update_metrics(scan_time, single_visit_info, all_changes, len(path_watchers))
+
+        if trace_recorder is not None:
+            trace_recorder.record_changes(all_changes)
+
+        scan_result.changes = all_changes
+        scan_result.path_watchers = path_watchers
+        scan_result.throttle = throttle
+        scan_result.scan_time = scan_time
+        if changes:
+            log_changes(changes)
+            yield changes
+
+    def _keep_unchecked(self, single_visit_info, old_file_to_mtime):
+        file_to_mtime = single_visit_info.file_to_mtime
+        for path, mtime in old_file_to_mtime.items():
+            file_to_mtime.setdefault(path, mtime)
+
+        old_dir_to_fingerprint = single_visit_info.old_dir_to_fingerprint
+        if old_dir_to_fingerprint:
+            dir_to_fingerprint = single_visit_info.dir_to_fingerprint
+            for dir_path, fingerprint in old_dir_to_fingerprint.items():
+                dir_to_fingerprint.setdefault(dir_path, fingerprint)
+
+    def _limit_snapshot(self, single_visit_info, path_watchers, changes=()):
+        '''
+        Collapses the files of the coldest directories to fingerprints if the snapshot has
+        more than `max_snapshot_entries` entries (see: `max_snapshot_entries`).
+        '''
+        from os.path import dirname
+
+        scan_index = self.scan_stats.scans_completed + 1
+        dir_to_last_change = self._dir_to_last_change
+        encode = os.fsencode if self._scan_bytes_paths else None
+        changed_paths = changes.paths if isinstance(changes, ChangeBatch) else (
+            change[1] for change in changes)
+        for path in changed_paths:
+            dir_path = dirname(path)
+            if encode is not None:
+                dir_path = encode(dir_path)
+            dir_to_last_change[dir_path] = scan_index
+
+        max_entries = self.max_snapshot_entries
+        file_to_mtime = single_visit_info.file_to_mtime
+        dir_to_fingerprint = single_visit_info.dir_to_fingerprint
+        if not max_entries or len(file_to_mtime) + len(dir_to_fingerprint) <= max_entries:
+            return
+
+        # Collapse until a bit below the limit so that it's not done in every scan.
+        target_entries = int(max_entries * .8)
+
+        # Directories with files from `TrackedFiles` are not collapsed.
+        skip_dirs = set()
+        for path_watcher in path_watchers:
+            if isinstance(path_watcher, _FileListWatcher):
+                skip_dirs.update(path_watcher._dir_to_name_to_path)
+
+        visited_dirs = single_visit_info.visited_dirs
+        dir_to_files = {}
+        for path in file_to_mtime:
+            dir_path = dirname(path)
+            if dir_path in visited_dirs and dir_path not in skip_dirs:
+                dir_to_files.setdefault(dir_path, []).append(path)
+
+        # The last change in the subtree of each directory (so that whole cold subtrees
+        # are collapsed before directories near changed ones).
+        subtree_last_change = {}
+        for dir_path in dir_to_files:
+            last_change = dir_to_last_change.get(dir_path, 0)
+            while subtree_last_change.get(dir_path, -1) < last_change:
+                subtree_last_change[dir_path] = last_change
+                parent = dirname(dir_path)
+                if parent == dir_path:
+                    break
+                dir_path = parent
+
+        for dir_path in sorted(dir_to_files, key=lambda d: (
+                subtree_last_change[d], dir_to_last_change.get(d, 0), d)):
+            if len(file_to_mtime) + len(dir_to_fingerprint) <= target_entries:
+                break
+            paths = dir_to_files[dir_path]
+            if len(paths) < 2:
+                continue  # Nothing to gain.
+            dir_to_fingerprint[dir_path] = _create_fingerprint(
+                (path, file_to_mtime.pop(path)) for path in paths)
+            dir_to_last_change.pop(dir_path, None)
+
+    def _iter_check_path_watchers(
+            self, path_watchers, single_visit_info, append_change, old_file_to_mtime):
+        '''
+        Checks the given path watchers (yielding whenever the changes found so far may be
+        provided).
+
+        If `round_robin_slice` is set, the path watchers are checked in slices (switching
+        to the next path watcher after the number of entries in a slice are checked).
+        '''
+        slice_entries = self.round_robin_slice
+        if not slice_entries or len(path_watchers) <= 1:
+            for path_watcher in path_watchers:
                 path_watcher._check(single_visit_info, append_change, old_file_to_mtime)
+                yield
+            return
 
-            # Note that we pop entries while visiting, so, what remained is what's deleted.
-            for entry in old_file_to_mtime:
-                append_change((Change.deleted, entry))
+        ready = deque(
+            path_watcher._iter_check(single_visit_info, append_change, old_file_to_mtime)
+            for path_watcher in path_watchers)
+        while ready:
+            if single_visit_info.cancelled:
+                return
+            it = ready.popleft()
+            target_count = single_visit_info.count + slice_entries
+            for _ in it:
+                if single_visit_info.count >= target_count:
+                    ready.append(it)
+                    break
+            yield
+
+    def _wrap_filters(self, path_watchers, scan_profile):
+        for path_watcher in path_watchers:
+            if isinstance(path_watcher, _PathWatcher):
+                path_watcher.accept_file = scan_profile.wrap_filter(
+                    'accept_file', path_watcher.accept_file)
+                path_watcher.accept_directory = scan_profile.wrap_filter(
+                    'accept_directory', path_watcher.accept_directory)
+
+    def _unwrap_filters(self, path_watchers):
+        for path_watcher in path_watchers:
+            if isinstance(path_watcher, _PathWatcher):
+                # Note: if the filter was changed in the meanwhile, keep the new one.
+                original = getattr(path_watcher.accept_file, 'original', None)
+                if original is not None:
+                    path_watcher.accept_file = original
+                original = getattr(path_watcher.accept_directory, 'original', None)
+                if original is not None:
+                    path_watcher.accept_directory = original
+
+    def _on_profiled_scan(self, scan_time, threshold, scan_profile, cprofile):
+        if cprofile is not None and self.slow_scan_reports:
+            import os.path
+            report = self.slow_scan_reports[-1]
+            report.cprofile_path = os.path.join(
+                self.slow_scan_cprofile_dir,
+                'fsnotify_scan_%s.prof' % (time.strftime('%Y%m%d_%H%M%S'),))
+            cprofile.dump_stats(report.cprofile_path)
+
+        if scan_time > threshold:
+            self.slow_scan_reports.append(scan_profile.create_report(scan_time, threshold))
+            if self.slow_scan_cprofile_dir:
+                self._cprofile_next_scan = True
 
-            for change in changes:
-                yield change
+    @property
+    def last_slow_scan_report(self):
+        '''
+        :rtype: Optional[fsnotify.profiler.SlowScanReport]
+        '''
+        slow_scan_reports = self.slow_scan_reports
+        if slow_scan_reports:
+            return slow_scan_reports[-1]
+        return None
+
+    def _update_metrics(self, scan_time, single_visit_info, changes, tracked_roots):
+        metrics = self.metrics
+        metrics.scans.inc()
+        metrics.scan_duration.observe(scan_time)
+        metrics.entries_scanned.inc(single_visit_info.count)
+        if scan_time > 0:
+            metrics.entries_per_second.set(single_visit_info.count / scan_time)
+        metrics.scan_errors.inc(single_visit_info.errors)
+        metrics.throttle_sleep.inc(single_visit_info.throttle_sleep_time)
+        metrics.snapshot_files.set(len(single_visit_info.file_to_mtime))
+        metrics.snapshot_collapsed_dirs.set(len(single_visit_info.dir_to_fingerprint))
+        metrics.expanded_dirs.inc(single_visit_info.expanded_dirs)
+        metrics.tracked_roots.set(tracked_roots)
+        if changes:
+            codes = changes.changes if isinstance(changes, ChangeBatch) else (
+                change[0] for change in changes)
+            change_to_count = {}
+            for code in codes:
+                change_to_count[code] = change_to_count.get(code, 0) + 1
+            for code, count in change_to_count.items():
+                metrics.changes.inc(count, change=Change(code).name)
+
+    def _wait_between_scans(self, timeout):
+        initial_time = time.time()
+        self._wakeup.wait(timeout)
+        if not self._disposed.is_set():
+            self._wakeup.clear()
+        self.metrics.notification_wait.inc(time.time() - initial_time)
+
+    def wakeup(self):
+        '''
+        Hints that something (probably) changed: the next scan is started right away and
+        the time between scans is restored if backing off (see: `idle_backoff_max_time`).
+        '''
+        if self._engine is not None:
+            self._engine.watcher.wakeup()
+            return
+        self._idle_wait = 0.
+        self._wakeup.set()
 
-            actual_time = (time.time() - initial_time)
-            if self.print_poll_time:
-                print('--- Total poll time: %.3fs' % actual_time)
+    def _get_notification_time(self, changes):
+        '''
+        :return float:
+            The target time from the start of a scan to the start of the next one (which
+            is increased while idle, see: `idle_backoff_max_time`).
+        '''
+        target_time = self.target_time_for_notification
+        max_time = self.idle_backoff_max_time
+        if changes or max_time <= target_time:
+            self._idle_wait = 0.
+            return target_time
+
+        # Note: start from 1 second if scans are done without waiting.
+        idle_wait = max(self._idle_wait, target_time) or 1.
+        self._idle_wait = min(idle_wait * self.idle_backoff_factor, max_time)
+        return self._idle_wait
+
+    def estimate_cost(self, paths, max_time=1., max_subtrees=10, seed=None):
+        '''
+        Estimates the cost of scanning the given paths with the current filters (without
+        tracking them), walking the directories for up to `max_time` seconds (and
+        extrapolating from samples of the subtrees which couldn't be walked in that time).
 
-            if actual_time > 0:
-                if self.target_time_for_single_scan <= 0.0:
-                    for path_watcher in path_watchers:
-                        path_watcher.sleep_time = 0.0
-                else:
-                    perc = self.target_time_for_single_scan / actual_time
+        :param [str|TrackedPath|TrackedFiles] paths:
+            The candidate tracked paths.
 
-                    # Prevent from changing the values too much (go slowly into the right
-                    # direction).
-                    # (to prevent from cases where the user puts the machine on sleep and
-                    # values become too skewed).
-                    if perc > 2.:
-                        perc = 2.
-                    elif perc < 0.5:
-                        perc = 0.5
+        :param int max_subtrees:
+            The number of subtrees in `CostEstimate.largest_subtrees`.
 
-                    for path_watcher in path_watchers:
-                        if path_watcher.sleep_time <= 0.0:
-                            path_watcher.sleep_time = 0.001
-                        new_sleep_time = path_watcher.sleep_time * perc
+        :param seed:
+            The seed for choosing the samples (so that estimates may be reproduced).
 
-                        # Prevent from changing the values too much (go slowly into the right
-                        # direction).
-                        # (to prevent from cases where the user puts the machine on sleep and
-                        # values become too skewed).
-                        diff_sleep_time = new_sleep_time - path_watcher.sleep_time
-                        path_watcher.sleep_time += (diff_sleep_time / (3.0 * len(self._path_watchers)))
+        :rtype: fsnotify.estimator.CostEstimate
+        '''
+        from .estimator import estimate_cost
+        return estimate_cost(
+            self, paths, max_time=max_time, max_subtrees=max_subtrees, seed=seed)
 
-                        if actual_time > 0:
-                            self._disposed.wait(actual_time)
+    def start_metrics_server(self, port=0, host='127.0.0.1'):
+        '''
+        Starts a local http server which provides `self.metrics` in the Prometheus text
+        format (it's stopped on `dispose()`).
 
-                        if path_watcher.sleep_time < 0.001:
-                            path_watcher.sleep_time = 0.001
+        :param int port:
+            The port to use (0 means any free port: use `server.server_address` to get it).
+        '''
+        from .metrics import start_http_server
+        server = start_http_server(self.metrics, port=port, host=host)
+        self._metrics_servers.append(server)
+        return server
 
-            # print('new sleep time: %s' % path_watcher.sleep_time)
+    def _iter_scan_changes(self, stop=None, batches=False):
+        '''
+        Continuously scans the tracked paths (until dispose() is called), providing the
+        list of changes found in each scan (only scans with changes are provided).
 
-            diff = self.target_time_for_notification - actual_time
-            if diff > 0.:
-                self._disposed.wait(diff)
+        :param threading.Event stop:
+            If given, scans are also stopped when it's set.
+
+        :param bool batches:
+            If True the changes found by scans are provided as `ChangeBatch` instances
+            (see: `_iter_scan`). Note: changes from the engine are always lists.
+
+        :rtype: Iterable[List[Tuple[Change, str]|ChangeEvent]|ChangeBatch]
+        '''
+        engine = self._engine
+        while not self._disposed.is_set():
+            if stop is not None and stop.is_set():
+                return
+            if engine is not None:
+                changes = engine._get_changes(self, timeout=.05)
+                if changes:
+                    yield changes
+                continue
+
+            for changes in self._iter_scan_cycle(batches):
+                yield changes
+
+    def _iter_scan_cycle(self, batches=False):
+        '''
+        Does a single scan (providing the changes as they're found), updates the throttling
+        based on the time it took and waits until the next scan should be started.
+
+        :param bool batches:
+            See: `_iter_scan`.
+
+        :rtype: Iterable[List[Tuple[Change, str]|ChangeEvent]|ChangeBatch]
+        '''
+        initial_scan = self._initial_scan
+        if not initial_scan.ready.wait(.05):
+            return
 
+        initial_time = time.time()
+        scan_result = _ScanResult()
+        for changes in self._iter_scan(initial_scan, scan_result, batches):
+            yield changes
+
+        path_watchers = scan_result.path_watchers
+        if path_watchers is None:
+            return  # Tracked paths changed in the meanwhile.
+
+        scan_time = scan_result.scan_time
+        if self.print_poll_time:
+            print('--- Total poll time: %.3fs' % scan_time)
+
+        if scan_time > 0:
+            # Note: the throttling is global (it doesn't depend on the number of
+            # tracked paths).
+            scan_result.throttle.update(self.target_time_for_single_scan, scan_time)
+
+        notification_time = self._get_notification_time(scan_result.changes)
+        self.metrics.notification_time.set(notification_time)
+        # Note: the time spent by the consumer counts here (the time is from the start of
+        # one scan to the start of the next one).
+        diff = notification_time - (time.time() - initial_time)
+        if diff > 0.:
+            self._wait_between_scans(diff)
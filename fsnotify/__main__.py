@@ -0,0 +1,174 @@
+'''
+Command line watcher.
+
+Prints the changes found in the given paths as json lines (one change per line) in the
+stdout, i.e.:
+
+    cd /home/user/project
+    python -m fsnotify --ext .py --stats src tests
+
+    {"seq": 1, "change": "added", "path": "/home/user/project/src/a.py", "size": 10, "mtime": 1600000000.5}
+    {"seq": 2, "change": "deleted", "path": "/home/user/project/src/b.py", "size": null, "mtime": null}
+
+Note: the paths reported are absolute (relative paths given are relative to the current
+directory).
+
+When `--stats` is passed, statistics on the scans (scan time, entries/sec, CPU used)
+are printed to the stderr.
+'''
+import argparse
+import json
+import sys
+import threading
+import time
+
+import fsnotify
+
+
+def _process_time():
+    try:
+        return time.process_time()
+    except AttributeError:  # Python 2
+        import os
+        times = os.times()
+        return times[0] + times[1]
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m fsnotify',
+        description='Watches the given paths and prints the changes as json lines.')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='Directory to watch.')
+    parser.add_argument(
+        '--ext', action='append', dest='extensions', default=[], metavar='EXT',
+        help='Only report files with the given extension (i.e.: .py). May be repeated.')
+    parser.add_argument(
+        '--ignore-dir', action='append', dest='ignored_dirs', default=[], metavar='NAME',
+        help='Directory name to ignore (added to the defaults: %s). May be repeated.' % (
+            ', '.join(sorted(fsnotify.Watcher.ignored_dirs)),))
+    parser.add_argument(
+        '--no-default-ignores', action='store_true',
+        help='Do not ignore the default directories.')
+    parser.add_argument(
+        '--no-recursive', action='store_true', help='Do not watch subdirectories.')
+    parser.add_argument(
+        '--target-scan-time', type=float, default=fsnotify.Watcher.target_time_for_single_scan,
+        metavar='SECONDS',
+        help='Target time for a full scan (0 means no throttling). Default: %(default)s')
+    parser.add_argument(
+        '--target-notification-time', type=float,
+        default=fsnotify.Watcher.target_time_for_notification, metavar='SECONDS',
+        help='Target time from the start of a scan to the start of the next one. '
+        'Default: %(default)s')
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='Print statistics on the scans (scan time, entries/sec, CPU used) to the stderr.')
+    parser.add_argument(
+        '--stats-interval', type=float, default=5., metavar='SECONDS',
+        help='Interval to print the statistics. Default: %(default)s')
+    return parser
+
+
+def create_watcher(args):
+    '''
+    :rtype: fsnotify.Watcher
+    '''
+    watcher = fsnotify.Watcher()
+    watcher.rich_change_events = True
+    watcher.target_time_for_single_scan = args.target_scan_time
+    watcher.target_time_for_notification = args.target_notification_time
+    if args.extensions:
+        watcher.accepted_file_extensions = tuple(args.extensions)
+
+    ignored_dirs = set() if args.no_default_ignores else set(watcher.ignored_dirs)
+    ignored_dirs.update(args.ignored_dirs)
+    watcher.ignored_dirs = ignored_dirs
+    return watcher
+
+
+def change_to_json(seq, change):
+    '''
+    :type change: fsnotify.ChangeEvent
+    '''
+    mtime = change.mtime_ns / 1e9 if change.mtime_ns is not None else None
+    return json.dumps({
+        'seq': seq,
+        'change': change.change.name,
+        'path': change.path,
+        'size': change.size,
+        'mtime': mtime,
+    })
+
+
+class _StatsPrinter(threading.Thread):
+
+    def __init__(self, watcher, interval, stream):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = 'fsnotify stats'
+        self._watcher = watcher
+        self._interval = interval
+        self._stream = stream
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        last_time = time.time()
+        last_cpu = _process_time()
+        while not self._stop_event.wait(self._interval):
+            curr_time = time.time()
+            curr_cpu = _process_time()
+            elapsed = curr_time - last_time
+            cpu_percent = 100. * (curr_cpu - last_cpu) / elapsed if elapsed > 0 else 0.
+            last_time, last_cpu = curr_time, curr_cpu
+
+            stats = self._watcher.scan_stats
+            self._stream.write(
+                'scans: %s, last scan: %.3fs, entries: %s, entries/sec: %.0f, files: %s, '
+                'changes: %s, cpu: %.1f%% (total: %.2fs)\n' % (
+                    stats.scans_completed,
+                    stats.last_scan_time,
+                    stats.last_entries_scanned,
+                    stats.entries_per_second,
+                    stats.last_files_found,
+                    stats.total_changes,
+                    cpu_percent,
+                    curr_cpu,
+                ))
+            self._stream.flush()
+
+
+def main(argv=None, stdout=None, stderr=None):
+    args = _create_parser().parse_args(argv)
+    stdout = stdout if stdout is not None else sys.stdout
+    stderr = stderr if stderr is not None else sys.stderr
+
+    watcher = create_watcher(args)
+    watcher.set_tracked_paths(
+        [fsnotify.TrackedPath(path, not args.no_recursive) for path in args.paths])
+
+    stats_printer = None
+    if args.stats:
+        stats_printer = _StatsPrinter(watcher, args.stats_interval, stderr)
+        stats_printer.start()
+
+    seq = 0
+    try:
+        for change in watcher.iter_changes():
+            seq += 1
+            stdout.write(change_to_json(seq, change))
+            stdout.write('\n')
+            stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.dispose()
+        if stats_printer is not None:
+            stats_printer.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
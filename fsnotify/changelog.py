@@ -0,0 +1,121 @@
+'''
+Bounded log of the changes reported by a `Watcher` (with sequence numbers), so that
+consumers may poll for what changed since they last looked instead of having to iterate
+`iter_changes()` themselves, i.e.:
+
+    watcher.set_tracked_paths([target_dir])
+    watcher.start_background_scan()
+
+    cursor = 0
+    while True:
+        result = watcher.changes_since(cursor)
+        if result.expired:
+            ...  # Changes were lost: a full resync is needed.
+        for change in result.changes:
+            ...
+        cursor = result.last_seq
+'''
+import itertools
+import threading
+from collections import deque
+
+
+class ChangesSince(object):
+
+    __slots__ = ['changes', 'last_seq', 'expired']
+
+    def __init__(self, changes, last_seq, expired):
+        # The changes after the requested sequence number (empty if expired).
+        self.changes = changes
+
+        # The cursor to use in the next call.
+        self.last_seq = last_seq
+
+        # Whether the changes after the requested sequence number are no longer
+        # available (i.e.: they were dropped from the log or the tracked paths were
+        # changed), in which case the consumer must do a full resync.
+        self.expired = expired
+
+
+class ChangeLog(object):
+    '''
+    Ring buffer with the last `max_size` changes (each change gets a sequence number which
+    is increased by 1 for each change, starting at 1).
+    '''
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._changes = deque(maxlen=max_size) if max_size > 0 else None
+        self._last_seq = 0
+
+        # Cursors up to this sequence number are expired.
+        self._expired_seq = 0
+
+    @property
+    def last_seq(self):
+        return self._last_seq
+
+    @property
+    def first_seq(self):
+        '''
+        :return int:
+            The sequence number of the oldest change still available.
+        '''
+        with self._lock:
+            changes = self._changes
+            return self._last_seq - (len(changes) if changes is not None else 0) + 1
+
+    def append(self, changes):
+        with self._lock:
+            self._last_seq += len(changes)
+            if self._changes is not None:
+                self._changes.extend(changes)
+            else:
+                self._expired_seq = self._last_seq
+
+    def append_batch(self, batch):
+        '''
+        :param fsnotify.ChangeBatch batch:
+            The changes to append (only the ones which fit in the log are converted to
+            the changes provided by `Watcher.iter_changes()`).
+        '''
+        with self._lock:
+            self._last_seq += len(batch)
+            changes = self._changes
+            if changes is not None:
+                changes.extend(batch[-changes.maxlen:].to_changes())
+            else:
+                self._expired_seq = self._last_seq
+
+    def expire_cursors(self):
+        '''
+        Expires all the cursors given so far (i.e.: changes are not available across
+        changes to the tracked paths).
+        '''
+        with self._lock:
+            # Skip a sequence number so that the current cursors are expired.
+            self._last_seq += 1
+            self._expired_seq = self._last_seq
+            if self._changes is not None:
+                self._changes.clear()
+
+    def changes_since(self, seq):
+        '''
+        :param int seq:
+            The `last_seq` of the previous call (or 0 to get all the changes since the
+            watcher was created).
+
+        :rtype: ChangesSince
+        '''
+        with self._lock:
+            last_seq = self._last_seq
+            if seq == last_seq:
+                return ChangesSince([], last_seq, False)
+
+            changes = self._changes
+            first_seq = last_seq - (len(changes) if changes is not None else 0) + 1
+            if seq > last_seq or seq < self._expired_seq or seq < first_seq - 1:
+                return ChangesSince([], last_seq, True)
+
+            start = seq - first_seq + 1
+            return ChangesSince(list(itertools.islice(changes, start, None)), last_seq, False)
@@ -0,0 +1,462 @@
+'''
+Process-wide scanning engine shared by `Watcher` instances.
+
+When different parts of a process create their own `Watcher` for overlapping trees,
+each one would do its own scans (and keep its own snapshot). Watchers created with an
+engine register their tracked paths with it instead: the engine scans the union of the
+tracked paths (so, each directory is scanned only once) and each watcher receives only
+the changes accepted by its own tracked paths and filters, i.e.:
+
+    from fsnotify.engine import get_shared_engine
+
+    watcher = fsnotify.Watcher(engine=get_shared_engine())
+    watcher.accepted_file_extensions = ('.py',)
+    watcher.set_tracked_paths([target_dir])
+    for change in watcher.iter_changes():
+        ...
+
+Notes:
+
+- The filters of the registered watchers are combined (a directory/file is scanned if
+  any of the watchers whose tracked paths contain it accepts it), so, filters must be
+  cheap and thread-safe as they're called from the engine thread.
+- Throttling uses the lowest `target_time_for_single_scan`,
+  `target_time_for_notification` and `idle_backoff_max_time` of the registered
+  watchers.
+- Log files are tracked for the union of the `log_file_patterns` of the registered
+  watchers (watchers which don't track a file as a log file get `Change.modified`).
+- Scan statistics/metrics are available in the engine watcher (`SharedEngine.watcher`).
+- Changes are queued for each watcher until they're consumed by `iter_changes()` (or
+  `subscribe()`), so, registered watchers must be consumed or disposed.
+- If the filters of a watcher raise an exception, the watcher is unregistered and the
+  exception is raised in its own thread (by `set_tracked_paths()` if the initial scan
+  isn't in the background or by `iter_changes()` otherwise).
+'''
+import os
+import threading
+
+from fsnotify import (
+    Change, ChangeEvent, InitialScan, TrackedFiles, TrackedPath, Watcher,
+    _create_append_change, _create_log_file_filter, _get_modified_change, _RootsTrie,
+    _SingleVisitInfo, ScandirProvider, queue)
+
+# The changes which are only reported to watchers tracking the file as a log file.
+_LOG_FILE_CHANGES = frozenset([Change.appended, Change.truncated, Change.rotated])
+
+_shared_engine = None
+_shared_engine_lock = threading.Lock()
+
+
+def get_shared_engine():
+    '''
+    :return SharedEngine:
+        The engine shared by the whole process (created on the first call).
+    '''
+    global _shared_engine
+    with _shared_engine_lock:
+        if _shared_engine is None:
+            _shared_engine = SharedEngine()
+        return _shared_engine
+
+
+class _Registration(object):
+    '''
+    The paths tracked by a watcher registered in the engine.
+    '''
+
+    def __init__(self, watcher, paths):
+        self.watcher = watcher
+        self.initial_scan = InitialScan(_SingleVisitInfo(), 1)
+        self.max_recursion_level = watcher.max_recursion_level
+        self.log_file_patterns = tuple(watcher.log_file_patterns)
+        self.is_log_file = _create_log_file_filter(self.log_file_patterns)
+
+        # The exception raised by the watcher filters (the registration is dropped).
+        self.error = None
+
+        self.roots = []  # List[Tuple[str, bool]]
+        self.files = set()
+        for path in paths:
+            if isinstance(path, TrackedFiles):
+                self.files.update(os.path.abspath(p) for p in path.paths)
+            elif isinstance(path, TrackedPath):
+                self.roots.append((os.path.abspath(path.path), bool(path.recursive)))
+            else:
+                self.roots.append((os.path.abspath(path), True))
+
+        # engine_spelling -> List[Tuple[own_spelling, recursive]]
+        self._bound_roots = {}
+
+    def bind(self, trie):
+        '''
+        Computes how the tracked paths are spelled in the paths reported by the engine
+        (which uses the spelling of the outermost tracked path).
+
+        :type trie: _RootsTrie
+        '''
+        bound_roots = {}
+        for root, recursive in self.roots:
+            engine_spelling = trie.get_spelling(root)
+            if engine_spelling is not None:
+                bound_roots.setdefault(engine_spelling, []).append((root, recursive))
+        self._bound_roots = bound_roots
+
+    def filter_changes(self, changes):
+        '''
+        :param List[ChangeEvent] changes:
+            The changes found by the engine.
+
+        :return List[Tuple[Change, str]|ChangeEvent]:
+            The changes accepted by the watcher (spelled as the watcher's tracked paths).
+        '''
+        watcher = self.watcher
+        rich_change_events = watcher.rich_change_events
+        accept_directory = watcher.accept_directory
+        accept_file = watcher.accept_file
+        max_recursion_level = self.max_recursion_level
+        bound_roots = self._bound_roots
+        dirname = os.path.dirname
+        dir_to_accepted = {}
+
+        def is_dir_accepted(dir_path):
+            accepted = dir_to_accepted.get(dir_path)
+            if accepted is None:
+                accepted = dir_to_accepted[dir_path] = bool(accept_directory(dir_path))
+            return accepted
+
+        ret = []
+        for change in changes:
+            path = change.path
+            accepted_path = path if path in self.files else None
+
+            if accepted_path is None:
+                # Look for the tracked paths containing the change going up from its
+                # directory (so, the cost doesn't depend on the number of tracked paths).
+                # `below` has the directories between the tracked path and the change.
+                below = []
+                current = dirname(path)
+                while accepted_path is None:
+                    for root, recursive in bound_roots.get(current, ()):
+                        if below and (not recursive or len(below) > max_recursion_level):
+                            continue
+                        if all(is_dir_accepted(d) for d in below) and accept_file(path):
+                            accepted_path = root + path[len(current):]
+                            break
+
+                    parent = dirname(current)
+                    if parent == current:
+                        break
+                    below.append(current)
+                    current = parent
+
+            if accepted_path is None:
+                continue
+
+            change_type = change.change
+            if change_type in _LOG_FILE_CHANGES and (
+                    self.is_log_file is None or not self.is_log_file(path)):
+                change_type = Change.modified
+
+            if accepted_path != path or change_type != change.change:
+                change = ChangeEvent(
+                    change_type, accepted_path, change.mtime_ns, change.size,
+                    change.old_mtime_ns, change.old_size)
+
+            if rich_change_events:
+                ret.append(change)
+            else:
+                ret.append((change.change, change.path))
+        return ret
+
+
+class SharedEngine(object):
+    '''
+    Scans the union of the paths tracked by the registered watchers (see the module
+    docstring).
+    '''
+
+    def __init__(self, provider=None):
+        '''
+        :param ScandirProvider provider:
+            The provider used to scan (see: `Watcher.__init__`).
+        '''
+        self._lock = threading.Lock()
+        self._registrations = {}  # Watcher -> _Registration
+
+        # engine_spelling -> List[Tuple[_Registration, recursive]] (see: `_Registration.bind`).
+        self._root_to_registrations = {}
+
+        # dir -> Tuple[_Registration] whose tracked paths contain the dir (cache for the
+        # filters, which is cleared when the registrations change).
+        self._dir_to_registrations = {}
+        self._pending = {}  # Watcher -> Optional[_Registration]
+        self._tracked = None
+        self._thread = None
+        self._disposed = False
+
+        # The watcher which actually does the scans.
+        self.watcher = Watcher(self._accept_directory, self._accept_file, provider=provider)
+        self.watcher.rich_change_events = True
+
+    def _accept_directory(self, dir_path):
+        for registration in self._get_registrations(dir_path):
+            if registration.error is None:
+                try:
+                    if registration.watcher.accept_directory(dir_path):
+                        return True
+                except Exception as e:
+                    self._fail(registration, e)
+        return False
+
+    def _accept_file(self, path):
+        for registration in self._get_registrations(os.path.dirname(path)):
+            if registration.error is None:
+                try:
+                    if registration.watcher.accept_file(path):
+                        return True
+                except Exception as e:
+                    self._fail(registration, e)
+        return False
+
+    def _fail(self, registration, error):
+        '''
+        Called when the filters of a registration raise an exception: the error is
+        provided to the watcher and the registration is dropped (so, the engine keeps on
+        scanning for the other watchers).
+        '''
+        if registration.error is not None:
+            return
+        registration.error = error
+        initial_scan = registration.initial_scan
+        if initial_scan.is_ready() or registration.watcher.background_initial_scan:
+            registration.watcher._engine_changes.put(error)
+        else:
+            # `register()` raises it.
+            initial_scan.cancel()
+            initial_scan._mark_ready()
+
+        with self._lock:
+            if registration.watcher not in self._pending:
+                self._pending[registration.watcher] = None
+
+    def _get_registrations(self, dir_path):
+        '''
+        :return Tuple[_Registration]:
+            The registrations with some tracked path containing the given directory (only
+            their filters are used for it, so, a watcher accepting everything doesn't make
+            the engine scan directories ignored by the watchers which track them).
+        '''
+        registrations = self._dir_to_registrations.get(dir_path)
+        if registrations is None:
+            found = []
+            root_to_registrations = self._root_to_registrations
+            dirname = os.path.dirname
+            current = dir_path
+            level = 0
+            while True:
+                for registration, recursive in root_to_registrations.get(current, ()):
+                    if level == 0 or (recursive and level <= registration.max_recursion_level):
+                        if registration not in found:
+                            found.append(registration)
+                parent = dirname(current)
+                if parent == current:
+                    break
+                current = parent
+                level += 1
+            registrations = self._dir_to_registrations[dir_path] = tuple(found)
+        return registrations
+
+    def _set_registrations(self, registrations):
+        root_to_registrations = {}
+        for registration in registrations.values():
+            for engine_spelling, roots in registration._bound_roots.items():
+                for _root, recursive in roots:
+                    root_to_registrations.setdefault(engine_spelling, []).append(
+                        (registration, recursive))
+        self._registrations = registrations
+        self._root_to_registrations = root_to_registrations
+        self._dir_to_registrations = {}
+
+    def register(self, watcher, paths):
+        '''
+        Registers (or updates) the paths tracked by the given watcher (called from
+        `Watcher.set_tracked_paths()`).
+
+        :rtype: InitialScan
+        '''
+        registration = _Registration(watcher, paths)
+        with self._lock:
+            if self._disposed:
+                raise RuntimeError('The engine is already disposed.')
+            self._pending[watcher] = registration
+            if self._thread is None:
+                t = threading.Thread(target=self._run)
+                t.name = 'fsnotify shared engine'
+                t.daemon = True
+                self._thread = t
+                t.start()
+        self.watcher._wakeup.set()
+
+        if not watcher.background_initial_scan:
+            registration.initial_scan.wait()
+            if registration.error is not None:
+                raise registration.error
+        return registration.initial_scan
+
+    def unregister(self, watcher):
+        with self._lock:
+            if watcher in self._registrations or watcher in self._pending:
+                self._pending[watcher] = None
+        self.watcher._wakeup.set()
+
+    def dispose(self):
+        with self._lock:
+            self._disposed = True
+            pending = [r for r in self._pending.values() if r is not None]
+            self._pending = {}
+        for registration in pending:
+            registration.initial_scan.cancel()
+            registration.initial_scan._mark_ready()
+        self.watcher.dispose()
+
+    def _get_changes(self, watcher, timeout):
+        '''
+        :return Optional[List[Tuple[Change, str]|ChangeEvent]]:
+            The next batch of changes for the given watcher (or None if there are no
+            changes until the timeout elapses).
+        '''
+        try:
+            changes = watcher._engine_changes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if isinstance(changes, Exception):
+            raise changes
+        return changes
+
+    def _run(self):
+        engine_watcher = self.watcher
+        try:
+            while True:
+                with self._lock:
+                    if self._disposed or (not self._registrations and not self._pending):
+                        self._thread = None
+                        return
+
+                self._apply_pending()
+
+                registrations = list(self._registrations.values())
+                for changes in engine_watcher._iter_scan_cycle():
+                    self._dispatch(registrations, changes)
+        finally:
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    # Unexpected error: a new thread is started by the next register().
+                    self._thread = None
+
+    def _dispatch(self, registrations, changes):
+        for registration in registrations:
+            if registration.error is not None:
+                continue
+            try:
+                accepted = registration.filter_changes(changes)
+            except Exception as e:
+                self._fail(registration, e)
+                continue
+            if accepted:
+                registration.watcher.change_log.append(accepted)
+                registration.watcher._engine_changes.put(accepted)
+
+    def _apply_pending(self):
+        '''
+        Applies the registrations done since the last scan (rescanning the tracked paths
+        if their union changed).
+        '''
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return
+
+        registrations = dict(self._registrations)
+        for watcher, registration in pending.items():
+            if registration is None:
+                registrations.pop(watcher, None)
+            else:
+                registrations[watcher] = registration
+
+        # The registrations kept get the changes found between the old and the new
+        # snapshot (new registrations just start from the new snapshot).
+        kept = [
+            registration for watcher, registration in registrations.items()
+            if watcher not in pending]
+
+        roots = {}
+        files = set()
+        max_recursion_level = 0
+        log_file_patterns = set()
+        for registration in registrations.values():
+            for root, recursive in registration.roots:
+                roots[root] = roots.get(root, False) or recursive
+            files.update(registration.files)
+            max_recursion_level = max(max_recursion_level, registration.max_recursion_level)
+            log_file_patterns.update(registration.log_file_patterns)
+
+        engine_watcher = self.watcher
+        if registrations:
+            engine_watcher.target_time_for_single_scan = min(
+                r.watcher.target_time_for_single_scan for r in registrations.values())
+            engine_watcher.target_time_for_notification = min(
+                r.watcher.target_time_for_notification for r in registrations.values())
+            engine_watcher.idle_backoff_max_time = min(
+                r.watcher.idle_backoff_max_time for r in registrations.values())
+
+        trie = _RootsTrie(resolve_symlinks=isinstance(engine_watcher.provider, ScandirProvider))
+        for root, recursive in roots.items():
+            trie.add(root, recursive)
+        for registration in registrations.values():
+            registration.bind(trie)
+
+        tracked = (
+            sorted(roots.items()), sorted(files), max_recursion_level, sorted(log_file_patterns))
+        if tracked != self._tracked:
+            self._tracked = tracked
+            old_file_to_mtime = engine_watcher._single_visit_info.file_to_mtime
+
+            # Note: the filters use the new registrations from here on.
+            self._set_registrations(registrations)
+            engine_watcher.max_recursion_level = max_recursion_level
+            engine_watcher.log_file_patterns = tuple(sorted(log_file_patterns))
+            tracked_paths = [TrackedPath(root, recursive) for root, recursive in sorted(roots.items())]
+            if files:
+                tracked_paths.append(TrackedFiles(sorted(files)))
+            engine_watcher.set_tracked_paths(tracked_paths)
+
+            if kept:
+                changes = self._diff_snapshots(
+                    old_file_to_mtime, engine_watcher._single_visit_info.file_to_mtime)
+                if changes:
+                    self._dispatch(kept, changes)
+        else:
+            self._set_registrations(registrations)
+
+        # The counts of the initial scan refer to the whole (shared) snapshot.
+        final_counts = engine_watcher.initial_scan._get_counts()
+        for registration in pending.values():
+            if registration is not None and registration.error is None:
+                registration.initial_scan.roots_done = 1
+                registration.initial_scan._mark_ready(final_counts)
+
+    def _diff_snapshots(self, old_file_to_mtime, new_file_to_mtime):
+        changes = []
+        append_change = _create_append_change(changes, True)
+        for path, mtime in new_file_to_mtime.items():
+            old_mtime = old_file_to_mtime.get(path)
+            if old_mtime is None:
+                append_change(Change.added, path, mtime, None)
+            elif old_mtime != mtime:
+                append_change(_get_modified_change(mtime, old_mtime), path, mtime, old_mtime)
+
+        for path, old_mtime in old_file_to_mtime.items():
+            if path not in new_file_to_mtime:
+                append_change(Change.deleted, path, None, old_mtime)
+        return changes
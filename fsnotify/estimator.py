@@ -0,0 +1,250 @@
+'''
+Estimates the cost of scanning candidate tracked paths before they're tracked (so that
+huge trees such as a home directory or `/` may be detected and excluded), i.e.:
+
+    estimate = watcher.estimate_cost([candidate_dir], max_time=1.0)
+    if estimate.scan_time > watcher.target_time_for_single_scan:
+        for path, entries in estimate.largest_subtrees:
+            ...
+
+The directories are walked using the filters of the watcher (`accept_directory`,
+`accept_file`, `max_recursion_level` and `follow_symlinks`). If the walk can't be done
+in the given time, the subtrees which weren't fully walked are estimated with random
+probes (a probe goes down a random path in the subtree and extrapolates the counts
+found based on the number of subdirectories in each directory along that path) until
+the deadline (subtrees which couldn't be probed are extrapolated from the probed ones).
+'''
+import random
+import time
+
+from fsnotify import FollowSymlinks, ScandirProvider, TrackedFiles, TrackedPath, _RootsTrie
+
+
+class CostEstimate(object):
+
+    __slots__ = ['entries', 'dirs', 'files', 'scan_time', 'largest_subtrees', 'exact']
+
+    def __init__(self):
+        # The estimated number of entries (files and directories) listed in a scan.
+        self.entries = 0
+
+        # The estimated number of directories listed in a scan.
+        self.dirs = 0
+
+        # The estimated number of files accepted (i.e.: files in the snapshot).
+        self.files = 0
+
+        # The estimated time (in seconds) for a scan without throttling (based on the
+        # time it took to list/stat the entries sampled).
+        self.scan_time = 0.
+
+        # List[Tuple[str, int]]: the subtrees (directories right below the tracked paths)
+        # with the most entries (and the estimated number of entries in each one).
+        self.largest_subtrees = []
+
+        # Whether the whole tree was walked (so, the counts are exact).
+        self.exact = True
+
+    def __repr__(self):
+        return 'CostEstimate(entries=%s, dirs=%s, files=%s, scan_time=%.3f, exact=%s)' % (
+            self.entries, self.dirs, self.files, self.scan_time, self.exact)
+
+
+class _DirInfo(object):
+
+    __slots__ = ['entries', 'files', 'subdirs']
+
+    def __init__(self, entries, files, subdirs):
+        self.entries = entries
+        self.files = files
+        self.subdirs = subdirs
+
+
+class _Estimator(object):
+
+    def __init__(self, watcher, deadline, rnd):
+        self.provider = watcher.provider
+        self.accept_directory = watcher.accept_directory
+        self.accept_file = watcher.accept_file
+        self.max_recursion_level = watcher.max_recursion_level
+        self.follow_symlinks = watcher.follow_symlinks
+        self.deadline = deadline
+        self.rnd = rnd
+
+        # Directories listed so far (so that probes going through the same directories
+        # don't list them again).
+        self._dir_to_info = {}
+
+        # The (st_dev, st_ino) of the directories listed (as in the scan, when symlinks
+        # are followed, each directory is counted only once).
+        self._dir_ids = set()
+
+        # Used to compute the scan rate.
+        self.listed_entries = 0
+        self.listing_time = 0.
+
+    def list_dir(self, dir_path, level):
+        '''
+        :rtype: _DirInfo
+        '''
+        info = self._dir_to_info.get(dir_path)
+        if info is not None:
+            return info
+
+        if self.follow_symlinks != FollowSymlinks.never:
+            try:
+                stat = self.provider.stat(dir_path)
+            except OSError:
+                pass
+            else:
+                st_ino = getattr(stat, 'st_ino', 0)
+                if st_ino:
+                    dir_id = (stat.st_dev, st_ino)
+                    if dir_id in self._dir_ids:
+                        info = self._dir_to_info[dir_path] = _DirInfo(0, 0, [])
+                        return info
+                    self._dir_ids.add(dir_id)
+
+        initial_time = time.time()
+        entries = 0
+        files = 0
+        subdirs = []
+        try:
+            for entry in self.provider.scandir(dir_path):
+                entries += 1
+                if entry.is_dir():
+                    if level < self.max_recursion_level and self.accept_directory(entry.path):
+                        if self.follow_symlinks != FollowSymlinks.always and entry.is_symlink():
+                            continue
+                        subdirs.append(entry.path)
+                elif self.accept_file(entry.path):
+                    files += 1
+                    try:
+                        entry.stat()  # So that the time is comparable to a scan.
+                    except OSError:
+                        pass
+        except OSError:
+            pass  # Not there or no permission (just count it as empty).
+
+        self.listing_time += time.time() - initial_time
+        self.listed_entries += entries
+        info = self._dir_to_info[dir_path] = _DirInfo(entries, files, subdirs)
+        return info
+
+    def walk(self, dir_path, level):
+        '''
+        :return Optional[Tuple[int, int, int]]:
+            The exact (entries, dirs, files) of the subtree (or None if it couldn't be
+            walked before the deadline).
+        '''
+        entries = dirs = files = 0
+        stack = [(dir_path, level)]
+        while stack:
+            if time.time() > self.deadline:
+                return None
+            dir_path, level = stack.pop()
+            info = self.list_dir(dir_path, level)
+            entries += info.entries
+            dirs += 1
+            files += info.files
+            stack.extend((subdir, level + 1) for subdir in info.subdirs)
+        return entries, dirs, files
+
+    def probe(self, dir_path, level, check_deadline=True):
+        '''
+        :return Optional[Tuple[float, float, float]]:
+            The (entries, dirs, files) of the subtree extrapolated from a random path (or
+            None if the deadline was reached before the probe was finished).
+        '''
+        entries = dirs = files = 0.
+        weight = 1.
+        while True:
+            if check_deadline and time.time() > self.deadline:
+                return None
+            info = self.list_dir(dir_path, level)
+            entries += weight * info.entries
+            dirs += weight
+            files += weight * info.files
+            if not info.subdirs:
+                return entries, dirs, files
+            weight *= len(info.subdirs)
+            dir_path = self.rnd.choice(info.subdirs)
+            level += 1
+
+
+def estimate_cost(watcher, paths, max_time=1., max_subtrees=10, seed=None):
+    '''
+    See: `Watcher.estimate_cost()`.
+    '''
+    if not isinstance(paths, (list, tuple, set)):
+        paths = (paths,)
+    initial_time = time.time()
+    estimator = _Estimator(watcher, initial_time + max_time, random.Random(seed))
+    estimate = CostEstimate()
+
+    trie = _RootsTrie(resolve_symlinks=isinstance(watcher.provider, ScandirProvider))
+    for path in paths:
+        if isinstance(path, TrackedFiles):
+            estimate.entries += len(path.paths)
+            estimate.files += len(path.paths)
+        elif isinstance(path, TrackedPath):
+            trie.add(path.path, path.recursive)
+        else:
+            trie.add(path, True)
+
+    # The subdirectories right below the roots are estimated separately (first walked
+    # and, if not done in half of the time, estimated with probes in the remaining time).
+    half_deadline = initial_time + max_time / 2.
+    subtrees = []  # List[Tuple[str, Optional[Tuple[int, int, int]], List[tuple]]]
+    for root_path, recursive, _nested_roots in trie.iter_roots():
+        # Note: for non-recursive paths, the level is set so that subdirs aren't listed.
+        info = estimator.list_dir(root_path, 0 if recursive else watcher.max_recursion_level)
+        estimate.entries += info.entries
+        estimate.dirs += 1
+        estimate.files += info.files
+        for subdir in info.subdirs:
+            estimator.deadline = half_deadline
+            subtrees.append([subdir, estimator.walk(subdir, 1), []])
+
+    estimator.deadline = initial_time + max_time
+    pending = [subtree for subtree in subtrees if subtree[1] is None]
+    if pending:
+        estimate.exact = False
+        # The subtrees are probed in turns until the deadline (note: the first probe is
+        # always finished so that there's something to extrapolate from).
+        first = True
+        while True:
+            for subtree in pending:
+                counts = estimator.probe(subtree[0], 1, check_deadline=not first)
+                first = False
+                if counts is None:
+                    break
+                subtree[2].append(counts)
+            if time.time() > estimator.deadline:
+                break
+
+        probed = []
+        for subtree in pending:
+            probes = subtree[2]
+            if probes:
+                subtree[1] = tuple(sum(counts) / len(probes) for counts in zip(*probes))
+                probed.append(subtree[1])
+
+        # Subtrees which couldn't be probed are extrapolated from the probed ones.
+        average = tuple(sum(counts) / len(probed) for counts in zip(*probed))
+        for subtree in pending:
+            subtree[1] = tuple(int(round(count)) for count in (subtree[1] or average))
+
+    for _subdir, (entries, dirs, files), _probes in subtrees:
+        estimate.entries += entries
+        estimate.dirs += dirs
+        estimate.files += files
+
+    estimate.largest_subtrees = sorted(
+        ((subdir, counts[0]) for subdir, counts, _probes in subtrees),
+        key=lambda item: (-item[1], item[0]))[:max_subtrees]
+
+    if estimator.listed_entries and estimator.listing_time > 0:
+        entries_per_second = estimator.listed_entries / estimator.listing_time
+        estimate.scan_time = estimate.entries / entries_per_second
+    return estimate
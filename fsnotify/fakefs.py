@@ -0,0 +1,309 @@
+'''
+In-memory synthetic filesystem which may be used as the `Watcher` provider (so that the
+scanning/diff/throttling logic may be benchmarked at scale without creating the files in
+the disk).
+
+The tree is generated lazily from a seed (each directory has `dirs_per_dir` directories
+up to the given `depth` and `files_per_dir` files), so, only the changes done afterwards
+(through `add_file`, `modify_file`, `delete` or `churn`) are actually kept in memory.
+
+Sample usage:
+
+    from fsnotify.fakefs import FakeFilesystem
+
+    # 10 * 10 * 10 directories with 1000 files each: ~1M entries.
+    fs = FakeFilesystem('/fake', depth=3, dirs_per_dir=10, files_per_dir=1000)
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.set_tracked_paths('/fake')
+
+    expected_changes = fs.churn(1000)
+    for change in watcher.iter_changes():
+        ...
+'''
+import os
+import random
+import stat
+import threading
+import zlib
+
+from fsnotify import Change
+
+_DIR = object()
+
+
+class FakeStat(object):
+
+    __slots__ = ['st_mtime_ns', 'st_size', 'st_mode', 'st_ino', 'st_dev']
+
+    def __init__(self, st_mtime_ns, st_size, st_mode, st_ino=0, st_dev=0):
+        self.st_mtime_ns = st_mtime_ns
+        self.st_size = st_size
+        self.st_mode = st_mode
+        self.st_ino = st_ino
+        self.st_dev = st_dev
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+
+class FakeDirEntry(object):
+
+    __slots__ = ['name', 'path', '_node']
+
+    def __init__(self, dir_path, name, node):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+        self._node = node  # _DIR or (mtime_ns, size)
+
+    def is_dir(self, follow_symlinks=True):
+        return self._node is _DIR
+
+    def is_file(self, follow_symlinks=True):
+        return self._node is not _DIR
+
+    def is_symlink(self):
+        return False
+
+    def stat(self, follow_symlinks=True):
+        return _stat_from_node(self._node)
+
+
+def _stat_from_node(node):
+    if node is _DIR:
+        return FakeStat(0, 0, stat.S_IFDIR | 0o755)
+    return FakeStat(node[0], node[1], stat.S_IFREG | 0o644)
+
+
+class FakeFilesystem(object):
+    '''
+    A provider (see: `fsnotify.ScandirProvider`) for an in-memory synthetic tree.
+    '''
+
+    # Base mtime for the generated files.
+    base_mtime_ns = 1500000000 * 10 ** 9
+
+    def __init__(
+            self, root, seed=0, depth=2, dirs_per_dir=10, files_per_dir=100,
+            file_extensions=('.py', '.txt')):
+        '''
+        :param str root:
+            The root of the fake filesystem (paths outside of it don't exist).
+
+        :param int depth:
+            The number of directory levels below the root.
+        '''
+        self.root = os.path.normpath(root)
+        self.seed = seed
+        self.depth = depth
+        self.dirs_per_dir = dirs_per_dir
+        self.files_per_dir = files_per_dir
+        self.file_extensions = tuple(file_extensions)
+
+        self._lock = threading.Lock()
+
+        # dir_path -> {name: _DIR|(mtime_ns, size)|None (deleted)}
+        self._dir_to_overrides = {}
+        self._mtime_ns = self.base_mtime_ns
+
+        # dir_path -> mtime_ns (for directories whose entries changed).
+        self._dir_to_mtime_ns = {}
+
+        # Used to count the calls to the provider.
+        self.scandir_count = 0
+        self.stat_count = 0
+
+    def _level(self, dir_path):
+        '''
+        :return int:
+            The level of the given directory (0 for the root) or -1 if outside the root.
+        '''
+        if dir_path == self.root:
+            return 0
+        if not dir_path.startswith(self.root + os.sep):
+            return -1
+        return dir_path[len(self.root):].count(os.sep)
+
+    def _dir_seed(self, dir_path):
+        return zlib.crc32(('%s:%s' % (self.seed, dir_path)).encode('utf-8')) & 0xffffffff
+
+    def _iter_generated(self, dir_path, level):
+        '''
+        Provides the (name, node) for the generated entries of a directory.
+        '''
+        if level < self.depth:
+            for i in range(self.dirs_per_dir):
+                yield 'dir_%04d' % (i,), _DIR
+
+        dir_seed = self._dir_seed(dir_path)
+        for i in range(self.files_per_dir):
+            yield self._generated_file(dir_seed, i)
+
+    def _generated_file(self, dir_seed, i):
+        h = (dir_seed + i * 2654435761) & 0xffffffff
+        extensions = self.file_extensions
+        return 'file_%05d%s' % (i, extensions[h % len(extensions)]), (
+            self.base_mtime_ns - (h % 10 ** 6) * 10 ** 9, h % 65536)
+
+    def _get_generated_node(self, dir_path, level, name):
+        try:
+            if name.startswith('dir_'):
+                if level < self.depth and int(name[4:]) < self.dirs_per_dir and len(name) == 8:
+                    return _DIR
+            elif name.startswith('file_'):
+                i = int(os.path.splitext(name)[0][5:])
+                if i < self.files_per_dir:
+                    generated_name, node = self._generated_file(self._dir_seed(dir_path), i)
+                    if generated_name == name:
+                        return node
+        except ValueError:
+            pass
+        return None
+
+    def _get_node_unlocked(self, path):
+        '''
+        :return _DIR|Tuple[int, int]|None:
+            The node for the given (normalized) path or None if it doesn't exist.
+        '''
+        if path == self.root:
+            return _DIR
+        level = self._level(path)
+        if level <= 0:
+            return None
+        parent, name = os.path.split(path)
+        if self._get_node_unlocked(parent) is not _DIR:
+            return None
+        overrides = self._dir_to_overrides.get(parent)
+        if overrides and name in overrides:
+            return overrides[name]
+        return self._get_generated_node(parent, level - 1, name)
+
+    def _get_children(self, dir_path):
+        '''
+        :return Optional[List[Tuple[str, object]]]:
+            The (name, node) for the entries in the directory or None if the directory
+            does not exist.
+        '''
+        dir_path = os.path.normpath(dir_path)
+        if self._get_node_unlocked(dir_path) is not _DIR:
+            return None
+        level = self._level(dir_path)
+
+        overrides = self._dir_to_overrides.get(dir_path)
+        if not overrides:
+            return list(self._iter_generated(dir_path, level))
+
+        ret = []
+        for name, node in self._iter_generated(dir_path, level):
+            if name in overrides:
+                continue
+            ret.append((name, node))
+        for name, node in overrides.items():
+            if node is not None:
+                ret.append((name, node))
+        return ret
+
+    # Provider API
+
+    def scandir(self, dir_path):
+        self.scandir_count += 1
+        with self._lock:
+            children = self._get_children(dir_path)
+        if children is None:
+            raise OSError('No such directory: %s' % (dir_path,))
+        return [FakeDirEntry(dir_path, name, node) for name, node in children]
+
+    def stat(self, path):
+        self.stat_count += 1
+        node = self._get_node(path)
+        if node is None:
+            raise OSError('No such file or directory: %s' % (path,))
+        if node is _DIR:
+            mtime_ns = self._dir_to_mtime_ns.get(os.path.normpath(path), 0)
+            return FakeStat(mtime_ns, 0, stat.S_IFDIR | 0o755)
+        return _stat_from_node(node)
+
+    def _get_node(self, path):
+        path = os.path.normpath(path)
+        with self._lock:
+            return self._get_node_unlocked(path)
+
+    # Changes
+
+    def _next_mtime_ns(self):
+        self._mtime_ns += 10 ** 9
+        return self._mtime_ns
+
+    def _set_node(self, path, node):
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            old_node = self._get_node_unlocked(path)
+            self._dir_to_overrides.setdefault(parent, {})[name] = node
+            if (old_node is None) != (node is None) or (old_node is _DIR) != (node is _DIR):
+                # Entries added/removed/replaced change the mtime of the directory.
+                self._mtime_ns += 10 ** 9
+                self._dir_to_mtime_ns[parent] = self._mtime_ns
+
+    def add_file(self, path, size=0):
+        self._set_node(path, (self._next_mtime_ns(), size))
+
+    def modify_file(self, path, size=None):
+        node = self._get_node(path)
+        if node is None or node is _DIR:
+            raise OSError('No such file: %s' % (path,))
+        if size is None:
+            size = node[1]
+        self._set_node(path, (self._next_mtime_ns(), size))
+
+    def add_dir(self, path):
+        self._set_node(path, _DIR)
+
+    def delete(self, path):
+        self._set_node(path, None)
+
+    def _random_file(self, rnd):
+        dir_path = self.root
+        while True:
+            children = self._get_children(dir_path)
+            if not children:
+                return None
+            dirs = [name for name, node in children if node is _DIR]
+            files = [name for name, node in children if node is not _DIR]
+            if files and (not dirs or rnd.random() < 0.5):
+                return os.path.join(dir_path, rnd.choice(files))
+            dir_path = os.path.join(dir_path, rnd.choice(dirs))
+
+    def churn(self, count, seed=None):
+        '''
+        Does random changes (modifications, deletions and additions) in existing
+        directories.
+
+        :return List[Tuple[Change, str]]:
+            The changes done (paths deleted or changed more than once are reported only
+            by the last change).
+        '''
+        rnd = random.Random(seed if seed is not None else self.seed)
+        path_to_change = {}
+        for i in range(count):
+            with self._lock:
+                path = self._random_file(rnd)
+            if path is None:
+                break
+            action = rnd.random()
+            if action < 0.6:
+                self.modify_file(path)
+                path_to_change.setdefault(path, Change.modified)
+            elif action < 0.8:
+                self.delete(path)
+                if path_to_change.get(path) == Change.added:
+                    del path_to_change[path]
+                else:
+                    path_to_change[path] = Change.deleted
+            else:
+                new_path = os.path.join(
+                    os.path.dirname(path), 'churn_%s_%05d%s' % (self.seed, i, os.path.splitext(path)[1]))
+                self.add_file(new_path, rnd.randint(0, 65536))
+                path_to_change[new_path] = Change.added
+
+        return sorted((change, path) for path, change in path_to_change.items())
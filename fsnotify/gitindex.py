@@ -0,0 +1,169 @@
+'''
+Reads the stat information which git keeps in its index (`.git/index`, versions 2 to 4)
+so that the initial scan of a git checkout doesn't have to stat the files tracked by git
+(see: `Watcher.git_index_warm_start`).
+
+Only entries whose stat information is reliable are used, so, the following entries are
+skipped (and the related files are stat'ed as usual):
+
+- Entries which aren't regular files (symlinks, submodules, sparse directories).
+- Entries with conflicts (stage != 0), marked as assume-valid, skip-worktree or
+  intent-to-add.
+- Racily clean entries (modified in the same second in which the index was written or
+  later).
+
+Note: files which were modified after git last refreshed the index (i.e.: uncommitted
+changes when `git status` wasn't run since then) have outdated information in the index,
+so, they're reported as modified in the first scan.
+
+Note: git keeps the sizes truncated to 32 bits, so, for files with 4 GiB or more, the
+first scan compares the truncated size (see: `_PathWatcher._check_dir`).
+'''
+import os
+import stat
+import struct
+
+_ENTRY_STRUCT = struct.Struct('>10I20sH')
+
+_FLAG_ASSUME_VALID = 0x8000
+_FLAG_EXTENDED = 0x4000
+_FLAG_STAGE_MASK = 0x3000
+_NAME_MASK = 0xFFF
+
+_EXTENDED_FLAG_SKIP_WORKTREE = 0x4000
+_EXTENDED_FLAG_INTENT_TO_ADD = 0x2000
+
+
+class IndexEntry(object):
+
+    __slots__ = ['path', 'mtime_ns', 'size', 'mode', 'reliable']
+
+    def __init__(self, path, mtime_ns, size, mode, reliable):
+        # The path relative to the work tree (bytes, with '/' as the separator).
+        self.path = path
+        self.mtime_ns = mtime_ns
+
+        # Note: truncated to 32 bits by git.
+        self.size = size
+        self.mode = mode
+
+        # Whether the stat information may be used (see the module docstring).
+        self.reliable = reliable
+
+
+def _read_varint(contents, pos):
+    # The offset encoding used by git for the prefix compression of version 4.
+    c = ord(contents[pos:pos + 1])
+    pos += 1
+    value = c & 0x7F
+    while c & 0x80:
+        c = ord(contents[pos:pos + 1])
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7F)
+    return value, pos
+
+
+def iter_index_entries(contents, index_mtime=None):
+    '''
+    :param bytes contents:
+        The contents of the index file.
+
+    :param Optional[int] index_mtime:
+        The mtime (in seconds) of the index file (entries modified at that time or later
+        are racily clean, so, not reliable).
+
+    :rtype: Iterable[IndexEntry]
+    '''
+    if len(contents) < 12 or contents[:4] != b'DIRC':
+        raise ValueError('Not a git index.')
+    version, count = struct.unpack_from('>II', contents, 4)
+    if version not in (2, 3, 4):
+        raise ValueError('Unsupported git index version: %s' % (version,))
+
+    unpack_from = _ENTRY_STRUCT.unpack_from
+    entry_size = _ENTRY_STRUCT.size
+    pos = 12
+    previous_path = b''
+    for _ in range(count):
+        entry_start = pos
+        (_ctime, _ctime_ns, mtime, mtime_ns, _dev, _ino, mode, _uid, _gid, size, _sha,
+         flags) = unpack_from(contents, pos)
+        pos += entry_size
+
+        extended_flags = 0
+        if flags & _FLAG_EXTENDED and version >= 3:
+            extended_flags = struct.unpack_from('>H', contents, pos)[0]
+            pos += 2
+
+        if version == 4:
+            strip, pos = _read_varint(contents, pos)
+            end = contents.index(b'\0', pos)
+            path = previous_path[:len(previous_path) - strip] + contents[pos:end]
+            pos = end + 1
+            previous_path = path
+        else:
+            name_len = flags & _NAME_MASK
+            if name_len == _NAME_MASK:  # The name is longer than what fits in the flags.
+                end = contents.index(b'\0', pos)
+            else:
+                end = pos + name_len
+            path = contents[pos:end]
+            # Padded with 1-8 NULs so that the entry size is a multiple of 8.
+            pos = entry_start + ((end - entry_start + 8) & ~7)
+
+        reliable = (
+            stat.S_ISREG(mode) and
+            not flags & (_FLAG_ASSUME_VALID | _FLAG_STAGE_MASK) and
+            not extended_flags & (_EXTENDED_FLAG_SKIP_WORKTREE | _EXTENDED_FLAG_INTENT_TO_ADD) and
+            (index_mtime is None or mtime < index_mtime))
+        yield IndexEntry(path, mtime * 1000000000 + mtime_ns, size, mode, reliable)
+
+
+def find_git_worktree(path):
+    '''
+    :param str path:
+        A (real) path inside a git checkout.
+
+    :return Optional[Tuple[str, str]]:
+        The work tree which contains the given path and its index file (or None if the
+        path isn't in a git checkout).
+    '''
+    current = path
+    while True:
+        dot_git = os.path.join(current, '.git')
+        if os.path.isdir(dot_git):
+            return current, os.path.join(dot_git, 'index')
+        if os.path.isfile(dot_git):
+            # Work trees and submodules have a file with the git dir.
+            try:
+                with open(dot_git, 'r') as stream:
+                    contents = stream.read().strip()
+            except (IOError, OSError):
+                return None
+            if not contents.startswith('gitdir:'):
+                return None
+            git_dir = os.path.join(current, contents[len('gitdir:'):].strip())
+            return current, os.path.join(git_dir, 'index')
+
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+
+def read_reliable_entries(index_path):
+    '''
+    :return List[Tuple[bytes, Tuple[int, int]]]:
+        The path (relative to the work tree, with '/' as the separator) and the
+        (st_mtime_ns, st_size) of the reliable entries in the given index (empty if the
+        index can't be read).
+    '''
+    try:
+        with open(index_path, 'rb') as stream:
+            index_mtime = int(os.fstat(stream.fileno()).st_mtime)
+            contents = stream.read()
+        entries = iter_index_entries(contents, index_mtime)
+        return [
+            (entry.path, (entry.mtime_ns, entry.size)) for entry in entries if entry.reliable]
+    except (IOError, OSError, ValueError, struct.error):
+        return []
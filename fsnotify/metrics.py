@@ -0,0 +1,260 @@
+'''
+Minimal metrics registry (counters, gauges and histograms) which may be exposed in the
+Prometheus text format (either through `MetricsRegistry.exposition()` or through a local
+http endpoint created with `start_http_server()`).
+
+Each `fsnotify.Watcher` has its own registry in `Watcher.metrics`, i.e.:
+
+    watcher = fsnotify.Watcher()
+    server = watcher.start_metrics_server(port=9123)
+    # metrics are now available at http://127.0.0.1:9123/metrics
+
+Note: it does not depend on the `prometheus_client` package.
+'''
+import threading
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+class _Metric(object):
+
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError('Expected labels: %s (found: %s)' % (self.label_names, tuple(labels)))
+        return tuple((name, labels[name]) for name in self.label_names)
+
+    def _iter_samples(self):
+        '''
+        :return Iterable[Tuple[str, Tuple[Tuple[str, str]], object]]:
+            The (suffix, labels, value) for each sample.
+        '''
+        raise NotImplementedError()
+
+    def exposition(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation.replace('\\', '\\\\').replace('\n', '\\n')),
+            '# TYPE %s %s' % (self.name, self.metric_type),
+        ]
+        for suffix, labels, value in self._iter_samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        _Metric.__init__(self, name, documentation, label_names)
+        self._values = {} if label_names else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented.')
+        key = self._label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._label_key(labels), 0)
+
+    def _iter_samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '', key, value
+
+
+class Gauge(_Metric):
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, label_names=()):
+        _Metric.__init__(self, name, documentation, label_names)
+        self._values = {} if label_names else {(): 0}
+
+    def set(self, value, **labels):
+        key = self._label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        return self._values.get(self._label_key(labels), 0)
+
+    def _iter_samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '', key, value
+
+
+class Histogram(_Metric):
+
+    metric_type = 'histogram'
+
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def _iter_samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+            total_count = self._count
+
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield '_bucket', (('le', _format_value(float(bound))),), cumulative
+        yield '_sum', (), total_sum
+        yield '_count', (), total_count
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def exposition(self):
+        '''
+        :return str:
+            The metrics in the Prometheus text exposition format.
+        '''
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.exposition() for metric in metrics) + '\n'
+
+
+class WatcherMetrics(MetricsRegistry):
+    '''
+    The metrics updated by `fsnotify.Watcher` (available in `Watcher.metrics`).
+    '''
+
+    def __init__(self):
+        MetricsRegistry.__init__(self)
+        self.scans = self.counter(
+            'fsnotify_scans_total', 'Number of full scans completed.')
+        self.scan_duration = self.histogram(
+            'fsnotify_scan_duration_seconds', 'Time to do a full scan (including throttling).')
+        self.entries_scanned = self.counter(
+            'fsnotify_entries_scanned_total', 'Number of directory entries scanned.')
+        self.entries_per_second = self.gauge(
+            'fsnotify_entries_per_second', 'Directory entries scanned per second in the last scan.')
+        self.changes = self.counter(
+            'fsnotify_changes_total', 'Number of changes reported.', ('change',))
+        self.scan_errors = self.counter(
+            'fsnotify_scan_errors_total',
+            'Number of OSErrors ignored while scanning (i.e.: directories removed while listing).')
+        self.throttle_sleep = self.counter(
+            'fsnotify_throttle_sleep_seconds_total', 'Time slept inside scans for throttling.')
+        self.notification_wait = self.counter(
+            'fsnotify_notification_wait_seconds_total', 'Time waited between scans.')
+        self.notification_time = self.gauge(
+            'fsnotify_notification_time_seconds',
+            'Target time from the start of a scan to the start of the next one (increased while idle).')
+        self.snapshot_files = self.gauge(
+            'fsnotify_snapshot_files', 'Number of files in the snapshot.')
+        self.snapshot_collapsed_dirs = self.gauge(
+            'fsnotify_snapshot_collapsed_dirs',
+            'Number of directories collapsed to a fingerprint in the snapshot.')
+        self.expanded_dirs = self.counter(
+            'fsnotify_expanded_dirs_total',
+            'Number of collapsed directories expanded because their fingerprint changed.')
+        self.tracked_roots = self.gauge(
+            'fsnotify_tracked_roots', 'Number of tracked roots.')
+
+
+def start_http_server(registry, port=0, host='127.0.0.1'):
+    '''
+    Starts a http server in a daemon thread which provides the metrics in the Prometheus
+    text format (in any path).
+
+    :param int port:
+        The port to use (0 means any free port: use `server.server_address` to get it).
+
+    :return:
+        The server (call `shutdown()` and `server_close()` to stop it).
+    '''
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:  # Python 2
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            contents = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(contents)))
+            self.end_headers()
+            self.wfile.write(contents)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((host, port), _MetricsHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.name = 'fsnotify metrics server'
+    t.daemon = True
+    t.start()
+    return server
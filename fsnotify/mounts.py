@@ -0,0 +1,129 @@
+'''
+Information on the mounted filesystems (used to apply `Watcher.filesystem_policies`).
+
+Note: the mount table is only available on Linux (read from `/proc/self/mountinfo`); on
+other platforms no mounts are found (so, the policies are not applied).
+'''
+import os
+
+
+class MountInfo(object):
+
+    __slots__ = ['mount_point', 'fs_type', 'source']
+
+    def __init__(self, mount_point, fs_type, source):
+        self.mount_point = mount_point
+        self.fs_type = fs_type
+        self.source = source
+
+    def __repr__(self):
+        return 'MountInfo(%r, %r, %r)' % (self.mount_point, self.fs_type, self.source)
+
+
+class FilesystemPolicy(object):
+    '''
+    How the directories in a given filesystem type are scanned (see:
+    `Watcher.filesystem_policies`).
+    '''
+
+    __slots__ = ['exclude', 'scan_interval']
+
+    def __init__(self, exclude=False, scan_interval=None):
+        # If True, the mount is not scanned at all.
+        self.exclude = exclude
+
+        # If given, the mount is scanned at most once in this interval (in seconds), in
+        # the scan loop of the watcher, instead of in every scan.
+        self.scan_interval = scan_interval
+
+
+def _unescape(field):
+    # Spaces, tabs, newlines and backslashes are escaped as octal (i.e.: '\040').
+    if '\\' not in field:
+        return field
+    parts = field.split('\\')
+    ret = [parts[0]]
+    for part in parts[1:]:
+        if len(part) >= 3 and part[:3].isdigit():
+            ret.append(chr(int(part[:3], 8)) + part[3:])
+        else:
+            ret.append('\\' + part)
+    return ''.join(ret)
+
+
+def parse_mountinfo(contents):
+    '''
+    :param str contents:
+        The contents of `/proc/self/mountinfo`.
+
+    :rtype: List[MountInfo]
+    '''
+    mounts = []
+    for line in contents.splitlines():
+        fields = line.split()
+        try:
+            separator = fields.index('-')
+        except ValueError:
+            continue
+        if separator < 5 or len(fields) < separator + 3:
+            continue
+        mounts.append(MountInfo(
+            _unescape(fields[4]), fields[separator + 1], _unescape(fields[separator + 2])))
+    return mounts
+
+
+def read_mountinfo(path='/proc/self/mountinfo'):
+    '''
+    :rtype: List[MountInfo]
+    :return:
+        The mounts (an empty list if the mount table is not available).
+    '''
+    try:
+        with open(path, 'r') as stream:
+            contents = stream.read()
+    except (IOError, OSError):
+        return []
+    return parse_mountinfo(contents)
+
+
+def get_policy(filesystem_policies, fs_type):
+    '''
+    :param Dict[str, FilesystemPolicy] filesystem_policies:
+        Maps the filesystem type to the policy (a type such as 'fuse' also matches
+        subtypes such as 'fuse.sshfs').
+
+    :rtype: Optional[FilesystemPolicy]
+    '''
+    policy = filesystem_policies.get(fs_type)
+    if policy is None and '.' in fs_type:
+        policy = filesystem_policies.get(fs_type.split('.', 1)[0])
+    return policy
+
+
+def find_mount(mounts, real_path):
+    '''
+    :return Optional[MountInfo]:
+        The mount which contains the given (real) path.
+    '''
+    found = None
+    for mount in mounts:
+        mount_point = mount.mount_point
+        if real_path == mount_point or real_path.startswith(
+                mount_point if mount_point.endswith(os.sep) else mount_point + os.sep):
+            # Later mounts shadow previous ones in the same mount point.
+            if found is None or len(mount_point) >= len(found.mount_point):
+                found = mount
+    return found
+
+
+def find_mounts_inside(mounts, real_path):
+    '''
+    :return List[MountInfo]:
+        The mounts strictly inside the given (real) path.
+    '''
+    prefix = real_path if real_path.endswith(os.sep) else real_path + os.sep
+    mount_point_to_mount = {}
+    for mount in mounts:
+        if mount.mount_point.startswith(prefix):
+            mount_point_to_mount[mount.mount_point] = mount  # Later mounts shadow previous ones.
+    return sorted(mount_point_to_mount.values(), key=lambda mount: mount.mount_point)
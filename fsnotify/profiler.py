@@ -0,0 +1,161 @@
+'''
+Profiling of slow scans.
+
+When `Watcher.slow_scan_threshold` is set, the time spent in each directory (and in the
+`accept_file` / `accept_directory` filters) is collected during scans and a
+`SlowScanReport` is created for the scans which take longer than the threshold, i.e.:
+
+    watcher.slow_scan_threshold = 2.0
+    ...
+    report = watcher.last_slow_scan_report
+    if report is not None:
+        print(report.format(top=10))
+
+If `Watcher.slow_scan_cprofile_dir` is also set, the scan done right after a slow scan is
+run under `cProfile` and its stats are dumped in that directory (see:
+`SlowScanReport.cprofile_path`).
+'''
+import os
+import time
+
+
+class DirProfile(object):
+
+    __slots__ = ['path', 'time', 'entries', 'subtree_time', 'subtree_entries']
+
+    def __init__(self, path, time, entries):
+        self.path = path
+
+        # Time/entries for the directory itself.
+        self.time = time
+        self.entries = entries
+
+        # Time/entries including subdirectories.
+        self.subtree_time = time
+        self.subtree_entries = entries
+
+
+class FilterProfile(object):
+
+    __slots__ = ['name', 'calls', 'time']
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.time = 0.
+
+
+class ScanProfile(object):
+    '''
+    Collects the information for a single scan.
+    '''
+
+    def __init__(self):
+        # List with (dir_path, elapsed_time, entries) for each directory (not counting
+        # subdirectories).
+        self.dirs = []
+        self.filters = {}
+
+    def wrap_filter(self, name, func):
+        filter_profile = self.filters.get(name)
+        if filter_profile is None:
+            filter_profile = self.filters[name] = FilterProfile(name)
+
+        def timed_filter(path):
+            initial_time = time.time()
+            try:
+                return func(path)
+            finally:
+                filter_profile.calls += 1
+                filter_profile.time += time.time() - initial_time
+
+        timed_filter.original = func
+        return timed_filter
+
+    def create_report(self, scan_time, threshold):
+        '''
+        :rtype: SlowScanReport
+        '''
+        path_to_dir_profile = {}
+        for dir_path, elapsed_time, entries in self.dirs:
+            path_to_dir_profile[dir_path] = DirProfile(dir_path, elapsed_time, entries)
+
+        # Add the subtree values to the parents (deeper directories first).
+        for dir_profile in sorted(
+                path_to_dir_profile.values(), key=lambda d: -d.path.count(os.sep)):
+            parent = path_to_dir_profile.get(os.path.dirname(dir_profile.path))
+            if parent is not None:
+                parent.subtree_time += dir_profile.subtree_time
+                parent.subtree_entries += dir_profile.subtree_entries
+
+        return SlowScanReport(
+            scan_time, threshold, list(path_to_dir_profile.values()),
+            sorted(self.filters.values(), key=lambda f: -f.time))
+
+
+class SlowScanReport(object):
+
+    def __init__(self, scan_time, threshold, dirs, filters):
+        '''
+        :type dirs: List[DirProfile]
+        :type filters: List[FilterProfile]
+        '''
+        self.scan_time = scan_time
+        self.threshold = threshold
+        self.dirs = dirs
+        self.filters = filters
+        self.created_time = time.time()
+
+        # Set to the file with the cProfile stats of the scan done after this one
+        # (if `Watcher.slow_scan_cprofile_dir` is set).
+        self.cprofile_path = None
+
+    @property
+    def entries(self):
+        return sum(dir_profile.entries for dir_profile in self.dirs)
+
+    def top_dirs(self, top=10):
+        '''
+        :return List[DirProfile]:
+            The directories which took more time (not counting subdirectories).
+        '''
+        return sorted(self.dirs, key=lambda d: -d.time)[:top]
+
+    def top_subtrees(self, top=10):
+        '''
+        :return List[DirProfile]:
+            The directories which took more time (counting subdirectories).
+        '''
+        return sorted(self.dirs, key=lambda d: -d.subtree_time)[:top]
+
+    def format(self, top=10):
+        lines = [
+            'Slow scan: %.3fs (threshold: %.3fs), %s entries in %s directories.' % (
+                self.scan_time, self.threshold, self.entries, len(self.dirs)),
+            '',
+            'Top %s directories (not counting subdirectories):' % (top,),
+        ]
+        for dir_profile in self.top_dirs(top):
+            lines.append('  %8.3fs %9s entries  %s' % (
+                dir_profile.time, dir_profile.entries, dir_profile.path))
+
+        lines.append('')
+        lines.append('Top %s subtrees:' % (top,))
+        for dir_profile in self.top_subtrees(top):
+            lines.append('  %8.3fs %9s entries  %s' % (
+                dir_profile.subtree_time, dir_profile.subtree_entries, dir_profile.path))
+
+        if self.filters:
+            lines.append('')
+            lines.append('Filters:')
+            for filter_profile in self.filters:
+                lines.append('  %8.3fs %9s calls    %s' % (
+                    filter_profile.time, filter_profile.calls, filter_profile.name))
+
+        if self.cprofile_path:
+            lines.append('')
+            lines.append('cProfile stats (next scan): %s' % (self.cprofile_path,))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.format()
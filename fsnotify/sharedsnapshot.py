@@ -0,0 +1,358 @@
+'''
+Publishes the snapshot of a `Watcher` (the mtime/size of each tracked file) in shared
+memory, so that worker processes may look it up without scanning the tree themselves
+(and without receiving copies of it), i.e.:
+
+    # In the process which owns the watcher:
+    publisher = watcher.publish_snapshot('my_index_snapshot')
+
+    # In the workers:
+    from fsnotify.sharedsnapshot import SnapshotReader
+    reader = SnapshotReader('my_index_snapshot')
+    mtime_ns, size = reader.get('/path/to/file.py')
+
+The snapshot is updated at the end of each scan with changes.
+
+Layout (the arrays are 8 byte integers in the native byte order):
+
+- A header segment (with the given name) with a magic, the layout version, a generation
+  counter (odd while being updated) and the name of the data segment which has the
+  current snapshot.
+
+- Data segments (two which are used alternately, so that a snapshot is never
+  overwritten while it's the current one) with the number of files and the size of the
+  path table, followed by the path offsets, mtimes and sizes (arrays) and the path table
+  (utf-8 encoded paths, sorted, so that they can be binary searched).
+
+Readers check that the generation didn't change after reading (and retry otherwise), so
+reads are always consistent.
+
+Note: requires `multiprocessing.shared_memory` (Python 3.8 onwards). Files in
+directories collapsed due to `Watcher.max_snapshot_entries` are not published.
+'''
+import struct
+import threading
+
+_MAGIC = b'FSNS'
+_VERSION = 1
+
+_HEADER_FORMAT = '<4sIQH'
+_HEADER_SIZE = 256
+_MAX_NAME_LEN = _HEADER_SIZE - struct.calcsize(_HEADER_FORMAT)
+_GENERATION_OFFSET = 8
+_NAME_LEN_OFFSET = 16
+
+_DATA_HEADER_FORMAT = '<QQ'
+_DATA_HEADER_SIZE = struct.calcsize(_DATA_HEADER_FORMAT)
+
+# The segments created in this process (or in the parent process if forked), which are
+# registered in the resource tracker shared with the publisher.
+_created_names = set()
+
+
+def _import_shared_memory():
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise RuntimeError(
+            'Publishing the snapshot requires multiprocessing.shared_memory (Python 3.8 onwards).')
+    return shared_memory
+
+
+def _attach(name):
+    '''
+    Attaches to an existing segment (without registering it in the resource tracker, as
+    otherwise it'd be unlinked when the process attaching to it exits).
+    '''
+    shared_memory = _import_shared_memory()
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 (no track argument).
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name not in _created_names:
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        return shm
+
+
+def _create(name, size):
+    shared_memory = _import_shared_memory()
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    _created_names.add(shm.name)
+    return shm
+
+
+def _encode(path):
+    if isinstance(path, bytes):
+        return path  # See: `Watcher.bytes_paths`.
+    return path.encode('utf-8', 'surrogateescape')
+
+
+class SnapshotPublisher(object):
+    '''
+    Created through `Watcher.publish_snapshot()`.
+    '''
+
+    def __init__(self, name=None):
+        self._lock = threading.Lock()
+        self._header = _create(name, _HEADER_SIZE)
+        self.name = self._header.name
+        if len(self.name.encode('utf-8')) + 8 > _MAX_NAME_LEN:
+            self._header.close()
+            self._header.unlink()
+            _created_names.discard(self.name)
+            raise ValueError('Name too long: %s' % (name,))
+
+        # The data segments (the current one is `self._data[self._current]`).
+        self._data = [None, None]
+        self._data_count = 0
+        self._current = 1
+        self.generation = 0
+        struct.pack_into(_HEADER_FORMAT, self._header.buf, 0, _MAGIC, _VERSION, 0, 0)
+
+    def _write_header(self, data_name):
+        '''
+        Switches the current data segment (the generation is odd while the name is being
+        written and the even generation is written last, so, readers never accept a
+        partially written name).
+        '''
+        encoded_name = data_name.encode('utf-8')
+        buf = self._header.buf
+        self.generation += 1
+        struct.pack_into('<Q', buf, _GENERATION_OFFSET, self.generation)
+
+        struct.pack_into('<H', buf, _NAME_LEN_OFFSET, len(encoded_name))
+        header_len = struct.calcsize(_HEADER_FORMAT)
+        buf[header_len:header_len + len(encoded_name)] = encoded_name
+
+        self.generation += 1
+        struct.pack_into('<Q', buf, _GENERATION_OFFSET, self.generation)
+
+    def publish(self, file_to_mtime):
+        '''
+        :param Dict[str, Tuple[int, int]] file_to_mtime:
+            The snapshot (path -> (st_mtime_ns, st_size)).
+        '''
+        from array import array
+
+        items = sorted(file_to_mtime.items())
+        count = len(items)
+        paths = []
+        offsets = array('q', [0])
+        mtimes = array('q')
+        sizes = array('q')
+        offset = 0
+        for path, mtime in items:
+            encoded = _encode(path)
+            paths.append(encoded)
+            offset += len(encoded)
+            offsets.append(offset)
+            mtimes.append(mtime[0])
+            sizes.append(mtime[1])
+        path_table = b''.join(paths)
+
+        needed = _DATA_HEADER_SIZE + 8 * (3 * count + 1) + len(path_table)
+        with self._lock:
+            if self._header is None:
+                return  # Already closed.
+
+            # Write to the segment which is not current.
+            index = 1 - self._current
+            shm = self._data[index]
+            if shm is None or shm.size < needed:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+                    _created_names.discard(shm.name)
+                self._data_count += 1
+                shm = self._data[index] = _create(
+                    '%s_%s' % (self.name, self._data_count), max(4096, int(needed * 1.5)))
+
+            buf = shm.buf
+            struct.pack_into(_DATA_HEADER_FORMAT, buf, 0, count, len(path_table))
+            pos = _DATA_HEADER_SIZE
+            for column in (offsets, mtimes, sizes):
+                column_bytes = column.tobytes()
+                buf[pos:pos + len(column_bytes)] = column_bytes
+                pos += len(column_bytes)
+            buf[pos:pos + len(path_table)] = path_table
+
+            self._current = index
+            self._write_header(shm.name)
+
+    def close(self):
+        '''
+        Removes the shared memory segments (called on `Watcher.dispose()`).
+        '''
+        with self._lock:
+            header = self._header
+            self._header = None
+            if header is None:
+                return
+            for shm in [header] + [shm for shm in self._data if shm is not None]:
+                shm.close()
+                shm.unlink()
+                _created_names.discard(shm.name)
+            self._data = [None, None]
+
+
+class _SnapshotView(object):
+    '''
+    View of a data segment (numbers are accessed without copying the data).
+    '''
+
+    def __init__(self, buf):
+        self.count, path_table_len = struct.unpack_from(_DATA_HEADER_FORMAT, buf, 0)
+        count = self.count
+        pos = _DATA_HEADER_SIZE
+        self.offsets = buf[pos:pos + 8 * (count + 1)].cast('q')
+        pos += 8 * (count + 1)
+        self.mtimes = buf[pos:pos + 8 * count].cast('q')
+        pos += 8 * count
+        self.sizes = buf[pos:pos + 8 * count].cast('q')
+        pos += 8 * count
+        self.path_table = buf[pos:pos + path_table_len]
+
+    def path_at(self, i):
+        return bytes(self.path_table[self.offsets[i]:self.offsets[i + 1]])
+
+    def find(self, encoded_path):
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path_at(mid) < encoded_path:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.path_at(lo) == encoded_path:
+            return lo
+        return -1
+
+    def release(self):
+        for view in (self.offsets, self.mtimes, self.sizes, self.path_table):
+            view.release()
+
+
+class SnapshotReader(object):
+    '''
+    Reads a snapshot published with `Watcher.publish_snapshot()` (possibly from another
+    process).
+    '''
+
+    # Maximum number of attempts to get a consistent read.
+    max_retries = 100
+
+    def __init__(self, name):
+        self._header = _attach(name)
+        magic, version, _generation, _name_len = struct.unpack_from(
+            _HEADER_FORMAT, self._header.buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._header.close()
+            raise ValueError('%s is not a snapshot published by fsnotify (version %s).' % (
+                name, _VERSION))
+        self._data_name = None
+        self._data = None
+
+    @property
+    def generation(self):
+        '''
+        :return int:
+            Increased whenever the snapshot is updated.
+        '''
+        return struct.unpack_from('<Q', self._header.buf, _GENERATION_OFFSET)[0]
+
+    def _read(self, func):
+        '''
+        Calls `func(view)` with a view of the current snapshot (retrying if it's updated
+        in the meanwhile).
+        '''
+        import time
+
+        header_len = struct.calcsize(_HEADER_FORMAT)
+        for _ in range(self.max_retries):
+            _magic, _version, generation, name_len = struct.unpack_from(
+                _HEADER_FORMAT, self._header.buf, 0)
+            if generation % 2:
+                time.sleep(0)
+                continue
+            if not name_len:
+                return func(None)
+            data_name = bytes(self._header.buf[header_len:header_len + name_len]).decode('utf-8')
+            if self.generation != generation:
+                continue
+
+            if data_name != self._data_name:
+                if self._data is not None:
+                    self._data.close()
+                    self._data = None
+                    self._data_name = None
+                try:
+                    self._data = _attach(data_name)
+                except (OSError, ValueError):
+                    if self.generation == generation:
+                        raise
+                    continue  # The segment was replaced in the meanwhile: retry.
+                self._data_name = data_name
+
+            view = None
+            try:
+                view = _SnapshotView(self._data.buf)
+                ret = func(view)
+            except (IndexError, ValueError, TypeError, struct.error):
+                if self.generation == generation:
+                    raise
+                continue  # Read while being updated: retry.
+            finally:
+                if view is not None:
+                    view.release()
+            if self.generation == generation:
+                return ret
+        raise RuntimeError('Unable to get a consistent read of the snapshot.')
+
+    def get(self, path):
+        '''
+        :return Optional[Tuple[int, int]]:
+            The (st_mtime_ns, st_size) of the given path (or None if not in the snapshot).
+        '''
+        encoded = _encode(path)
+
+        def get(view):
+            if view is None:
+                return None
+            i = view.find(encoded)
+            if i < 0:
+                return None
+            return view.mtimes[i], view.sizes[i]
+
+        return self._read(get)
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __len__(self):
+        return self._read(lambda view: view.count if view is not None else 0)
+
+    def items(self):
+        '''
+        :return List[Tuple[str, Tuple[int, int]]]:
+            A copy of the whole snapshot (sorted by path).
+        '''
+
+        def items(view):
+            if view is None:
+                return []
+            return [
+                (view.path_at(i).decode('utf-8', 'surrogateescape'), (view.mtimes[i], view.sizes[i]))
+                for i in range(view.count)]
+
+        return self._read(items)
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._header.close()
@@ -0,0 +1,421 @@
+'''
+Record/replay of scan traces.
+
+A trace has the directory listings (and stat results) obtained while scanning the tracked
+paths as well as the changes reported, so, it may be replayed afterwards through the same
+scanning code without needing the original filesystem (which is useful to create
+deterministic benchmarks and regression tests).
+
+Sample usage:
+
+    watcher = fsnotify.Watcher()
+    watcher.start_recording('trace.jsonl.gz', hash_names=True)
+    watcher.set_tracked_paths([target_dir])
+    for change in watcher.iter_changes():
+        ...
+
+    # Afterwards (possibly in another machine):
+    from fsnotify.trace import replay_trace
+    result = replay_trace('trace.jsonl.gz')
+    print('Total scan time: %.3fs' % (result.total_time,))
+    assert not result.mismatches
+
+The trace is saved as json lines (one record per line):
+
+    {"type": "header", "version": 1, "hashed": false}
+    {"type": "roots", "roots": [[path, recursive], ...]}
+    {"type": "scan"}
+    {"type": "dir", "path": dir_path, "entries": [[name, is_dir, mtime_ns, size], ...]}
+    {"type": "stat", "path": path, "stat": [mtime_ns, size, mode, ino, dev]}
+    {"type": "changes", "changes": [[change, path], ...]}
+
+Note: `is_dir`, `mtime_ns` and `size` are null if they were not requested while scanning.
+
+Note: `stat` records have the results of the stats done through the provider (i.e.: for
+roots, symlinks, log files and `TrackedFiles`): the `stat` is null if it raised OSError
+(and fields not available from the provider are null).
+'''
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+TRACE_VERSION = 1
+
+
+def _open_trace(path_or_stream, mode):
+    if not isinstance(path_or_stream, str):
+        return path_or_stream, False
+
+    if path_or_stream.endswith('.gz'):
+        import gzip
+        return io.TextIOWrapper(gzip.open(path_or_stream, mode + 'b'), encoding='utf-8'), True
+
+    return io.open(path_or_stream, mode, encoding='utf-8'), True
+
+
+class _Stat(object):
+
+    __slots__ = ['st_mtime_ns', 'st_size']
+
+    def __init__(self, st_mtime_ns, st_size):
+        self.st_mtime_ns = st_mtime_ns
+        self.st_size = st_size
+
+
+_STAT_FIELDS = ('st_mtime_ns', 'st_size', 'st_mode', 'st_ino', 'st_dev')
+
+
+class _RecordedStat(object):
+    '''
+    The stat result replayed from a `stat` record (fields which were not available when
+    recording are not set).
+    '''
+
+    __slots__ = _STAT_FIELDS
+
+    def __init__(self, values):
+        for field, value in zip(_STAT_FIELDS, values):
+            if value is not None:
+                setattr(self, field, value)
+
+
+class _RecordingDirEntry(object):
+    '''
+    Wraps a DirEntry to record the information requested from it.
+    '''
+
+    __slots__ = ['_entry', '_recorded']
+
+    def __init__(self, entry, recorded):
+        self._entry = entry
+        self._recorded = recorded  # [name, is_dir, mtime_ns, size]
+
+    @property
+    def name(self):
+        return self._entry.name
+
+    @property
+    def path(self):
+        return self._entry.path
+
+    def is_dir(self):
+        ret = self._entry.is_dir()
+        self._recorded[1] = ret
+        return ret
+
+    def is_symlink(self):
+        # Note: not recorded (symlinks are replayed as the directories they point to).
+        return self._entry.is_symlink()
+
+    def stat(self):
+        stat = self._entry.stat()
+        self._recorded[2] = stat.st_mtime_ns
+        self._recorded[3] = stat.st_size
+        return stat
+
+
+class _RecordingProvider(object):
+
+    def __init__(self, trace_recorder, provider):
+        self._trace_recorder = trace_recorder
+        self._provider = provider
+
+    def scandir(self, dir_path):
+        trace_recorder = self._trace_recorder
+        entries = []
+        try:
+            for entry in self._provider.scandir(dir_path):
+                recorded = [trace_recorder._hash_name(entry.name), None, None, None]
+                entries.append(recorded)
+                yield _RecordingDirEntry(entry, recorded)
+        finally:
+            trace_recorder._write({
+                'type': 'dir', 'path': trace_recorder._hash_path(dir_path), 'entries': entries})
+
+    def stat(self, path):
+        trace_recorder = self._trace_recorder
+        try:
+            stat = self._provider.stat(path)
+        except OSError:
+            trace_recorder._write(
+                {'type': 'stat', 'path': trace_recorder._hash_path(path), 'stat': None})
+            raise
+        trace_recorder._write({
+            'type': 'stat',
+            'path': trace_recorder._hash_path(path),
+            'stat': [getattr(stat, field, None) for field in _STAT_FIELDS],
+        })
+        return stat
+
+
+class TraceRecorder(object):
+    '''
+    Created through `Watcher.start_recording()`.
+    '''
+
+    def __init__(self, path_or_stream, hash_names=False, keep_names=()):
+        self._stream, self._close_stream = _open_trace(path_or_stream, 'w')
+        self._lock = threading.Lock()
+        self._hash_names = hash_names
+        self._keep_names = frozenset(keep_names)
+        self._name_to_hashed = {}
+        self._write({'type': 'header', 'version': TRACE_VERSION, 'hashed': hash_names})
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            if self._stream is not None:
+                self._stream.write(line)
+                self._stream.write(u'\n')
+
+    def _hash_name(self, name):
+        if isinstance(name, bytes) and bytes is not str:
+            name = os.fsdecode(name)  # See: `Watcher.bytes_paths`.
+        if not self._hash_names or name in self._keep_names:
+            return name
+        hashed = self._name_to_hashed.get(name)
+        if hashed is None:
+            base, ext = os.path.splitext(name)
+            hashed = hashlib.sha1(base.encode('utf-8', 'replace')).hexdigest()[:16] + ext
+            self._name_to_hashed[name] = hashed
+        return hashed
+
+    def _hash_path(self, path):
+        if isinstance(path, bytes) and bytes is not str:
+            path = os.fsdecode(path)  # See: `Watcher.bytes_paths`.
+        if not self._hash_names:
+            return path
+        drive, path = os.path.splitdrive(path)
+        return drive + os.sep.join(self._hash_name(part) if part else part
+                                   for part in path.split(os.sep))
+
+    def wrap_provider(self, provider):
+        '''
+        :return _RecordingProvider:
+            A provider which records the listings (and the stat results requested).
+        '''
+        return _RecordingProvider(self, provider)
+
+    def record_roots(self, path_watchers):
+        roots = []
+        for path_watcher in path_watchers:
+            root_path = getattr(path_watcher, '_root_path', None)
+            if root_path is not None:  # i.e.: TrackedFiles are not recorded.
+                roots.append([self._hash_path(root_path), bool(path_watcher._recursive)])
+                for nested_root, recursive in path_watcher.nested_roots.items():
+                    roots.append([self._hash_path(nested_root), recursive])
+        self._write({'type': 'roots', 'roots': roots})
+
+    def record_scan_start(self):
+        self._write({'type': 'scan'})
+
+    def record_changes(self, changes):
+        self._write({
+            'type': 'changes',
+            'changes': [[int(change[0]), self._hash_path(change[1])] for change in changes]
+        })
+
+    def close(self):
+        with self._lock:
+            stream = self._stream
+            self._stream = None
+        if stream is not None:
+            if self._close_stream:
+                stream.close()
+            else:
+                stream.flush()
+
+
+class _ReplayDirEntry(object):
+
+    __slots__ = ['name', 'path', '_is_dir', '_stat']
+
+    def __init__(self, dir_path, name, is_dir, mtime_ns, size):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+        self._is_dir = bool(is_dir)
+        # Note: if the stat was not recorded (i.e.: the filters used when replaying differ
+        # from the ones used when recording) it's reported as empty.
+        self._stat = _Stat(mtime_ns or 0, size or 0)
+
+    def is_dir(self):
+        return self._is_dir
+
+    def is_symlink(self):
+        return False
+
+    def stat(self):
+        return self._stat
+
+
+class _ReplayProvider(object):
+
+    def __init__(self):
+        self.current_scan = _ReplayScan()
+
+    def scandir(self, dir_path):
+        entries = self.current_scan.dir_to_entries.get(dir_path)
+        if entries is None:
+            raise OSError('Directory not in trace: %s' % (dir_path,))
+        return [_ReplayDirEntry(dir_path, *entry) for entry in entries]
+
+    def stat(self, path):
+        stat = self.current_scan.path_to_stat.get(path)
+        if stat is None:
+            raise OSError('Stat not in trace: %s' % (path,))
+        return _RecordedStat(stat)
+
+
+class _ReplayScan(object):
+
+    def __init__(self):
+        self.dir_to_entries = {}
+        self.path_to_stat = {}  # path -> stat fields (see: `_STAT_FIELDS`)
+        self.recorded_changes = []
+
+
+class ReplayedScan(object):
+
+    def __init__(self, changes, recorded_changes, elapsed_time, initial):
+        # The changes found when replaying.
+        self.changes = changes
+
+        # The changes found when recording.
+        self.recorded_changes = recorded_changes
+
+        self.elapsed_time = elapsed_time
+
+        # Whether it's the initial scan done when the tracked paths were set (in
+        # which case the changes are not compared).
+        self.initial = initial
+
+    @property
+    def matches(self):
+        if self.initial:
+            return True
+        return sorted((int(c[0]), c[1]) for c in self.changes) == sorted(
+            (c[0], c[1]) for c in self.recorded_changes)
+
+
+class ReplayResult(object):
+
+    def __init__(self, scans):
+        '''
+        :type scans: List[ReplayedScan]
+        '''
+        self.scans = scans
+
+    @property
+    def total_time(self):
+        return sum(scan.elapsed_time for scan in self.scans)
+
+    @property
+    def mismatches(self):
+        '''
+        :return List[ReplayedScan]:
+            The scans whose changes differ from the ones recorded.
+        '''
+        return [scan for scan in self.scans if not scan.matches]
+
+
+def load_trace(path_or_stream):
+    '''
+    :return List[Tuple[str, object]]:
+        A list with ('roots', List[Tuple[str, bool]]) and ('scan', _ReplayScan) entries.
+    '''
+    stream, close_stream = _open_trace(path_or_stream, 'r')
+    operations = []
+    current_scan = None
+
+    # Stats done before the scan starts (i.e.: when the tracked paths are set) are used
+    # in the next scan.
+    pending_path_to_stat = {}
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record_type = record['type']
+            if record_type == 'header':
+                if record['version'] != TRACE_VERSION:
+                    raise ValueError('Unsupported trace version: %s' % (record['version'],))
+
+            elif record_type == 'roots':
+                operations.append(('roots', [tuple(root) for root in record['roots']]))
+                current_scan = None
+
+            elif record_type == 'scan':
+                current_scan = _ReplayScan()
+                current_scan.path_to_stat.update(pending_path_to_stat)
+                pending_path_to_stat.clear()
+                operations.append(('scan', current_scan))
+
+            elif record_type == 'dir':
+                if current_scan is not None:
+                    current_scan.dir_to_entries[record['path']] = record['entries']
+
+            elif record_type == 'stat':
+                path_to_stat = (
+                    current_scan.path_to_stat if current_scan is not None
+                    else pending_path_to_stat)
+                if record['stat'] is None:
+                    path_to_stat.pop(record['path'], None)
+                else:
+                    path_to_stat[record['path']] = record['stat']
+
+            elif record_type == 'changes':
+                if current_scan is not None:
+                    current_scan.recorded_changes.extend(tuple(c) for c in record['changes'])
+    finally:
+        if close_stream:
+            stream.close()
+    return operations
+
+
+def replay_trace(path_or_stream, watcher=None):
+    '''
+    Replays a trace recorded with `Watcher.start_recording()` through the scanning code.
+
+    :param fsnotify.Watcher watcher:
+        The watcher used to replay (its filters are used when scanning). If not given a
+        new `Watcher` with the default filters is used.
+
+    :rtype: ReplayResult
+    '''
+    import fsnotify
+
+    operations = load_trace(path_or_stream)
+    if watcher is None:
+        watcher = fsnotify.Watcher()
+    watcher.background_initial_scan = False
+    watcher.cache_dir_listings = False  # Each recorded listing must be replayed.
+
+    provider = _ReplayProvider()
+    watcher._set_scan_provider(provider)
+
+    scans = []
+    pending_roots = None
+    for operation, value in operations:
+        if operation == 'roots':
+            pending_roots = value
+            continue
+
+        provider.current_scan = value
+        initial_time = time.time()
+        if pending_roots is not None:
+            # The first scan after the roots are set is the baseline.
+            watcher.set_tracked_paths(
+                [fsnotify.TrackedPath(path, recursive) for path, recursive in pending_roots])
+            pending_roots = None
+            scans.append(ReplayedScan(
+                [], value.recorded_changes, time.time() - initial_time, True))
+        else:
+            changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+            scans.append(ReplayedScan(
+                changes, value.recorded_changes, time.time() - initial_time, False))
+
+    return ReplayResult(scans)
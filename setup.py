@@ -34,6 +34,11 @@ setup(
         'Programming Language :: Python :: 3.8',
     ],
     description='Simple file watching',
+    entry_points={
+        'console_scripts': [
+            'fsnotify = fsnotify.__main__:main',
+        ],
+    },
     extras_require={
         'test': tests_require,
         'dev': development_requires + tests_require,
@@ -1,4 +1,5 @@
 import os
+import sys
 import pytest
 from fsnotify import Change
 import fsnotify
@@ -253,6 +254,1239 @@ def test_not_recursive(tmpdir, watcher, changes):
     assert not changes
 
 
+def test_background_initial_scan(tmpdir):
+    import threading
+
+    for i in range(3):
+        d = tmpdir.mkdir('dir_%s' % (i,))
+        for j in range(10):
+            d.join('my_%s.txt' % (j,)).write('foo')
+
+    watcher = fsnotify.Watcher()
+    watcher.background_initial_scan = True
+    watcher.target_time_for_single_scan = 0.1
+    watcher.target_time_for_notification = 0.1
+    initial_scan = watcher.set_tracked_paths(str(tmpdir))
+    assert initial_scan is watcher.initial_scan
+    assert initial_scan.roots_total == 1
+
+    changes = []
+
+    def start_watching():
+        for change in watcher.iter_changes():
+            changes.append(change)
+
+    t = threading.Thread(target=start_watching)
+    t.start()
+    try:
+        assert initial_scan.wait(5)
+        assert initial_scan.roots_done == 1
+        assert initial_scan.files_found == 30
+        assert initial_scan.dirs_scanned == 4
+        assert initial_scan.entries_scanned == 33
+
+        path = tmpdir.join('dir_1').join('new.txt')
+        path.write('foo')
+        wait_for_condition(lambda: len(changes) >= 1)
+        assert changes.pop(0) == (Change.added, str(path))
+        assert not changes
+    finally:
+        watcher.dispose()
+        t.join()
+
+
+def test_rich_change_events(tmpdir, watcher, changes):
+    import time
+
+    watcher.rich_change_events = True
+    time.sleep(.5)  # i.e.: if we were in the middle of a scan, let it finish.
+
+    path = tmpdir.join('my.txt')
+    path.write('foo')
+    wait_for_condition(lambda: len(changes) >= 1)
+    change = changes.pop(0)
+    assert isinstance(change, fsnotify.ChangeEvent)
+    change_enum, change_path = change
+    assert (change_enum, change_path) == (Change.added, str(path))
+    assert change == (Change.added, str(path))
+    stat = os.stat(str(path))
+    assert change.mtime_ns == stat.st_mtime_ns
+    assert change.size == 3
+    assert change.old_mtime_ns is None
+    assert change.old_size is None
+
+    path.write('something else')
+    wait_for_condition(lambda: len(changes) >= 1)
+    change = changes.pop(0)
+    assert change == (Change.modified, str(path))
+    assert change.size == len('something else')
+    assert change.old_size == 3
+    assert change.size_changed
+
+    path.remove()
+    wait_for_condition(lambda: len(changes) >= 1)
+    change = changes.pop(0)
+    assert change == (Change.deleted, str(path))
+    assert change.size is None
+    assert change.old_size == len('something else')
+    assert not changes
+
+
+def test_subscribe(tmpdir):
+    import threading
+    import time
+
+    watcher = fsnotify.Watcher()
+    watcher.target_time_for_single_scan = 0.1
+    watcher.target_time_for_notification = 0.1
+    watcher.set_tracked_paths(str(tmpdir))
+
+    lock = threading.Lock()
+    running = set()
+    concurrent_paths = []
+    changes = []
+
+    def on_changes(batch):
+        for change in batch:
+            with lock:
+                if change[1] in running:
+                    concurrent_paths.append(change[1])
+                running.add(change[1])
+        time.sleep(.05)
+        with lock:
+            for change in batch:
+                running.discard(change[1])
+            changes.extend(batch)
+
+    subscription = watcher.subscribe(on_changes)
+    try:
+        paths = [tmpdir.join('my_%s.txt' % (i,)) for i in range(20)]
+        for path in paths:
+            path.write('foo')
+
+        def get_added():
+            # Note: a scan may see the file before it's written (so, it may also be modified).
+            with lock:
+                return sorted(change for change in changes if change[0] == Change.added)
+
+        wait_for_condition(lambda: len(get_added()) >= 20)
+        assert get_added() == sorted((Change.added, str(path)) for path in paths)
+
+        subscription.unsubscribe()
+        del changes[:]
+        paths[0].remove()
+        time.sleep(.5)
+        assert not changes
+        assert not concurrent_paths
+
+        # Without subscriptions, scans are stopped (and restarted on a new subscription).
+        wait_for_condition(lambda: watcher._dispatcher_thread is None)
+        scans_completed = watcher.scan_stats.scans_completed
+        time.sleep(.3)
+        assert watcher.scan_stats.scans_completed == scans_completed
+
+        watcher.subscribe(on_changes)
+        wait_for_condition(lambda: len(changes) >= 1)
+        assert changes == [(Change.deleted, str(paths[0]))]
+    finally:
+        watcher.dispose()
+
+
+def test_tracked_files(tmpdir, watcher, changes):
+    import time
+
+    big_dir = tmpdir.mkdir('big_dir')
+    for i in range(50):
+        big_dir.join('other_%s.txt' % (i,)).write('foo')
+    big_dir_tracked = big_dir.join('tracked.txt')
+    big_dir_tracked.write('foo')
+
+    small_dir = tmpdir.mkdir('small_dir')
+    small_dir_tracked = [small_dir.join('tracked_%s.txt' % (i,)) for i in range(10)]
+    for path in small_dir_tracked:
+        path.write('foo')
+    not_there = small_dir.join('not_there.txt')
+
+    tracked_paths = [str(p) for p in [big_dir_tracked, not_there] + small_dir_tracked]
+    watcher.set_tracked_paths([fsnotify.TrackedFiles(tracked_paths)])
+    time.sleep(.5)  # i.e.: if we were in the middle of it, we don't want to be notified from the previous run.
+    del changes[:]
+
+    big_dir.join('other_0.txt').write('changed')
+    big_dir_tracked.write('changed')
+    small_dir_tracked[0].write('changed')
+    tmp = tmpdir.join('tmp.txt')
+    tmp.write('foo')
+    tmp.rename(not_there)
+    wait_for_condition(lambda: len(set(changes)) >= 3)
+    time.sleep(.3)
+    # Note: a scan may be done in the middle of a write (so, use a set for comparing).
+    assert set(changes) == set([
+        (Change.modified, str(big_dir_tracked)),
+        (Change.modified, str(small_dir_tracked[0])),
+        (Change.added, str(not_there)),
+    ])
+    del changes[:]
+
+    big_dir_tracked.remove()
+    wait_for_condition(lambda: len(changes) >= 1)
+    assert changes.pop(0) == (Change.deleted, str(big_dir_tracked))
+    assert not changes
+
+    # Relative paths are made absolute and directories aren't tracked as files.
+    rel_dir = tmpdir.mkdir('rel_dir')
+    names = ['rel_%s.txt' % (i,) for i in range(6)]
+    for name in names:
+        rel_dir.join(name).write('foo')
+    rel_dir.mkdir('sub')
+    with rel_dir.as_cwd():
+        rel_watcher = fsnotify.Watcher()
+        rel_watcher.set_tracked_paths([
+            fsnotify.TrackedFiles(names + ['sub']), fsnotify.TrackedFiles(['sub'])])
+    assert sorted(rel_watcher._single_visit_info.file_to_mtime) == [
+        str(rel_dir.join(name)) for name in names]
+    rel_watcher.dispose()
+
+
+@pytest.mark.parametrize('hash_names', [False, True])
+def test_record_replay(tmpdir, hash_names):
+    import threading
+    from fsnotify.trace import replay_trace
+
+    tracked = tmpdir.mkdir('tracked')
+    tracked.mkdir('.git').join('index').write('foo')
+    tracked.mkdir('dir').join('my.txt').write('foo')
+
+    trace_path = str(tmpdir.join('trace.jsonl.gz'))
+    watcher = fsnotify.Watcher()
+    watcher.target_time_for_single_scan = 0.1
+    watcher.target_time_for_notification = 0.1
+    watcher.start_recording(trace_path, hash_names=hash_names)
+    watcher.set_tracked_paths(str(tracked))
+    changes = []
+
+    def start_watching():
+        for change in watcher.iter_changes():
+            changes.append(change)
+
+    t = threading.Thread(target=start_watching)
+    t.start()
+    try:
+        tmp = tmpdir.join('new.txt')
+        tmp.write('foo')
+        tmp.rename(tracked.join('dir').join('new.txt'))
+        wait_for_condition(lambda: len(changes) >= 1)
+        tracked.join('dir').join('my.txt').remove()
+        wait_for_condition(lambda: len(changes) >= 2)
+    finally:
+        watcher.dispose()
+        t.join()
+
+    with open(trace_path, 'rb') as stream:
+        contents = stream.read()
+    import gzip
+    contents = gzip.decompress(contents).decode('utf-8')
+    assert ('new.txt' in contents) != hash_names
+    assert '.git' in contents
+
+    result = replay_trace(trace_path)
+    assert result.scans[0].initial
+    assert len(result.scans) > 2
+    assert not result.mismatches
+    replayed = [change for scan in result.scans for change in scan.changes]
+    assert [change[0] for change in replayed] == [Change.added, Change.deleted]
+
+
+def test_fake_filesystem():
+    import threading
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=2, dirs_per_dir=5, files_per_dir=20)
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.target_time_for_single_scan = 0.1
+    watcher.target_time_for_notification = 0.1
+    initial_scan = watcher.set_tracked_paths('/fake')
+    assert initial_scan.files_found == 31 * 20
+    assert watcher.provider is fs
+
+    expected = fs.churn(50, seed=2)
+    assert set(change for change, _path in expected) == set([Change.added, Change.modified, Change.deleted])
+    changes = []
+
+    def start_watching():
+        for change in watcher.iter_changes():
+            changes.append(change)
+
+    t = threading.Thread(target=start_watching)
+    t.start()
+    try:
+        wait_for_condition(lambda: len(changes) >= len(expected))
+        assert sorted(changes) == expected
+    finally:
+        watcher.dispose()
+        t.join()
+
+
+def test_command_line(tmpdir):
+    import json
+    import subprocess
+    import sys
+
+    tmpdir.join('existing.py').write('foo')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'fsnotify', '--ext', '.py', '--target-scan-time', '0.1',
+         '--target-notification-time', '0.1', '--stats', '--stats-interval', '0.2',
+         str(tmpdir)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        # The initial scan is only done after the process started, so, wait for stats.
+        assert b'scans: ' in process.stderr.readline()
+        tmpdir.join('my.txt').write('foo')
+        path = tmpdir.join('my.py')
+        tmpdir.join('my.tmp').write('foo')
+        tmpdir.join('my.tmp').rename(path)
+
+        change = json.loads(process.stdout.readline().decode('utf-8'))
+        assert change['seq'] == 1
+        assert change['change'] == 'added'
+        assert change['path'] == str(path)
+        assert change['size'] == 3
+        assert change['mtime'] == pytest.approx(os.stat(str(path)).st_mtime)
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def test_metrics(tmpdir, watcher, changes):
+    try:
+        from urllib.request import urlopen
+    except ImportError:
+        from urllib2 import urlopen
+
+    path = tmpdir.join('my.txt')
+    path.write('foo')
+    wait_for_condition(lambda: len(changes) >= 1)
+    path.remove()
+    wait_for_condition(lambda: watcher.metrics.changes.get(change='deleted') == 1)
+
+    metrics = watcher.metrics
+    assert metrics.changes.get(change='added') == 1
+    assert metrics.scans.get() >= 2
+    assert metrics.scan_duration.count == metrics.scans.get()
+    assert metrics.tracked_roots.get() == 1
+
+    server = watcher.start_metrics_server()
+    host, port = server.server_address[:2]
+    contents = urlopen('http://%s:%s/metrics' % (host, port)).read().decode('utf-8')
+    assert '# TYPE fsnotify_scans_total counter' in contents
+    assert 'fsnotify_changes_total{change="deleted"} 1\n' in contents
+    assert 'fsnotify_scan_duration_seconds_bucket{le="+Inf"} ' in contents
+
+
+def test_slow_scan_report(tmpdir):
+    import time
+
+    big_dir = tmpdir.mkdir('big_dir')
+    for i in range(100):
+        big_dir.join('my_%s.txt' % (i,)).write('foo')
+    tmpdir.mkdir('small_dir').join('my.txt').write('foo')
+
+    def accept_file(path):
+        if 'big_dir' in path:
+            time.sleep(.001)
+        return True
+
+    watcher = fsnotify.Watcher(accept_file=accept_file)
+    watcher.slow_scan_threshold = 0.01
+    watcher.slow_scan_cprofile_dir = str(tmpdir)
+    watcher.target_time_for_single_scan = 0.
+    watcher.target_time_for_notification = 0.
+    watcher.set_tracked_paths(str(tmpdir))
+
+    assert watcher.last_slow_scan_report is None
+    it = watcher.iter_changes()
+    try:
+        # Note: deletions are only provided at the end of the scan.
+        big_dir.join('my_0.txt').remove()
+        next(it)
+        report = watcher.last_slow_scan_report
+        assert report is not None
+        assert report.top_dirs(1)[0].path == str(big_dir)
+        assert report.top_dirs(1)[0].entries == 99
+        assert report.top_subtrees(1)[0].path == str(tmpdir)
+        assert report.top_subtrees(1)[0].subtree_entries == 102
+        assert report.filters[0].name == 'accept_file'
+        assert report.filters[0].calls == 100
+        assert watcher.path_watchers[0].accept_file is accept_file
+        assert str(big_dir) in report.format()
+
+        # The next scan is done under cProfile.
+        big_dir.join('my_1.txt').remove()
+        next(it)
+        assert os.path.exists(report.cprofile_path)
+    finally:
+        watcher.dispose()
+
+
+def test_round_robin(tmpdir):
+    big_dir = tmpdir.mkdir('big_dir')
+    for i in range(50):
+        big_dir.mkdir('dir_%s' % (i,)).join('my.txt').write('foo')
+    small_dir = tmpdir.mkdir('small_dir')
+    nested_dir = big_dir.mkdir('nested')
+
+    watcher = fsnotify.Watcher()
+    watcher.round_robin_slice = 10
+    watcher.target_time_for_single_scan = 0.
+    watcher.target_time_for_notification = 0.
+    watcher.set_tracked_paths([str(big_dir), str(small_dir), str(nested_dir)])
+
+    for i in range(50):
+        big_dir.join('dir_%s' % (i,)).join('new.txt').write('foo')
+    small_dir.join('new.txt').write('foo')
+    nested_dir.join('new.txt').write('foo')
+
+    batches = []
+    for changes in watcher._iter_scan(watcher.initial_scan, fsnotify._ScanResult()):
+        batches.append(changes)
+
+    def batch_index(path):
+        for i, changes in enumerate(batches):
+            if (Change.added, str(path)) in changes:
+                return i
+
+    big_dir_indexes = [
+        batch_index(big_dir.join('dir_%s' % (i,)).join('new.txt')) for i in range(50)]
+    # The small dir is not delayed by the big dir.
+    assert batch_index(small_dir.join('new.txt')) < max(big_dir_indexes)
+    # The nested dir is scanned only once.
+    assert batch_index(nested_dir.join('new.txt')) is not None
+    all_changes = [change for changes in batches for change in changes]
+    assert len(all_changes) == 52
+    assert len(set(all_changes)) == 52
+
+    # The time spent by the consumer of the changes isn't counted as scan time.
+    import time
+    for i in range(50):
+        big_dir.join('dir_%s' % (i,)).join('new.txt').write('changed')
+    scan_result = fsnotify._ScanResult()
+    batches = 0
+    for _changes in watcher._iter_scan(watcher.initial_scan, scan_result):
+        batches += 1
+        time.sleep(.1)
+    assert batches > 1
+    assert scan_result.scan_time < .1
+    watcher.dispose()
+
+
+@pytest.mark.parametrize('round_robin_slice', [1000, 0])
+def test_round_robin_interrupted_scan(round_robin_slice):
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=3, files_per_dir=2000)
+    roots = ['/fake/dir_%04d' % (i,) for i in range(3)]
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.round_robin_slice = round_robin_slice
+    watcher.target_time_for_single_scan = 0.
+    watcher.set_tracked_paths(roots)
+
+    modified = [sorted(entry.path for entry in fs.scandir(root))[0] for root in roots]
+    for path in modified:
+        fs.modify_file(path)
+    fs.delete(sorted(entry.path for entry in fs.scandir(roots[2]))[1])
+
+    # Stop iterating in the middle of the scan.
+    for change in watcher.iter_changes():
+        break
+    assert change == (Change.modified, change[1])
+
+    # What wasn't checked is still compared in the next scan.
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert all(c != Change.added for c, _path in changes)
+    assert sorted(path for c, path in changes if c == Change.modified) == sorted(
+        path for path in modified if path != change[1])
+    assert len([c for c, _path in changes if c == Change.deleted]) == 1
+    watcher.dispose()
+
+
+def test_round_robin_overlapping_tracked_files():
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=5, files_per_dir=600)
+    tracked_files = [
+        sorted(entry.path for entry in fs.scandir('/fake/dir_%04d' % (i,)))[0]
+        for i in range(5)]
+
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.target_time_for_single_scan = 0.
+    watcher.set_tracked_paths(['/fake', fsnotify.TrackedFiles(tracked_files)])
+    assert watcher.initial_scan.files_found == 6 * 600
+
+    # Files found by both path watchers (in any order) are only reported once.
+    for _i in range(2):
+        changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+        assert changes == []
+
+    fs.modify_file(tracked_files[4])
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.modified, tracked_files[4])]
+    watcher.dispose()
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink') or os.name == 'nt', reason='Requires symlinks.')
+def test_overlapping_tracked_paths(tmpdir):
+    root = tmpdir.mkdir('root')
+    nested = root.mkdir('nested')
+    nested.mkdir('deep').join('my.txt').write('foo')
+    other = tmpdir.mkdir('other')
+    other.mkdir('deep').join('my.txt').write('foo')
+    os.symlink(str(root), str(tmpdir.join('link')))
+
+    watcher = fsnotify.Watcher()
+    watcher.set_tracked_paths([
+        fsnotify.TrackedPath(str(root), recursive=False),
+        str(nested) + os.sep,
+        str(tmpdir.join('link').join('nested')),
+        os.path.relpath(str(root)),
+        fsnotify.TrackedPath(str(other), recursive=False),
+    ])
+    path_watchers = sorted(watcher.path_watchers, key=lambda p: p._root_path)
+    assert [p._root_path for p in path_watchers] == [str(other), str(root)]
+    assert [p._recursive for p in path_watchers] == [False, True]
+    assert path_watchers[1].nested_roots == {str(nested): True}
+
+    watcher.set_tracked_paths([
+        fsnotify.TrackedPath(str(root), recursive=False),
+        str(nested),
+    ])
+    # The nested path is still recursive even if the root is not.
+    assert watcher.initial_scan.files_found == 1
+    assert watcher.initial_scan.dirs_scanned == 3
+    watcher.dispose()
+
+
+def test_shared_engine(tmpdir):
+    import threading
+    import time
+    from fsnotify.engine import SharedEngine
+
+    sub = tmpdir.mkdir('sub')
+    engine = SharedEngine()
+
+    def create_watcher(extension, path):
+        watcher = fsnotify.Watcher(engine=engine)
+        watcher.accepted_file_extensions = (extension,)
+        watcher.target_time_for_single_scan = 0.1
+        watcher.target_time_for_notification = 0.1
+        watcher.set_tracked_paths(path)
+        changes = []
+
+        def start_watching():
+            for change in watcher.iter_changes():
+                changes.append(change)
+
+        t = threading.Thread(target=start_watching)
+        t.daemon = True
+        t.start()
+        return watcher, changes
+
+    py_watcher, py_changes = create_watcher('.py', str(tmpdir))
+    txt_watcher, txt_changes = create_watcher('.txt', str(sub))
+    # A single path watcher scans both.
+    assert [p._root_path for p in engine.watcher.path_watchers] == [str(tmpdir)]
+
+    for path in [tmpdir.join('a.py'), tmpdir.join('a.txt'), sub.join('b.py'), sub.join('b.txt')]:
+        tmp = tmpdir.join('tmp')
+        tmp.write('foo')
+        tmp.rename(path)
+
+    wait_for_condition(lambda: len(py_changes) >= 2 and len(txt_changes) >= 1)
+    time.sleep(.3)
+    assert sorted(py_changes) == [
+        (Change.added, str(tmpdir.join('a.py'))),
+        (Change.added, str(sub.join('b.py'))),
+    ]
+    assert txt_changes == [(Change.added, str(sub.join('b.txt')))]
+    del py_changes[:]
+
+    # The other watchers keep receiving their changes after a watcher is disposed.
+    txt_watcher.dispose()
+    tmpdir.join('a.py').remove()
+    wait_for_condition(lambda: len(py_changes) >= 1)
+    assert py_changes == [(Change.deleted, str(tmpdir.join('a.py')))]
+
+    py_watcher.dispose()
+    engine.dispose()
+
+
+def test_shared_engine_filters_scope():
+    from fsnotify.engine import SharedEngine
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=2, files_per_dir=5)
+    fs.add_dir('/fake/dir_0000/node_modules')
+    fs.add_file('/fake/dir_0000/node_modules/ignored.js')
+    engine = SharedEngine(provider=fs)
+
+    project_watcher = fsnotify.Watcher(engine=engine)
+    project_watcher.set_tracked_paths('/fake/dir_0000')
+    # A watcher accepting everything in some other tree doesn't affect the filters used
+    # for the tree of the first watcher.
+    other_watcher = fsnotify.Watcher(accept_directory=lambda path: True, engine=engine)
+    other_watcher.set_tracked_paths('/fake/dir_0001')
+
+    engine_files = engine.watcher._single_visit_info.file_to_mtime
+    assert len(engine_files) == 10
+    assert '/fake/dir_0000/node_modules/ignored.js' not in engine_files
+
+    project_watcher.dispose()
+    other_watcher.dispose()
+    engine.dispose()
+
+
+def test_shared_engine_filter_error():
+    from fsnotify.engine import SharedEngine
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=2, files_per_dir=5)
+    engine = SharedEngine(provider=fs)
+
+    def accept_file(path):
+        raise ValueError('Error in filter')
+
+    watcher = fsnotify.Watcher(engine=engine)
+    watcher.target_time_for_single_scan = 0.
+    watcher.target_time_for_notification = 0.
+    watcher.set_tracked_paths('/fake/dir_0000')
+
+    # The error is raised in the thread which registers the faulty watcher.
+    faulty_watcher = fsnotify.Watcher(accept_file=accept_file, engine=engine)
+    with pytest.raises(ValueError):
+        faulty_watcher.set_tracked_paths('/fake/dir_0001')
+
+    # With a background initial scan it's raised when iterating the changes.
+    faulty_watcher = fsnotify.Watcher(accept_file=accept_file, engine=engine)
+    faulty_watcher.background_initial_scan = True
+    faulty_watcher.set_tracked_paths('/fake/dir_0001')
+    with pytest.raises(ValueError):
+        for _change in faulty_watcher.iter_changes():
+            pass
+
+    # The engine keeps on scanning for the other watchers.
+    path = sorted(entry.path for entry in fs.scandir('/fake/dir_0000'))[0]
+    fs.modify_file(path)
+    for change in watcher.iter_changes():
+        assert change == (Change.modified, path)
+        break
+    wait_for_condition(lambda: len(engine._registrations) == 1)
+    assert engine._thread is not None
+
+    watcher.dispose()
+    engine.dispose()
+
+
+def test_changes_since(tmpdir):
+    from fsnotify.changelog import ChangeLog
+
+    change_log = ChangeLog(3)
+    change_log.append(['a', 'b'])
+    result = change_log.changes_since(0)
+    assert (result.changes, result.last_seq, result.expired) == (['a', 'b'], 2, False)
+    change_log.append(['c', 'd'])
+    assert change_log.changes_since(0).expired
+    assert change_log.changes_since(1).changes == ['b', 'c', 'd']
+    assert change_log.changes_since(4).changes == []
+    assert change_log.changes_since(5).expired
+    change_log.expire_cursors()
+    assert change_log.changes_since(4).expired
+    assert not change_log.changes_since(change_log.last_seq).expired
+
+    watcher = fsnotify.Watcher()
+    watcher.target_time_for_single_scan = 0.1
+    watcher.target_time_for_notification = 0.1
+    watcher.set_tracked_paths(str(tmpdir))
+    watcher.start_background_scan()
+    cursor = watcher.changes_since(0).last_seq
+
+    tmp = tmpdir.join('tmp.txt')
+    tmp.write('foo')
+    tmp.rename(tmpdir.join('my.txt'))
+    wait_for_condition(lambda: watcher.changes_since(cursor).changes)
+    result = watcher.changes_since(cursor)
+    assert result.changes == [(Change.added, str(tmpdir.join('my.txt')))]
+    assert not watcher.changes_since(result.last_seq).changes
+
+    watcher.set_tracked_paths(str(tmpdir))
+    assert watcher.changes_since(result.last_seq).expired
+    watcher.dispose()
+
+
+def test_max_snapshot_entries():
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=4, files_per_dir=10)
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.max_snapshot_entries = 30
+    watcher.set_tracked_paths('/fake')
+
+    # 50 files: the coldest directories are collapsed until it's below 80% of the limit.
+    visit_info = watcher._single_visit_info
+    assert sorted(visit_info.dir_to_fingerprint) == ['/fake', '/fake/dir_0000', '/fake/dir_0001']
+    assert len(visit_info.file_to_mtime) == 20
+
+    hot_file = fs.scandir('/fake/dir_0003')[-1].path
+    fs.modify_file(hot_file)
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.modified, hot_file)]
+
+    # Changes in a collapsed directory expand it.
+    collapsed_file = fs.scandir('/fake/dir_0000')[-1].path
+    fs.modify_file(collapsed_file)
+    fs.delete(hot_file)
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert sorted(changes) == [(Change.modified, collapsed_file), (Change.deleted, hot_file)]
+    assert watcher.metrics.expanded_dirs.get() == 1
+
+    # The limit was exceeded again: the coldest directory is collapsed.
+    visit_info = watcher._single_visit_info
+    assert sorted(visit_info.dir_to_fingerprint) == ['/fake', '/fake/dir_0001', '/fake/dir_0002']
+    assert collapsed_file in visit_info.file_to_mtime
+
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == []
+
+
+def test_publish_snapshot(tmpdir, monkeypatch):
+    pytest.importorskip('multiprocessing.shared_memory')
+    from fsnotify.sharedsnapshot import SnapshotReader
+
+    for i in range(3):
+        tmpdir.join('my_%s.txt' % (i,)).write('a' * i)
+    watcher = fsnotify.Watcher()
+    watcher.set_tracked_paths(str(tmpdir))
+    publisher = watcher.publish_snapshot()
+    reader = SnapshotReader(publisher.name)
+    try:
+        assert len(reader) == 3
+        assert reader.get(str(tmpdir.join('my_2.txt')))[1] == 2
+        assert reader.get(str(tmpdir.join('not_there.txt'))) is None
+        generation = reader.generation
+
+        tmpdir.join('my_0.txt').remove()
+        tmpdir.join('new.txt').write('foo')
+        watcher._scan_once(watcher.initial_scan)
+        assert reader.generation > generation
+        assert [path for path, _mtime in reader.items()] == [
+            str(tmpdir.join(name)) for name in ['my_1.txt', 'my_2.txt', 'new.txt']]
+        assert str(tmpdir.join('new.txt')) in reader
+
+        # A segment replaced while the reader attaches to it is retried.
+        from fsnotify import sharedsnapshot
+        attach = sharedsnapshot._attach
+
+        def attach_while_publishing(name):
+            monkeypatch.setattr(sharedsnapshot, '_attach', attach)
+            tmpdir.join('other.txt').write('foo')
+            watcher._scan_once(watcher.initial_scan)
+            raise OSError('Segment removed: %s' % (name,))
+
+        tmpdir.join('my_1.txt').remove()
+        watcher._scan_once(watcher.initial_scan)
+        monkeypatch.setattr(sharedsnapshot, '_attach', attach_while_publishing)
+        assert len(reader) == 3
+        assert str(tmpdir.join('other.txt')) in reader
+    finally:
+        reader.close()
+        watcher.dispose()
+
+
+def test_iter_change_batches():
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=2, files_per_dir=20)
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.rich_change_events = True
+    watcher.round_robin_slice = 0
+    watcher.target_time_for_notification = 0.1
+    watcher.set_tracked_paths('/fake')
+    cursor = watcher.changes_since(0).last_seq
+    expected = fs.churn(30, seed=2)
+
+    batches = []
+    for batch in watcher.iter_change_batches(max_batch_size=5):
+        batches.append(batch)
+        if sum(len(b) for b in batches) >= len(expected):
+            break
+    watcher.dispose()
+
+    assert all(len(batch) <= 5 for batch in batches)
+    assert sorted(change for batch in batches for change in batch) == expected
+    for batch in batches:
+        for code, path, mtime_ns, size, old_size in zip(
+                batch.changes, batch.paths, batch.mtime_ns, batch.size, batch.old_size):
+            if code == Change.deleted:
+                assert (mtime_ns, size) == (-1, -1)
+            else:
+                assert fs.stat(path).st_mtime_ns == mtime_ns
+            assert (old_size == -1) == (code == Change.added)
+
+    # The changes log has the same changes provided by `iter_changes()`.
+    logged = watcher.changes_since(cursor).changes
+    assert all(isinstance(change, fsnotify.ChangeEvent) for change in logged)
+    assert logged == [change for batch in batches for change in batch.to_changes()]
+    assert sorted(tuple(change) for change in logged) == expected
+
+
+@pytest.mark.skipif(not hasattr(os, 'fsencode'), reason='Requires Python 3.')
+def test_bytes_paths(tmpdir):
+    watcher = fsnotify.Watcher()
+    watcher.accepted_file_extensions = ('.txt',)
+    tmpdir.mkdir('.git').join('ignored.txt').write('foo')
+    tmpdir.join('my.txt').write('foo')
+
+    # Without `bytes_paths`, bytes tracked paths are decoded.
+    watcher.set_tracked_paths(os.fsencode(str(tmpdir)))
+    assert set(watcher._single_visit_info.file_to_mtime) == set([str(tmpdir.join('my.txt'))])
+
+    watcher.bytes_paths = True
+    watcher.set_tracked_paths(fsnotify.TrackedPath(str(tmpdir), recursive=True))
+    assert set(watcher._single_visit_info.file_to_mtime) == set([os.fsencode(str(tmpdir.join('my.txt')))])
+
+    # Names which can't be decoded are kept (the change is reported with surrogate escapes).
+    undecodable = os.path.join(os.fsencode(str(tmpdir)), b'undecodable_\xff.txt')
+    try:
+        with open(undecodable, 'wb') as stream:
+            stream.write(b'foo')
+    except (OSError, UnicodeError):
+        pytest.skip('Filesystem does not accept undecodable names.')
+    tmpdir.join('my.py').write('foo')
+    tmpdir.join('my.txt').remove()
+
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert sorted(changes) == [
+        (Change.added, os.fsdecode(undecodable)),
+        (Change.deleted, str(tmpdir.join('my.txt'))),
+    ]
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink') or os.name == 'nt', reason='Requires symlinks.')
+def test_follow_symlinks(tmpdir):
+    from fsnotify import FollowSymlinks
+
+    root = tmpdir.mkdir('root')
+    root.mkdir('real').join('my.txt').write('foo')
+    os.symlink(str(root), str(root.join('real').join('loop')))
+    os.symlink(str(root.join('real')), str(root.join('link_inside')))
+    outside = tmpdir.mkdir('outside')
+    outside.join('outside.txt').write('foo')
+    os.symlink(str(outside), str(root.join('link_outside')))
+
+    def files_found(follow_symlinks):
+        watcher = fsnotify.Watcher()
+        watcher.follow_symlinks = follow_symlinks
+        watcher.max_recursion_level = 30
+        watcher.set_tracked_paths(str(root))
+        files = sorted(os.path.basename(path) for path in watcher._single_visit_info.file_to_mtime)
+        watcher.dispose()
+        return files
+
+    # Each directory is scanned only once (even with loops and different paths to it).
+    assert files_found(FollowSymlinks.always) == ['my.txt', 'outside.txt']
+    assert files_found(FollowSymlinks.within_roots) == ['my.txt']
+    assert files_found(FollowSymlinks.never) == ['my.txt']
+
+    # Directories which aren't symlinks are identified based on the listing (not stat'ed).
+    plain = root.mkdir('plain')
+    plain.mkdir('nested')
+    stat_calls = []
+
+    def counting_stat(path):
+        stat_calls.append(path)
+        return os.stat(path)
+
+    provider = fsnotify.ScandirProvider()
+    provider.stat = counting_stat
+    watcher = fsnotify.Watcher(provider=provider)
+    watcher.set_tracked_paths(str(root))
+    del stat_calls[:]
+    watcher._scan_once(watcher.initial_scan)
+    assert stat_calls
+    assert str(plain) not in stat_calls
+    assert str(plain.join('nested')) not in stat_calls
+    watcher.dispose()
+
+    # Subclasses of the provider may provide entries without `inode()`.
+    class _Entry(object):
+
+        def __init__(self, entry):
+            self.name = entry.name
+            self.path = entry.path
+            self.is_dir = entry.is_dir
+            self.is_symlink = entry.is_symlink
+            self.stat = entry.stat
+
+    class WrappingProvider(fsnotify.ScandirProvider):
+
+        def scandir(self, dir_path):
+            return [_Entry(entry) for entry in fsnotify.ScandirProvider.scandir(self, dir_path)]
+
+    watcher = fsnotify.Watcher(provider=WrappingProvider())
+    watcher.follow_symlinks = FollowSymlinks.always
+    watcher.max_recursion_level = 30
+    watcher.set_tracked_paths(str(root))
+    assert sorted(os.path.basename(path) for path in watcher._single_visit_info.file_to_mtime) == [
+        'my.txt', 'outside.txt']
+    watcher.dispose()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='Mount table only available on Linux.')
+def test_mounts(tmpdir, monkeypatch):
+    from fsnotify import FilesystemPolicy, ScandirProvider, mounts
+
+    root = tmpdir.mkdir('root')
+    root.join('my.txt').write('foo')
+    for name in ('nfs', 'sshfs', 'other_dev'):
+        root.mkdir(name).join('%s.txt' % (name,)).write('foo')
+
+    real_root = os.path.realpath(str(root))
+    mountinfo = '\n'.join([
+        '22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw',
+        '40 22 0:50 / %s/nfs rw,relatime shared:2 - nfs4 server:/export rw' % (real_root,),
+        '41 22 0:51 / %s/sshfs rw,relatime - fuse.sshfs user@host: rw' % (real_root,),
+    ])
+    parsed = mounts.parse_mountinfo(mountinfo)
+    assert [(m.mount_point, m.fs_type) for m in parsed][1:] == [
+        (real_root + '/nfs', 'nfs4'), (real_root + '/sshfs', 'fuse.sshfs')]
+    monkeypatch.setattr(mounts, 'read_mountinfo', lambda: parsed)
+
+    class Provider(ScandirProvider):
+
+        def stat(self, path):
+            stat = os.stat(path)
+            if os.path.basename(path) == 'other_dev':
+                return os.stat_result(stat[:2] + (stat.st_dev + 1,) + stat[3:])
+            return stat
+
+    watcher = fsnotify.Watcher(provider=Provider())
+    watcher.one_filesystem = True
+    watcher.filesystem_policies = {
+        'nfs4': FilesystemPolicy(scan_interval=60.),
+        'fuse': FilesystemPolicy(exclude=True),
+    }
+    watcher.set_tracked_paths(str(root))
+    assert sorted(os.path.basename(path) for path in watcher._single_visit_info.file_to_mtime) == [
+        'my.txt', 'nfs.txt']
+
+    # The nfs mount is only scanned again when its scan interval elapses.
+    root.join('nfs').join('new.txt').write('foo')
+    root.join('new.txt').write('foo')
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.added, str(root.join('new.txt')))]
+    assert str(root.join('nfs').join('nfs.txt')) in watcher._single_visit_info.file_to_mtime
+
+    for path_watcher in watcher.path_watchers:
+        path_watcher._last_check_time = None
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.added, str(root.join('nfs').join('new.txt')))]
+    watcher.dispose()
+
+
+def test_idle_backoff(tmpdir):
+    import threading
+    import time
+
+    watcher = fsnotify.Watcher()
+    watcher.target_time_for_notification = 0.5
+    watcher.idle_backoff_max_time = 3.
+    assert [watcher._get_notification_time([]) for _ in range(4)] == [1., 2., 3., 3.]
+    assert watcher._get_notification_time([(Change.added, 'my.txt')]) == .5
+    assert watcher._get_notification_time([]) == 1.
+
+    # A hint restores the time between scans and starts the next scan right away.
+    watcher._get_notification_time([])
+    watcher.idle_backoff_max_time = 60.
+    watcher.set_tracked_paths(str(tmpdir))
+    changes = []
+
+    def start_watching():
+        for change in watcher.iter_changes():
+            changes.append(change)
+
+    t = threading.Thread(target=start_watching)
+    t.daemon = True
+    t.start()
+    time.sleep(.3)
+    assert watcher.metrics.notification_time.get() == 4.
+
+    tmpdir.join('my.txt').write('foo')
+    watcher.wakeup()
+    timeout_at = time.time() + 5
+    while not changes and time.time() < timeout_at:
+        time.sleep(.05)
+    assert changes == [(Change.added, str(tmpdir.join('my.txt')))]
+    watcher.dispose()
+    t.join(5)
+
+
+def test_log_file_patterns(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('line 1\n')
+    tmpdir.join('my.txt').write('foo')
+    watcher = fsnotify.Watcher()
+    watcher.rich_change_events = True
+    watcher.log_file_patterns = ('*.log',)
+    watcher.set_tracked_paths(str(tmpdir))
+
+    def scan():
+        changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+        return sorted((change.change, os.path.basename(change.path), change.old_size, change.size)
+                      for change in changes)
+
+    log.write('line 2\n', mode='a')
+    tmpdir.join('my.txt').write('foo bar')
+    assert scan() == [(Change.modified, 'my.txt', 3, 7), (Change.appended, 'app.log', 7, 14)]
+
+    log.write('')
+    assert scan() == [(Change.truncated, 'app.log', 14, 0)]
+
+    # Rotation: the log is moved away and a new one is created.
+    log.write('line 3\n')
+    scan()
+    log.rename(tmpdir.join('app.log.1'))
+    log.write('line 1\n line 2\n')
+    assert scan() == [(Change.added, 'app.log.1', None, 7), (Change.rotated, 'app.log', 7, 15)]
+    watcher.dispose()
+
+
+def test_record_replay_log_files(tmpdir):
+    import io
+    from fsnotify.trace import replay_trace
+
+    log = tmpdir.join('app.log')
+    log.write('line 1\n')
+    tmpdir.join('my.txt').write('foo')
+    watcher = fsnotify.Watcher()
+    watcher.log_file_patterns = ('*.log',)
+    stream = io.StringIO()
+    watcher.start_recording(stream)
+    watcher.set_tracked_paths(str(tmpdir))
+
+    log.write('line 2\n', mode='a')
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.appended, str(log))]
+    log.write('')
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.truncated, str(log))]
+    watcher.stop_recording()
+    watcher.dispose()
+
+    # The stats done through the provider (for the log files) are replayed.
+    stream.seek(0)
+    replay_watcher = fsnotify.Watcher()
+    replay_watcher.log_file_patterns = ('*.log',)
+    result = replay_trace(stream, watcher=replay_watcher)
+    assert [scan.changes for scan in result.scans] == [
+        [], [(Change.appended, str(log))], [(Change.truncated, str(log))]]
+    assert not result.mismatches
+    replay_watcher.dispose()
+
+
+def test_many_roots():
+    # Benchmark: 5000 small tracked paths (timings are printed with `pytest -s`).
+    import time
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=1, dirs_per_dir=5000, files_per_dir=2)
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.target_time_for_single_scan = 0.01
+    watcher.target_time_for_notification = 0.
+    roots = [fsnotify.TrackedPath('/fake/dir_%04d' % (i,), True) for i in range(5000)]
+
+    initial_time = time.time()
+    watcher.set_tracked_paths(roots)
+    print('set_tracked_paths: %.3fs' % (time.time() - initial_time,))
+    assert len(watcher.path_watchers) == 5000
+    assert len(set(id(path_watcher.throttle) for path_watcher in watcher.path_watchers)) == 1
+
+    expected = [(Change.modified, fs.scandir('/fake/dir_%04d' % (i,))[0].path) for i in (0, 4999)]
+    for _change, path in expected:
+        fs.modify_file(path)
+
+    # With throttling enabled, the time between scans doesn't depend on the number of
+    # tracked paths.
+    for i in range(3):
+        initial_time = time.time()
+        changes = [change for changes in watcher._iter_scan_cycle() for change in changes]
+        print('scan cycle: %.3fs' % (time.time() - initial_time,))
+        assert sorted(changes) == (expected if i == 0 else [])
+    assert watcher.metrics.notification_wait.get() < 1.
+    watcher.dispose()
+
+
+@pytest.mark.parametrize('index_version', [2, 3, 4])
+def test_git_index_warm_start(tmpdir, index_version):
+    import subprocess
+    import time
+
+    def git(*args):
+        try:
+            subprocess.check_call(('git',) + args, cwd=str(tmpdir))
+        except OSError:
+            pytest.skip('git is not available.')
+
+    git('init', '-q')
+    old_time = int(time.time()) - 3600
+    for path in (tmpdir.join('a.txt'), tmpdir.mkdir('sub').join('b.txt')):
+        path.write('foo')
+        os.utime(str(path), (old_time, old_time))
+    git('add', 'a.txt', 'sub/b.txt')
+    git('update-index', '--index-version', str(index_version))
+    tmpdir.join('untracked.txt').write('foo')
+
+    # Changed after the index was refreshed: the index has outdated information.
+    os.utime(str(tmpdir.join('a.txt')), (old_time + 10, old_time + 10))
+
+    watcher = fsnotify.Watcher()
+    watcher.git_index_warm_start = True
+    watcher.set_tracked_paths(str(tmpdir))
+    file_to_mtime = watcher._single_visit_info.file_to_mtime
+    assert sorted(os.path.basename(path) for path in file_to_mtime) == [
+        'a.txt', 'b.txt', 'untracked.txt']
+    assert file_to_mtime[str(tmpdir.join('a.txt'))] == (old_time * 10 ** 9, 3)  # From the index.
+    b_stat = os.stat(str(tmpdir.join('sub', 'b.txt')))
+    assert file_to_mtime[str(tmpdir.join('sub', 'b.txt'))] == (b_stat.st_mtime_ns, b_stat.st_size)
+
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == [(Change.modified, str(tmpdir.join('a.txt')))]
+    watcher.dispose()
+
+
+def test_git_index_warm_start_big_files(tmpdir):
+    big = tmpdir.join('big.bin')
+    try:
+        with open(str(big), 'wb') as stream:
+            stream.truncate(2 ** 32 + 3)  # Sparse file.
+    except (IOError, OSError, OverflowError):
+        pytest.skip('Unable to create a file with 4 GiB.')
+    big_stat = os.stat(str(big))
+
+    # The git index has the size truncated to 32 bits.
+    watcher = fsnotify.Watcher()
+    watcher.git_index_warm_start = True
+    watcher._read_git_index_seed = lambda path_watchers: {str(big): (big_stat.st_mtime_ns, 3)}
+    watcher.set_tracked_paths(str(tmpdir))
+    assert watcher._single_visit_info.file_to_mtime[str(big)] == (big_stat.st_mtime_ns, 3)
+
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == []
+    assert watcher._single_visit_info.file_to_mtime[str(big)] == (
+        big_stat.st_mtime_ns, 2 ** 32 + 3)
+    watcher.dispose()
+
+
+def test_estimate_cost():
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=2, dirs_per_dir=10, files_per_dir=20)
+    for i in range(300):
+        fs.add_file('/fake/dir_0003/extra_%s.txt' % (i,))
+    watcher = fsnotify.Watcher(provider=fs)
+
+    # 111 directories with 20 files each (plus 300 files in dir_0003).
+    estimate = watcher.estimate_cost('/fake', max_time=10.)
+    assert estimate.exact
+    assert (estimate.entries, estimate.dirs, estimate.files) == (110 + 111 * 20 + 300, 111, 111 * 20 + 300)
+    assert estimate.largest_subtrees[0] == ('/fake/dir_0003', 10 + 11 * 20 + 300)
+    assert estimate.scan_time > 0
+
+    # Without time to walk, the subtrees are estimated with probes (note: without time
+    # to probe, a single probe is done and the other subtrees are extrapolated from it).
+    estimate = watcher.estimate_cost('/fake', max_time=0., seed=1)
+    assert not estimate.exact
+    assert (estimate.entries, estimate.dirs) == (110 + 111 * 20, 111)
+
+    # The time is respected even when there are many subtrees to probe (as the subtrees
+    # are uniform, the estimate is exact in this case).
+    import time
+    big_fs = FakeFilesystem('/big', seed=1, depth=4, dirs_per_dir=12, files_per_dir=20)
+    initial_time = time.time()
+    estimate = fsnotify.Watcher(provider=big_fs).estimate_cost('/big', max_time=.1, seed=1)
+    assert time.time() - initial_time < .5
+    assert not estimate.exact
+    assert estimate.dirs == 1 + 12 + 12 ** 2 + 12 ** 3 + 12 ** 4
+
+    # The filters are used (note: 'dir_0003' is also ignored inside the other dirs).
+    watcher.ignored_dirs = set(['dir_0003'])
+    estimate = watcher.estimate_cost([fsnotify.TrackedPath('/fake', True)], max_time=10.)
+    assert estimate.dirs == 1 + 9 + 9 * 9
+    assert [path for path, _entries in estimate.largest_subtrees] == [
+        '/fake/dir_%04d' % (i,) for i in range(10) if i != 3]
+
+
+def test_cache_dir_listings():
+    from fsnotify.fakefs import FakeFilesystem
+
+    fs = FakeFilesystem('/fake', seed=1, depth=2, dirs_per_dir=3, files_per_dir=10)
+    watcher = fsnotify.Watcher(provider=fs)
+    watcher.cache_dir_listings = True
+    watcher.accepted_file_extensions = ('.py',)
+    watcher.set_tracked_paths('/fake')
+    initial_files = dict(watcher._single_visit_info.file_to_mtime)
+
+    # Unchanged directories aren't listed again.
+    scandir_count = fs.scandir_count
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes == []
+    assert fs.scandir_count == scandir_count
+    assert watcher._single_visit_info.file_to_mtime == initial_files
+
+    # Only the changed directories are listed.
+    fs.modify_file(sorted(initial_files)[0])
+    fs.add_file('/fake/dir_0001/new.py')
+    fs.add_file('/fake/dir_0001/new.txt')
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert sorted(changes) == [
+        (Change.added, '/fake/dir_0001/new.py'), (Change.modified, sorted(initial_files)[0])]
+    assert fs.scandir_count == scandir_count + 1
+
+    expected = [change for change in fs.churn(30, seed=2) if change[1].endswith('.py')]
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert sorted(changes) == expected
+
+    # Listings aren't cached while recording (so that the trace may be replayed).
+    import io
+    from fsnotify.trace import replay_trace
+    stream = io.StringIO()
+    watcher.start_recording(stream)
+    watcher.set_tracked_paths('/fake')
+    fs.churn(30, seed=3)
+    watcher._scan_once(watcher.initial_scan)
+    watcher.stop_recording()
+    stream.seek(0)
+    replay_watcher = fsnotify.Watcher()
+    replay_watcher.accepted_file_extensions = ('.py',)
+    result = replay_trace(stream, watcher=replay_watcher)
+    assert len(result.scans) == 2
+    assert result.scans[1].changes
+    assert not result.mismatches
+
+    # The cache is cleared when the filters change.
+    watcher.set_tracked_paths('/fake')
+    watcher.accept_file = lambda path: path.endswith('.py') and 'dir_0001' not in path
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes
+    assert all(change == Change.deleted and 'dir_0001' in path for change, path in changes)
+
+    watcher.ignored_dirs = set(['dir_0002'])
+    changes, _path_watchers = watcher._scan_once(watcher.initial_scan)
+    assert changes
+    assert all(change == Change.deleted and 'dir_0002' in path for change, path in changes)
+    watcher.dispose()
+
+
 def gen_structure(basedir):
     dirs_created = 0
     files_created = 0